@@ -0,0 +1,127 @@
+"""
+Benchmark comparing the JSON backends available to src.codec, on a GetProfile response and on
+manifest item definition rows.
+
+Recorded payloads can be given on the command line: the first argument is a file containing a
+saved GetProfile response, and the second is a manifest sqlite database (e.g. manifest.content). If
+they are not given, synthetic payloads of a similar shape and size are generated.
+
+Run from the root of the repository with: python -m benchmarks.codec_benchmark [profile] [manifest]
+"""
+
+import json
+import random
+import sqlite3
+import sys
+import timeit
+
+from src import codec
+
+
+def synthetic_profile(num_items=2000, seed=0):
+    """
+    Generate a GetProfile response with the given number of items spread over the vault and three
+    characters
+    """
+    rng = random.Random(seed)
+
+    def item():
+        return {
+            'itemHash': rng.getrandbits(32),
+            'itemInstanceId': str(rng.getrandbits(63)),
+            'quantity': 1,
+            'bindStatus': 0,
+            'location': rng.choice([1, 2]),
+            'bucketHash': rng.choice([1498876634, 2465295065, 953998645, 138197802]),
+            'transferStatus': 0,
+            'lockable': True,
+            'state': rng.getrandbits(3),
+            'dismantlePermission': 0,
+            'isWrapper': False,
+            'tooltipNotificationIndexes': [],
+            'versionNumber': rng.randint(0, 5)
+        }
+
+    per_owner = num_items // 4
+    characters = {str(rng.getrandbits(63)): {'items': [item() for _ in range(per_owner)]}
+                  for _ in range(3)}
+    return json.dumps({
+        'Response': {
+            'profileInventory': {'data': {'items': [item() for _ in range(per_owner)]},
+                                 'privacy': 1},
+            'characterInventories': {'data': characters, 'privacy': 1}
+        },
+        'ErrorCode': 1,
+        'ThrottleSeconds': 0,
+        'ErrorStatus': 'Success',
+        'Message': 'Ok',
+        'MessageData': {}
+    }).encode()
+
+
+def synthetic_manifest_rows(num_rows=2000, seed=0):
+    """
+    Generate item definition rows, as stored in the manifest database
+    """
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(num_rows):
+        rows.append(json.dumps({
+            'hash': rng.getrandbits(32),
+            'displayProperties': {
+                'name': 'Weapon {}'.format(rng.getrandbits(16)),
+                'description': 'x' * rng.randint(50, 300),
+                'icon': '/common/destiny2_content/icons/{:032x}.jpg'.format(rng.getrandbits(128)),
+                'hasIcon': True
+            },
+            'itemType': 3,
+            'itemSubType': rng.choice([6, 7, 9, 13, 14]),
+            'inventory': {'bucketTypeHash': 1498876634, 'tierType': rng.choice([5, 6]),
+                          'maxStackSize': 1, 'tierTypeName': 'Legendary'},
+            'stats': {'stats': {str(rng.getrandbits(32)): {'statHash': rng.getrandbits(32),
+                                                           'value': rng.randint(0, 100),
+                                                           'minimum': 0, 'maximum': 100}
+                                for _ in range(12)}},
+            'sockets': {'socketEntries': [{'socketTypeHash': rng.getrandbits(32),
+                                           'singleInitialItemHash': rng.getrandbits(32),
+                                           'reusablePlugItems': []}
+                                          for _ in range(8)]}
+        }))
+    return rows
+
+
+def manifest_rows_from_db(path, limit=5000):
+    """
+    Load item definition rows from a manifest sqlite database
+    """
+    connection = sqlite3.connect(path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT json from DestinyInventoryItemDefinition LIMIT ?', (limit,))
+        return [x[0] for x in cursor]
+    finally:
+        connection.close()
+
+
+def main(argv):
+    if len(argv) > 0:
+        with open(argv[0], 'rb') as f:
+            profile = f.read()
+    else:
+        profile = synthetic_profile()
+    rows = manifest_rows_from_db(argv[1]) if len(argv) > 1 else synthetic_manifest_rows()
+
+    print('Selected backend: {}'.format(codec.BACKEND))
+    print('Profile payload: {} bytes. Manifest rows: {} ({} bytes)'.format(
+        len(profile), len(rows), sum(len(x) for x in rows)))
+
+    for name, loads in codec.get_backends().items():
+        number = 20
+        profile_time = timeit.timeit(lambda: loads(profile), number=number) / number
+        rows_time = timeit.timeit(lambda: [loads(x) for x in rows], number=number) / number
+        print('{:8} profile: {:8.2f} ms   manifest rows: {:8.2f} ms'.format(
+            name, profile_time * 1000, rows_time * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
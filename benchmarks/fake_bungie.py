@@ -0,0 +1,341 @@
+"""
+In-memory stand-in for the Bungie API, for benchmarks that exercise the bot end to end. FakeAPI has
+the same interface as src.api.API (make_get_call, make_post_call, membership_type, membership_id
+and manifest), and serves a synthetic account whose inventory changes as items are transferred and
+equipped. Every call can be delayed by a fixed latency, and calls are counted by endpoint.
+
+FakeManifest generates the definitions, and can write them to a database laid out like the real
+manifest database, so that src.manifest.Manifest can load them. Accounts and manifests of any size
+can be generated, and scaled_sizes gives the sizes for a multiple of a real account
+"""
+
+from collections import Counter
+import json
+import random
+import sqlite3
+from threading import Lock
+import time
+
+from src.enums import TierType, WeaponSubType, WeaponType
+
+
+VAULT_BUCKET_HASH = 138197802
+
+# Subtypes that can appear in each slot
+SUB_TYPES = {
+    WeaponType.KINETIC: [WeaponSubType.AUTO_RIFLE, WeaponSubType.HAND_CANNON,
+                         WeaponSubType.PULSE_RIFLE, WeaponSubType.SCOUT_RIFLE,
+                         WeaponSubType.SIDEARM, WeaponSubType.SUBMACHINE_GUN, WeaponSubType.BOW],
+    WeaponType.ENERGY: [WeaponSubType.AUTO_RIFLE, WeaponSubType.HAND_CANNON,
+                        WeaponSubType.PULSE_RIFLE, WeaponSubType.SHOTGUN,
+                        WeaponSubType.SNIPER_RIFLE, WeaponSubType.FUSION_RIFLE],
+    WeaponType.POWER: [WeaponSubType.ROCKET_LAUNCHER, WeaponSubType.SWORD,
+                       WeaponSubType.MACHINE_GUN, WeaponSubType.LINEAR_FUSION_RIFLE,
+                       WeaponSubType.GRENADE_LAUNCHER],
+}
+
+# Item types, buckets and tiers of definitions other than weapons, like armor and mods
+OTHER_ITEM_TYPES = [2, 9, 19]
+OTHER_BUCKET_HASHES = [3448274439, 3551918588, 14239492, 20886954, 1585787867, 3313201758]
+OTHER_TIER_TYPES = [TierType.BASIC, TierType.COMMON, TierType.RARE, TierType.SUPERIOR]
+
+# Sizes at a scale of 1, which are roughly those of a real account: a full vault's worth of weapons
+# spread over the vault and three characters, and as many definitions as the item table has in a
+# recent manifest, of which about one in ten is a weapon
+SCALE_WEAPONS = 500
+SCALE_WEAPON_DEFINITIONS = 2500
+SCALE_OTHER_DEFINITIONS = 22500
+
+NAME_WORDS = ['Jade', 'Rabbit', 'Mini', 'Tool', 'Cold', 'Front', 'Last', 'Word', 'Ace', 'Spades',
+              'Better', 'Devils', 'Gnawing', 'Hunger', 'Loaded', 'Question', 'Midnight', 'Coup',
+              'Falling', 'Guillotine', 'Night', 'Watch', 'Austringer', 'Dire', 'Promise']
+
+# Number of distinct names made of one to three of the words above
+NAME_COMBINATIONS = sum(len(NAME_WORDS) ** k for k in range(1, 4))
+
+
+def scaled_sizes(scale):
+    """
+    Returns the number of weapons, weapon definitions and other definitions for an account and
+    manifest scale times the size of real ones
+    """
+    return (int(SCALE_WEAPONS * scale), int(SCALE_WEAPON_DEFINITIONS * scale),
+            int(SCALE_OTHER_DEFINITIONS * scale))
+
+
+class FakeManifest:
+    """
+    Manifest with synthetic weapon definitions, and optionally definitions of other items. Once the
+    number of definitions gets close to the number of names that can be made from NAME_WORDS, names
+    are numbered to keep them distinct
+    """
+
+    def __init__(self, num_definitions=400, num_other_definitions=0, seed=0):
+        rng = random.Random(seed)
+        self.manifest_version = 'fake'
+        self.item_data = {}
+        names = set()
+        while len(self.item_data) < num_definitions:
+            name = ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 3)))
+            if name in names:
+                if len(names) < NAME_COMBINATIONS // 2:
+                    continue
+                name = '{} {}'.format(name, len(self.item_data))
+            names.add(name)
+            item_hash = rng.getrandbits(32)
+            weapon_type = rng.choice(WeaponType.values())
+            self.item_data[item_hash] = {
+                'hash': item_hash,
+                'displayProperties': {'name': name},
+                'itemType': 3,
+                'itemSubType': rng.choice(SUB_TYPES[weapon_type]),
+                'inventory': {
+                    'bucketTypeHash': weapon_type,
+                    'tierType': TierType.EXOTIC if rng.random() < 0.15 else TierType.SUPERIOR
+                }
+            }
+
+        while len(self.item_data) < num_definitions + num_other_definitions:
+            item_hash = rng.getrandbits(32)
+            if item_hash in self.item_data:
+                continue
+            self.item_data[item_hash] = {
+                'hash': item_hash,
+                'displayProperties': {'name': ' '.join(rng.sample(NAME_WORDS, 2))},
+                'itemType': rng.choice(OTHER_ITEM_TYPES),
+                'itemSubType': 0,
+                'inventory': {
+                    'bucketTypeHash': rng.choice(OTHER_BUCKET_HASHES),
+                    'tierType': rng.choice(OTHER_TIER_TYPES)
+                }
+            }
+
+    @property
+    def weapon_names(self):
+        """
+        Names of all weapon definitions
+        """
+        return [x['displayProperties']['name'] for x in self.item_data.values()
+                if x['itemType'] == 3]
+
+    def write_database(self, path):
+        """
+        Write the definitions to a sqlite database with the same tables and layout as the real
+        manifest database. Each item definition is padded with the kind of fields the real ones
+        have and the bot does not use, so that rows are about as large, and take about as long to
+        decode
+        """
+        connection = sqlite3.connect(path)
+        try:
+            rows = []
+            for item_hash, definition in self.item_data.items():
+                row = dict(definition)
+                row['displayProperties'] = dict(definition['displayProperties'],
+                                                description='Synthetic definition {}. '.format(
+                                                    item_hash) * 4,
+                                                icon='/common/destiny2_content/icons/{:x}.jpg'
+                                                .format(item_hash),
+                                                hasIcon=True)
+                row['flavorText'] = 'Made up for the benchmarks, with no lore to speak of. ' * 2
+                row['stats'] = {'stats': {str(x): {'statHash': x, 'value': item_hash % 100}
+                                          for x in range(4284893193, 4284893203)}}
+                row['redacted'] = False
+                # Row IDs are the hashes as signed 32 bit integers
+                rows.append((item_hash - (1 << 32) if item_hash >= 1 << 31 else item_hash,
+                             json.dumps(row)))
+
+            def named_rows(hashes, kind):
+                return [(x, json.dumps({'hash': x,
+                                        'displayProperties': {'name': '{} {}'.format(kind, x)}}))
+                        for x in hashes]
+
+            tables = {
+                'DestinyInventoryItemDefinition': rows,
+                'DestinyDamageTypeDefinition': named_rows(range(5), 'Damage'),
+                'DestinyInventoryBucketDefinition': named_rows(
+                    list(WeaponType.values()) + [VAULT_BUCKET_HASH], 'Bucket')
+            }
+            for table, table_rows in tables.items():
+                connection.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY NOT NULL, json TEXT)'
+                                   .format(table))
+                connection.executemany('INSERT INTO {} VALUES (?, ?)'.format(table), table_rows)
+            connection.commit()
+        finally:
+            connection.close()
+
+
+class FakeAPI:
+    """
+    Synthetic Bungie account with num_weapons weapons spread over the vault and num_characters
+    characters. latency is the number of seconds each call takes
+    """
+
+    def __init__(self, manifest, num_weapons=500, num_characters=3, latency=0.05, seed=0):
+        rng = random.Random(seed)
+        self.manifest = manifest
+        self.membership_type = 3
+        self.membership_id = '4611686018400000000'
+        self.latency = latency
+
+        self.calls = Counter()  # Number of calls made to each endpoint
+        self._lock = Lock()
+
+        self.characters = {}
+        for i in range(num_characters):
+            character_id = str(2305843009200000000 + i)
+            self.characters[character_id] = {
+                'data': {'characterId': character_id,
+                         'membershipId': self.membership_id,
+                         'membershipType': self.membership_type,
+                         'dateLastPlayed': '2020-01-0{}T00:00:00Z'.format(i + 1)},
+                'inventory': [],
+                'equipment': []
+            }
+
+        self.instances = {}
+        self.vault = []
+        hashes = [k for k, v in manifest.item_data.items() if v['itemType'] == 3]
+        for i in range(num_weapons):
+            item_hash = rng.choice(hashes)
+            item = {'itemHash': item_hash,
+                    'itemInstanceId': str(6917529000000000000 + i),
+                    'bucketHash': VAULT_BUCKET_HASH}
+            self.instances[item['itemInstanceId']] = {'damageType': rng.randint(1, 4),
+                                                      'primaryStat': {'value': rng.randint(1700,
+                                                                                           1900)}}
+            owner = rng.choice([None] + list(self.characters))
+            slot = manifest.item_data[item_hash]['inventory']['bucketTypeHash']
+            if owner is None:
+                self.vault.append(item)
+                continue
+            item['bucketHash'] = slot
+            character = self.characters[owner]
+            equipped = [x for x in character['equipment'] if x['bucketHash'] == slot]
+            if not equipped and not manifest.item_data[item_hash]['inventory']['tierType'] == \
+                    TierType.EXOTIC:
+                character['equipment'].append(item)
+            elif len([x for x in character['inventory'] if x['bucketHash'] == slot]) < 9:
+                character['inventory'].append(item)
+            else:
+                item['bucketHash'] = VAULT_BUCKET_HASH
+                self.vault.append(item)
+
+    @property
+    def access_token(self):
+        """
+        No token is needed, but sessions check for one when they resume a stored token
+        """
+        return 'fake'
+
+    @property
+    def total_calls(self):
+        """
+        Total number of calls made to all endpoints
+        """
+        return sum(self.calls.values())
+
+    def _record(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _instances_of(self, items):
+        return {'data': {x['itemInstanceId']: self.instances[x['itemInstanceId']] for x in items}}
+
+    def make_get_call(self, endpoint, params=None):
+        parts = endpoint.strip('/').split('/')
+        components = (params or {}).get('components', '')
+        if 'Item' in parts:
+            self._record('GetItem')
+        elif 'Character' in parts:
+            self._record('GetCharacter')
+        elif '102' in components:
+            self._record('GetProfile (inventory)')
+        else:
+            self._record('GetProfile (characters)')
+
+        with self._lock:
+            if 'Item' in parts:
+                return {'Response': self._locate(parts[-1])}
+
+            if 'Character' in parts:
+                character = self.characters[parts[-1]]
+                items = character['inventory'] + character['equipment']
+                return {
+                    'Response': {
+                        'inventory': {'data': {'items': list(character['inventory'])}},
+                        'equipment': {'data': {'items': list(character['equipment'])}},
+                        'itemComponents': {'instances': self._instances_of(items)}
+                    }
+                }
+
+            if '102' in components:
+                return {
+                    'Response': {
+                        'profileInventory': {'data': {'items': list(self.vault)}},
+                        'itemComponents': {'instances': self._instances_of(self.vault)}
+                    }
+                }
+
+            return {
+                'Response': {
+                    'characters': {'data': {k: v['data'] for k, v in self.characters.items()}},
+                    'characterActivities': {'data': {
+                        k: {'currentActivityHash': 0} for k in self.characters}}
+                }
+            }
+
+    def _locate(self, item_id):
+        """
+        Returns the response to an item lookup, with the owner and whether the item is equipped
+        """
+        for character_id, character in self.characters.items():
+            for key in ('inventory', 'equipment'):
+                if any(x['itemInstanceId'] == item_id for x in character[key]):
+                    return {'characterId': character_id,
+                            'instance': {'data': {'isEquipped': key == 'equipment'}}}
+        return {'instance': {'data': {'isEquipped': False}}}
+
+    def make_post_call(self, endpoint, data=None):
+        endpoint_name = endpoint.strip('/').split('/')[-1]
+        self._record(endpoint_name)
+        with self._lock:
+            if endpoint_name == 'TransferItem':
+                self._transfer(data)
+                return {'Response': 0, 'ErrorStatus': 'Success'}
+            if endpoint_name == 'EquipItem':
+                self._equip(data['characterId'], data['itemId'])
+                return {'Response': 0, 'ErrorStatus': 'Success'}
+            if endpoint_name == 'EquipItems':
+                for item_id in data['itemIds']:
+                    self._equip(data['characterId'], item_id)
+                return {'Response': {'equipResults': [
+                    {'itemInstanceId': x, 'equipStatus': 1} for x in data['itemIds']]},
+                    'ErrorStatus': 'Success'}
+        raise ValueError('Unsupported endpoint {}'.format(endpoint))
+
+    def _transfer(self, data):
+        character = self.characters[data['characterId']]
+        item_id = data['itemId']
+        if data['transferToVault']:
+            item = next(x for x in character['inventory'] if x['itemInstanceId'] == item_id)
+            character['inventory'].remove(item)
+            item['bucketHash'] = VAULT_BUCKET_HASH
+            self.vault.append(item)
+        else:
+            item = next(x for x in self.vault if x['itemInstanceId'] == item_id)
+            self.vault.remove(item)
+            item['bucketHash'] = self.manifest.item_data[item['itemHash']]['inventory'][
+                'bucketTypeHash']
+            character['inventory'].append(item)
+
+    def _equip(self, character_id, item_id):
+        character = self.characters[character_id]
+        item = next(x for x in character['inventory'] if x['itemInstanceId'] == item_id)
+        character['inventory'].remove(item)
+        for equipped in [x for x in character['equipment']
+                         if x['bucketHash'] == item['bucketHash']]:
+            character['equipment'].remove(equipped)
+            character['inventory'].append(equipped)
+        character['equipment'].append(item)
@@ -0,0 +1,115 @@
+"""
+Microbenchmark for parsing chat commands. Compares the per-message cost of parse_command against
+the previous approach, which called WeaponType.get_enum_from_string and
+WeaponSubType.get_enum_from_string repeatedly for every word. Those have since been rewritten, so
+copies of them as they were are used for the comparison.
+
+Run from the root of the repository with: python -m benchmarks.parse_benchmark
+"""
+
+import timeit
+
+from src.enums import WeaponSubType, WeaponType
+from src.query import parse_command
+
+
+# A mix of the kinds of commands seen in chat
+MESSAGES = [
+    '!equip',
+    '!equip kinetic',
+    '!equip kinetic pulse',
+    '!equip Power Rocket-Launcher',
+    '!search tool',
+    '!equip the jade rabbit',
+    '!search heavy sword',
+    '!equip random energy smg',
+]
+
+
+def legacy_weapon_type(sub_type_string):
+    """
+    WeaponType.get_enum_from_string as it was before parse_command existed
+    """
+    # Remove all nonletters, and convert to lowercase
+    sub_type_string = ''.join(ch for ch in sub_type_string if ch.isalpha()).lower()
+
+    return {
+        'kinetic': WeaponType.KINETIC,
+        'energy': WeaponType.ENERGY,
+        'power': WeaponType.POWER,
+        'heavy': WeaponType.POWER
+    }.get(sub_type_string, WeaponType.UNKNOWN)
+
+
+def legacy_weapon_sub_type(sub_type_string):
+    """
+    WeaponSubType.get_enum_from_string as it was before parse_command existed
+    """
+    # Remove all nonletters, and convert to lowercase
+    sub_type_string = ''.join(ch for ch in sub_type_string if ch.isalpha()).lower()
+
+    return {
+        'autorifle': WeaponSubType.AUTO_RIFLE,
+        'auto': WeaponSubType.AUTO_RIFLE,
+        'shotgun': WeaponSubType.SHOTGUN,
+        'machinegun': WeaponSubType.MACHINE_GUN,
+        'handcannon': WeaponSubType.HAND_CANNON,
+        'rocketlauncher': WeaponSubType.ROCKET_LAUNCHER,
+        'fusionrifle': WeaponSubType.FUSION_RIFLE,
+        'fusion': WeaponSubType.FUSION_RIFLE,
+        'sniperrifle': WeaponSubType.SNIPER_RIFLE,
+        'sniper': WeaponSubType.SNIPER_RIFLE,
+        'pulserifle': WeaponSubType.PULSE_RIFLE,
+        'pulse': WeaponSubType.PULSE_RIFLE,
+        'scoutrifle': WeaponSubType.SCOUT_RIFLE,
+        'scout': WeaponSubType.SCOUT_RIFLE,
+        'sidearm': WeaponSubType.SIDEARM,
+        'sword': WeaponSubType.SWORD,
+        'linearfusionrifle': WeaponSubType.LINEAR_FUSION_RIFLE,
+        'linearfusion': WeaponSubType.LINEAR_FUSION_RIFLE,
+        'grenadelauncher': WeaponSubType.GRENADE_LAUNCHER,
+        'submachinegun': WeaponSubType.SUBMACHINE_GUN,
+        'smg': WeaponSubType.SUBMACHINE_GUN,
+        'tracerifle': WeaponSubType.TRACE_RIFLE,
+        'bow': WeaponSubType.BOW
+    }.get(sub_type_string, WeaponSubType.UNKNOWN)
+
+
+def legacy_parse(command):
+    """
+    The parsing done by the bot before parse_command existed
+    """
+    words = command.split()[1:]
+    for word in words:
+        if legacy_weapon_type(word) == WeaponType.UNKNOWN and \
+                legacy_weapon_sub_type(word) == WeaponSubType.UNKNOWN:
+            return command.split(None, 1)[1].strip(), None, None
+
+    weapon_type = None
+    weapon_sub_type = None
+    for word in words:
+        if legacy_weapon_type(word) != WeaponType.UNKNOWN:
+            weapon_type = legacy_weapon_type(word)
+        if legacy_weapon_sub_type(word) != WeaponSubType.UNKNOWN:
+            weapon_sub_type = legacy_weapon_sub_type(word)
+    return None, weapon_type, weapon_sub_type
+
+
+def per_message_cost(parse, number):
+    """
+    Return the average cost of parsing one message, in microseconds
+    """
+    total = timeit.timeit(lambda: [parse(x) for x in MESSAGES], number=number)
+    return total / (number * len(MESSAGES)) * 1e6
+
+
+def main(number=20000):
+    legacy = per_message_cost(legacy_parse, number)
+    compiled = per_message_cost(parse_command, number)
+    print('legacy parser:   {:.2f} us/message'.format(legacy))
+    print('compiled parser: {:.2f} us/message'.format(compiled))
+    print('speedup:         {:.1f}x'.format(legacy / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""
+Replay harness for the chat command handlers in src.bot. A stream of chat messages is fed into the
+real handlers (!equip, !search, !loadout, !help, !status) through fake twitchio contexts, at the
+times given in the stream, with real ChannelSessions, CommandBudget and chat rate limiting, against
+the in-memory Bungie backend in benchmarks.fake_bungie. Reports commands per second, the time
+commands spend waiting for their channel's command lock, reply latency percentiles and the number
+of Bungie API calls made by each kind of command.
+
+A recorded chat log can be given as a JSONL file, with one message per line like
+{"time": 12.5, "channel": "streamer", "user": "viewer", "message": "!equip jade rabbit"}, where time
+is in seconds from the start of the log. If no log is given, a synthetic burst of chat is
+generated. Use --help to see the options, e.g. the API latency and the chat rate limit.
+
+Run from the root of the repository with: python -m benchmarks.replay_benchmark [chat log]
+"""
+
+import argparse
+import asyncio
+import builtins
+from collections import Counter, defaultdict
+import json
+import random
+import time
+from types import SimpleNamespace
+import zlib
+
+from benchmarks.fake_bungie import FakeAPI, FakeManifest
+from src.budget import CommandBudget
+from src.circuit_breaker import CircuitBreaker
+from src.profile import Profile
+from src.session import ChannelSession
+
+
+class FakeBot:
+    """
+    Stands in for the twitchio bot. Records the command handlers registered by src.bot, and
+    accepts the messages the bot sends outside of commands
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self._ws = self
+
+    def command(self, name):
+        def decorator(function):
+            self.commands[name] = function
+            return function
+        return decorator
+
+    def event(self, function):
+        return function
+
+    async def send_privmsg(self, channel, message):
+        pass
+
+
+class FakeApplication:
+    """
+    Stands in for src.application.Application, with only what the bot's handlers use
+    """
+
+    def __init__(self, command_budget):
+        self.bot = FakeBot()
+        self.sessions = {}
+        self.command_budget = command_budget
+
+    def get_session(self, channel):
+        return self.sessions.get(channel.lower())
+
+
+class CommandRecord:
+    """
+    Timings of one command. All times are time.perf_counter() values
+    """
+
+    def __init__(self, command, received):
+        self.command = command
+        self.received = received
+        self.started = None  # When the command acquired its channel's command lock
+        self.finished = None
+        self.replies = []
+        self.api_calls = Counter()
+
+    @property
+    def rejected(self):
+        """
+        True if the command was turned away by the command budget. Viewers are not always told
+        about this, but every other command gets at least one reply
+        """
+        return not self.replies or any('too many commands' in x for _, x in self.replies)
+
+    @property
+    def failed(self):
+        return any(x.startswith('An error occurred') or x.startswith('An unexpected error')
+                   for _, x in self.replies)
+
+
+class FakeContext:
+    """
+    Stands in for a twitchio command context. Replies are recorded in the command's record
+    """
+
+    def __init__(self, channel, user, content, record):
+        self.channel = SimpleNamespace(name=channel)
+        self.author = SimpleNamespace(name=user, is_mod=False)
+        self.content = content
+        self.record = record
+
+    async def send(self, message):
+        self.record.replies.append((time.perf_counter(), message))
+
+
+class TimedLock(asyncio.Lock):
+    """
+    Command lock which records when each command acquires it, and which API calls the channel
+    makes while the command holds it. Commands in a channel hold the lock one at a time, so every
+    call made in between belongs to the holder
+    """
+
+    def __init__(self, api):
+        super().__init__()
+        self.api = api
+        self.holder = None
+        self._calls_before = None
+
+    async def acquire(self):
+        await super().acquire()
+        self.holder = getattr(asyncio.current_task(), 'record', None)
+        if self.holder is not None:
+            self.holder.started = time.perf_counter()
+            self._calls_before = Counter(self.api.calls)
+        return True
+
+    def release(self):
+        if self.holder is not None:
+            self.holder.api_calls = self.api.calls - self._calls_before
+            self.holder = None
+        super().release()
+
+
+def load_chat_log(path):
+    """
+    Load a recorded chat log, sorted by time
+    """
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    return sorted(messages, key=lambda x: x['time'])
+
+
+def synthetic_chat(manifest, num_messages=300, rate=20.0, num_users=100, channels=('streamer',),
+                   seed=0):
+    """
+    Generate a burst of chat at the given number of messages per second. Most messages are
+    commands, with a mix of random and named equips, searches and the odd !help
+    """
+    rng = random.Random(seed)
+    names = manifest.weapon_names
+    criteria = ['', 'kinetic', 'energy', 'power', 'pulse', 'energy sniper', 'solar', 'void',
+                'arc', '1800+', 'kinetic 1750+', 'handcannon']
+    messages = []
+    t = 0.0
+    for _ in range(num_messages):
+        t += rng.expovariate(rate)
+        kind = rng.random()
+        if kind < 0.35:
+            message = '!equip {}'.format(rng.choice(criteria))
+        elif kind < 0.55:
+            message = '!equip {}'.format(rng.choice(names).lower())
+        elif kind < 0.7:
+            message = '!search {}'.format(rng.choice(criteria))
+        elif kind < 0.8:
+            message = '!search {}'.format(rng.choice(names).lower())
+        elif kind < 0.85:
+            message = '!loadout'
+        elif kind < 0.87:
+            message = '!help'
+        else:
+            message = 'gg'
+        messages.append({'time': t,
+                         'channel': rng.choice(channels),
+                         'user': 'viewer{}'.format(rng.randrange(num_users)),
+                         'message': message.strip()})
+    return messages
+
+
+def create_session(channel, manifest, args, circuit_breaker, command_budget):
+    """
+    Create a ChannelSession backed by its own FakeAPI, with the inventory snapshot already taken
+    """
+    session = ChannelSession({'channel': channel}, manifest, None, circuit_breaker, command_budget)
+    api = FakeAPI(manifest, num_weapons=args.weapons, latency=args.latency,
+                  seed=zlib.crc32(channel.encode()))
+    session._api = api
+    session.oauth_code = 'fake'
+    # No snapshot file, so nothing is written to disk
+    session._profile = Profile(api, args.max_age)
+    session.profile.get_all_weapons()
+    session.profile.active_character
+    session.command_lock = TimedLock(api)
+    api.calls.clear()
+    return session
+
+
+async def replay(application, messages, speed):
+    """
+    Dispatch each message to its command handler at its (scaled) time, and wait for all commands to
+    finish. Returns the CommandRecord of each command, and the wall time of the replay
+    """
+    records = []
+    tasks = []
+    start = time.perf_counter()
+    offset = messages[0]['time'] if messages else 0
+    for message in messages:
+        delay = (message['time'] - offset) / speed - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        content = message['message']
+        if not content.startswith('!'):
+            continue
+        command = content[1:].split(' ', 1)[0].lower()
+        handler = application.bot.commands.get(command)
+        if handler is None:
+            continue
+
+        record = CommandRecord(command, time.perf_counter())
+        context = FakeContext(message['channel'], message['user'], content, record)
+        task = asyncio.ensure_future(handler(context))
+        task.record = record
+        task.add_done_callback(lambda _, r=record: setattr(r, 'finished', time.perf_counter()))
+        records.append(record)
+        tasks.append(task)
+
+    await asyncio.gather(*tasks)
+    return records, time.perf_counter() - start
+
+
+def percentiles(values):
+    """
+    Format the median, 90th and 99th percentile, and maximum of the given times, in milliseconds
+    """
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+    return 'p50 {:.0f}  p90 {:.0f}  p99 {:.0f}  max {:.0f}'.format(
+        percentile(50), percentile(90), percentile(99), values[-1] * 1000)
+
+
+def report(records, elapsed, command_budget):
+    """
+    Print the results of a replay
+    """
+    handled = [x for x in records if not x.rejected]
+    print('{} commands in {:.1f} s: {:.1f} commands/s, {:.1f} handled/s'.format(
+        len(records), elapsed, len(records) / elapsed, len(handled) / elapsed))
+    print('rejected by the command budget: {}, failed: {}'.format(
+        len(records) - len(handled), sum(x.failed for x in handled)))
+    print()
+
+    print('latency (ms)')
+    queued = [x for x in handled if x.started is not None]
+    print('  queueing delay:  {}'.format(percentiles([x.started - x.received for x in queued])))
+    print('  first reply:     {}'.format(percentiles(
+        [x.replies[0][0] - x.received for x in handled if x.replies])))
+    print('  last reply:      {}'.format(percentiles(
+        [x.replies[-1][0] - x.received for x in handled if x.replies])))
+    print()
+
+    print('API calls per command')
+    by_command = defaultdict(list)
+    for record in queued:
+        by_command[record.command].append(record)
+    for command, command_records in sorted(by_command.items()):
+        totals = Counter()
+        for record in command_records:
+            totals.update(record.api_calls)
+        print('  !{:<8} n={:<4} {:.2f} calls/command  ({})'.format(
+            command, len(command_records), sum(totals.values()) / len(command_records),
+            ', '.join('{} {:.2f}'.format(k, v / len(command_records))
+                      for k, v in totals.most_common())))
+    print()
+    print('command budget: {}'.format(command_budget.get_status()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay chat through the bot\'s command handlers')
+    parser.add_argument('log', nargs='?', help='recorded chat log (JSONL); synthetic if omitted')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, as a multiple of the recorded pace')
+    parser.add_argument('--messages', type=int, default=300, help='synthetic messages')
+    parser.add_argument('--rate', type=float, default=20.0,
+                        help='synthetic messages per second')
+    parser.add_argument('--users', type=int, default=100, help='synthetic viewers')
+    parser.add_argument('--channels', type=int, default=1, help='synthetic channels')
+    parser.add_argument('--weapons', type=int, default=500, help='weapons in each account')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds each Bungie API call takes')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='seconds between chat messages (default: the bot\'s CHAT_RATE_LIMIT)')
+    parser.add_argument('--max-age', type=float, default=30,
+                        help='seconds before the inventory snapshot is fetched again')
+    parser.add_argument('--no-budget', action='store_true',
+                        help='disable viewer cooldowns and the global command budget')
+    args = parser.parse_args()
+
+    if args.no_budget:
+        command_budget = CommandBudget(user_cooldown=0, capacity=10 ** 9, refill_rate=10 ** 9)
+    else:
+        command_budget = CommandBudget()
+    application = FakeApplication(command_budget)
+
+    # src.bot registers its handlers on the application in the global namespace when imported
+    builtins.application = application
+    import src.bot
+    if args.rate_limit is not None:
+        src.bot.CHAT_RATE_LIMIT = args.rate_limit
+
+    manifest = FakeManifest()
+    if args.log:
+        messages = load_chat_log(args.log)
+    else:
+        channels = tuple('streamer{}'.format(i) for i in range(args.channels))
+        messages = synthetic_chat(manifest, args.messages, args.rate, args.users, channels)
+
+    circuit_breaker = CircuitBreaker()
+    for channel in sorted(set(x['channel'].lower() for x in messages)):
+        application.sessions[channel] = create_session(channel, manifest, args, circuit_breaker,
+                                                       command_budget)
+
+    records, elapsed = asyncio.run(replay(application, messages, args.speed))
+    report(records, elapsed, command_budget)
+
+    for session in application.sessions.values():
+        session.executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
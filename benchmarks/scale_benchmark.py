@@ -0,0 +1,336 @@
+"""
+Benchmark of how the manifest and inventory structures scale with the size of the manifest and of
+the account. For each scale (a multiple of a real account and manifest, see
+benchmarks.fake_bungie.scaled_sizes), a synthetic manifest database and account are generated, and
+the following operations are measured:
+* manifest_database: Extracting the item table from the manifest database
+* manifest_cache: Loading the item table from its cache file
+* get_all_weapons: Taking an inventory snapshot with Profile.get_all_weapons
+* get_weapon_owner: Profile.get_weapon_owner for a fixed number of weapons
+* get_weapon_owners: Profile.get_weapon_owners for every weapon at once
+* get_weapons_string: src.bot.get_weapons_string for every weapon
+
+For each operation, the time taken, the peak memory allocated while it runs and the memory it
+leaves allocated (with the number of blocks, as counted by tracemalloc) are reported, along with
+how the time grows from one scale to the next, as the exponent of the growth in size. An operation
+whose time grows linearly with the size has an exponent of 1, and one with a quadratic path, like
+calling get_weapon_owner for every weapon, has an exponent closer to 2. The peak RSS of the
+process measuring each scale is reported too, which includes the synthetic account held by the
+fake Bungie API.
+
+Each scale is measured in a fresh Python process, so peak RSS is measured separately. Manifests
+above --max-manifest-scale (10 by default, a quarter of a million item definitions) take minutes to
+generate and gigabytes to load, so larger scales reuse the largest manifest and only scale the
+account, and the manifest operations are not measured for them.
+
+The benchmark fails (exits with status 1) if any measurement exceeds its budget in
+benchmarks/scale_budgets.json, or the file given with --budgets. Times and memory are budgeted for
+each scale, and the growth exponent of each operation from the smallest scale to the largest.
+
+Run from the root of the repository with: python -m benchmarks.scale_benchmark [--scales 1 10 100]
+"""
+
+import argparse
+import builtins
+import gc
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows, where peak RSS is not reported
+
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scale_budgets.json')
+
+# Operations which load the manifest, and are only measured when the manifest is generated at the
+# scale being measured
+MANIFEST_OPERATIONS = ('manifest_database', 'manifest_cache')
+
+# Number of weapons looked up one at a time with get_weapon_owner
+OWNER_LOOKUPS = 20
+
+# Growth exponents are not worked out from times shorter than this, since they are too noisy
+MIN_TIME_FOR_GROWTH = 0.001
+
+
+def prepare(directory, scale):
+    """
+    Write a manifest database generated at the given scale to a directory
+    """
+    from benchmarks.fake_bungie import FakeManifest, scaled_sizes
+    from src.manifest import MANIFEST_DB_FILE, MANIFEST_DB_VERSION_FILE
+
+    _, num_definitions, num_other_definitions = scaled_sizes(scale)
+    FakeManifest(num_definitions, num_other_definitions).write_database(
+        os.path.join(directory, MANIFEST_DB_FILE))
+    with open(os.path.join(directory, MANIFEST_DB_VERSION_FILE), 'w') as f:
+        f.write(manifest_version(scale))
+
+
+def manifest_version(scale):
+    return 'synthetic-{}'.format(scale)
+
+
+def measure(setup, run, min_time=0.2, max_runs=20):
+    """
+    Measure an operation. setup is called before each run to create what run is given, and is not
+    measured. run is repeated until it has taken min_time in total, or max_runs times, and the
+    fastest time is kept. It is then run once more with tracemalloc tracing, to measure the memory
+    it allocates
+    """
+    times = []
+    while sum(times) < min_time and len(times) < max_runs:
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    result = run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    # Everything run allocated that is still held, by its result or by the state it was given
+    statistics = tracemalloc.take_snapshot().statistics('filename')
+    tracemalloc.stop()
+    del result
+
+    return {'time': min(times),
+            'peak_mb': peak / 2 ** 20,
+            'retained_mb': sum(x.size for x in statistics) / 2 ** 20,
+            'retained_blocks': sum(x.count for x in statistics)}
+
+
+def child(scale, manifest_scale):
+    """
+    Measure every operation at a scale, in the current directory, which holds a manifest database
+    generated at manifest_scale, and print the results as JSON
+    """
+    from benchmarks.fake_bungie import FakeAPI, scaled_sizes
+    from benchmarks.replay_benchmark import FakeApplication
+    from src.budget import CommandBudget
+    from src.manifest import TABLES, Manifest
+    from src.profile import Profile
+
+    # src.bot registers its handlers on the application in the global namespace when imported
+    builtins.application = FakeApplication(CommandBudget())
+    from src.bot import get_weapons_string
+
+    def new_manifest():
+        manifest = Manifest('benchmark')
+        manifest._manifest_info = {'version': manifest_version(manifest_scale)}
+        return manifest
+
+    def clear_table_caches():
+        for table in TABLES.values():
+            for path in (table.cache_file, table.hash_file):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def load_from_database():
+        clear_table_caches()
+        return new_manifest()
+
+    operations = {}
+    if manifest_scale == scale:
+        operations['manifest_database'] = measure(load_from_database, lambda x: x.item_data)
+        operations['manifest_cache'] = measure(new_manifest, lambda x: x.item_data)
+    manifest = new_manifest()
+    manifest.item_data
+
+    num_weapons, _, _ = scaled_sizes(scale)
+    api = FakeAPI(manifest, num_weapons=num_weapons, latency=0)
+
+    def new_profile():
+        return Profile(api, inventory_max_age=3600)
+
+    operations['get_all_weapons'] = measure(new_profile, lambda x: x.get_all_weapons())
+    profile = new_profile()
+    weapons = profile.get_all_weapons()
+
+    sample = weapons[::max(1, len(weapons) // OWNER_LOOKUPS)][:OWNER_LOOKUPS]
+    operations['get_weapon_owner'] = measure(
+        lambda: profile, lambda x: [x.get_weapon_owner(weapon) for weapon in sample])
+    operations['get_weapon_owners'] = measure(lambda: profile,
+                                              lambda x: x.get_weapon_owners(weapons))
+    operations['get_weapons_string'] = measure(lambda: weapons,
+                                               lambda x: get_weapons_string(x, 'All weapons'))
+
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS, and in kilobytes elsewhere
+        peak_rss_mb = peak_rss / 2 ** (20 if sys.platform == 'darwin' else 10)
+
+    print(json.dumps({'scale': scale,
+                      'weapons': len(weapons),
+                      'definitions': len(manifest.item_data),
+                      'operations': operations,
+                      'peak_rss_mb': peak_rss_mb}))
+
+
+def run_child(directory, scale, manifest_scale):
+    """
+    Measure a scale in a fresh process, and return its results
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.scale_benchmark', '--child',
+                             '--scales', str(scale), '--max-manifest-scale', str(manifest_scale)],
+                            cwd=directory, env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def growth_exponent(small, large):
+    """
+    Returns the exponent of the growth in time between an operation's measurements at two scales,
+    or None if it is too fast at the smaller scale
+    """
+    if small['time'] < MIN_TIME_FOR_GROWTH:
+        return None
+    return math.log(large['time'] / small['time']) / math.log(large['scale'] / small['scale'])
+
+
+def format_row(name, values, width=11):
+    return '{:<20}'.format(name) + ''.join('{:>{}}'.format(x, width) for x in values)
+
+
+def report(results):
+    """
+    Print the measurements of each operation at each scale, with the growth exponent from each
+    scale to the next
+    """
+    scales = [x['scale'] for x in results]
+    operation_names = [x for x in MANIFEST_OPERATIONS + ('get_all_weapons', 'get_weapon_owner',
+                                                         'get_weapon_owners', 'get_weapons_string')
+                       if any(x in result['operations'] for result in results)]
+
+    def for_each_scale(name, key, template, multiplier=1):
+        return [template.format(result['operations'][name][key] * multiplier)
+                if name in result['operations'] else '-' for result in results]
+
+    print(format_row('scale', ['{}x'.format(x) for x in scales]))
+    print(format_row('weapons', [x['weapons'] for x in results]))
+    print(format_row('definitions', [x['definitions'] for x in results]))
+    print()
+
+    print('time (ms)' + ' ' * (20 - 9 + 11 * len(scales)) + '  growth exponent')
+    for name in operation_names:
+        measured = [dict(x['operations'][name], scale=x['scale']) for x in results
+                    if name in x['operations']]
+        exponents = [growth_exponent(small, large)
+                     for small, large in zip(measured, measured[1:])]
+        print(format_row(name, for_each_scale(name, 'time', '{:.2f}', 1000)) + '  ' +
+              ' '.join('{:.2f}'.format(x) if x is not None else '-' for x in exponents))
+    print()
+
+    print('peak memory (MB)')
+    for name in operation_names:
+        print(format_row(name, for_each_scale(name, 'peak_mb', '{:.1f}')))
+    print()
+
+    print('retained memory (MB / blocks)')
+    for name in operation_names:
+        print(format_row(name, [
+            '{:.1f}/{}'.format(result['operations'][name]['retained_mb'],
+                               result['operations'][name]['retained_blocks'])
+            if name in result['operations'] else '-' for result in results], width=16))
+    print()
+
+    print(format_row('peak RSS (MB)', [
+        '{:.0f}'.format(x['peak_rss_mb']) if x['peak_rss_mb'] is not None else '-'
+        for x in results]))
+
+
+def check_budgets(results, budgets):
+    """
+    Returns a message for every measurement which is over its budget. Growth exponents are
+    checked from the smallest scale each operation was timed at to the largest, rather than between
+    neighbouring scales, which is noisier, e.g. from the manifest no longer fitting in the CPU
+    caches
+    """
+    over_budget = []
+    for result in results:
+        scale = str(result['scale'])
+        for name, measurement in result['operations'].items():
+            budget = budgets['operations'].get(name, {})
+            if measurement['time'] > budget.get('time', {}).get(scale, math.inf):
+                over_budget.append('{} at {}x took {:.3f} s, over the budget of {} s'.format(
+                    name, scale, measurement['time'], budget['time'][scale]))
+            if measurement['peak_mb'] > budget.get('peak_mb', {}).get(scale, math.inf):
+                over_budget.append('{} at {}x allocated {:.1f} MB, over the budget of {} MB'
+                                   .format(name, scale, measurement['peak_mb'],
+                                           budget['peak_mb'][scale]))
+        if result['peak_rss_mb'] is not None and \
+                result['peak_rss_mb'] > budgets.get('peak_rss_mb', {}).get(scale, math.inf):
+            over_budget.append('peak RSS at {}x was {:.0f} MB, over the budget of {} MB'.format(
+                scale, result['peak_rss_mb'], budgets['peak_rss_mb'][scale]))
+
+    for name, budget in budgets['operations'].items():
+        # Start from the first scale the operation is slow enough at to give a reliable time
+        measured = [dict(x['operations'][name], scale=x['scale']) for x in results
+                    if name in x['operations'] and
+                    x['operations'][name]['time'] >= MIN_TIME_FOR_GROWTH]
+        if len(measured) < 2:
+            continue
+        exponent = growth_exponent(measured[0], measured[-1])
+        if exponent > budget.get('max_exponent', math.inf):
+            over_budget.append('{} time grew with exponent {:.2f} from {}x to {}x, over the '
+                               'budget of {}'.format(name, exponent, measured[0]['scale'],
+                                                     measured[-1]['scale'],
+                                                     budget['max_exponent']))
+    return over_budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the manifest and inventory '
+                                                 'structures scale with their size')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='multiples of a real account and manifest to measure')
+    parser.add_argument('--max-manifest-scale', type=int, default=10,
+                        help='largest scale the manifest is generated at')
+    parser.add_argument('--budgets', default=BUDGETS_FILE, help='budgets file (JSON)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.scales[0], min(args.scales[0], args.max_manifest_scale))
+        return
+
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+
+    results = []
+    directories = {}
+    try:
+        for scale in sorted(args.scales):
+            manifest_scale = min(scale, args.max_manifest_scale)
+            if manifest_scale not in directories:
+                print('Generating a manifest at {}x'.format(manifest_scale), file=sys.stderr)
+                directories[manifest_scale] = tempfile.TemporaryDirectory()
+                prepare(directories[manifest_scale].name, manifest_scale)
+            print('Measuring at {}x'.format(scale), file=sys.stderr)
+            results.append(run_child(directories[manifest_scale].name, scale, manifest_scale))
+    finally:
+        for directory in directories.values():
+            directory.cleanup()
+
+    report(results)
+    over_budget = check_budgets(results, budgets)
+    for message in over_budget:
+        print('FAIL: ' + message)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Benchmark of how long the bot takes to come back after a restart, e.g. after a crash during a
+stream. Measures the time to import the bot's modules, to create the Application, and from then
+until a channel with a stored Bungie token and a saved inventory snapshot announces that it is
+ready. Also lists which of the modules that should only be imported when needed (like flask) were
+imported anyway.
+
+Each run starts a fresh Python process in a temporary directory holding a config.json, a token file
+and an inventory snapshot. The Bungie API is simulated by benchmarks.fake_bungie, and the bot does
+not connect to Twitch, so no network access is needed.
+
+The benchmark fails (exits with status 1) if the median import time or the median total time until
+the ready message exceeds its budget. The budgets can be given in seconds with --import-budget and
+--ready-budget.
+
+Run from the root of the repository with: python -m benchmarks.startup_benchmark [--runs N]
+"""
+
+import argparse
+import asyncio
+import builtins
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Modules which should only be imported when they are needed, e.g. for oauth approval
+DEFERRED_MODULES = ('flask', 'werkzeug', 'cryptography')
+
+CHANNEL = 'streamer'
+
+CONFIG = {
+    'tmi_token': 'oauth:benchmark',
+    'client_id': 'benchmark',
+    'bot_nickname': 'benchmark',
+    'bot_prefix': '!',
+    'channel': CHANNEL,
+    'bungie_api_key': 'benchmark',
+    'bungie_membership_type': 254,
+    'oauth_client_id': 0,
+    'oauth_client_secret': 'benchmark',
+    'oauth_port': 4949
+}
+
+
+def prepare(directory):
+    """
+    Write the files a previous run of the bot would have left behind: config.json, the channel's
+    stored token and its inventory snapshot
+    """
+    from benchmarks.fake_bungie import FakeAPI, FakeManifest
+    from src.profile import Profile
+
+    with open(os.path.join(directory, 'config.json'), 'w') as f:
+        json.dump(CONFIG, f)
+
+    api = FakeAPI(FakeManifest(), latency=0)
+    with open(os.path.join(directory, 'token.{}.data'.format(CHANNEL)), 'w') as f:
+        json.dump({'refresh_token': 'benchmark',
+                   'refresh_expiration': time.time() + 3600,
+                   'membership_id': api.membership_id,
+                   'membership_type': api.membership_type}, f)
+
+    # Taking a snapshot saves it to the snapshot file
+    Profile(api, snapshot_file=os.path.join(directory, 'inventory.{}.data'.format(CHANNEL))) \
+        .get_all_weapons()
+
+
+class ReadyRecorder:
+    """
+    Stands in for the bot's connection to Twitch, and records when the ready message is sent
+    """
+
+    def __init__(self):
+        self.ready_time = None
+
+    async def send_privmsg(self, channel, message):
+        if 'ready' in message and self.ready_time is None:
+            self.ready_time = time.perf_counter()
+
+
+def child():
+    """
+    Start the bot the way main.py does, in the current directory, and print the timings as JSON
+    """
+    start = time.perf_counter()
+    from src.application import Application
+    imported = time.perf_counter()
+
+    application = Application()
+    builtins.application = application
+    import src.bot
+    created = time.perf_counter()
+
+    from benchmarks.fake_bungie import FakeAPI, FakeManifest
+    session = application.get_session(CHANNEL)
+    session._api = FakeAPI(FakeManifest(), latency=0)
+    recorder = ReadyRecorder()
+    application.bot._ws = recorder
+
+    announce_start = time.perf_counter()
+    asyncio.run(src.bot.announce_when_approved(session))
+
+    print(json.dumps({
+        'import': imported - start,
+        'application': created - imported,
+        'ready': recorder.ready_time - announce_start,
+        'total': (imported - start) + (created - imported) + (recorder.ready_time - announce_start),
+        'deferred_modules': sorted(x for x in DEFERRED_MODULES if x in sys.modules)
+    }))
+
+
+def run_once(directory):
+    """
+    Run one measurement in a fresh process, and return its timings
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup_benchmark', '--child'],
+                            cwd=directory, env=env, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the time the bot takes to start')
+    parser.add_argument('--runs', type=int, default=5, help='number of runs')
+    parser.add_argument('--import-budget', type=float, default=1.0,
+                        help='seconds allowed for importing the bot\'s modules')
+    parser.add_argument('--ready-budget', type=float, default=2.0,
+                        help='seconds allowed from process start until the ready message')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory)
+        runs = [run_once(directory) for _ in range(args.runs)]
+
+    medians = {}
+    for name in ('import', 'application', 'ready', 'total'):
+        medians[name] = statistics.median(x[name] for x in runs)
+        print('{:<12} {:7.1f} ms'.format(name, medians[name] * 1000))
+    deferred = sorted(set(x for run in runs for x in run['deferred_modules']))
+    print('deferred modules imported at startup: {}'.format(', '.join(deferred) or 'none'))
+
+    over_budget = []
+    if medians['import'] > args.import_budget:
+        over_budget.append('import time {:.2f} s is over the budget of {:.2f} s'.format(
+            medians['import'], args.import_budget))
+    if medians['total'] > args.ready_budget:
+        over_budget.append('time until ready {:.2f} s is over the budget of {:.2f} s'.format(
+            medians['total'], args.ready_budget))
+    for message in over_budget:
+        print('FAIL: ' + message)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import builtins
-import time
 
 from src.application import Application
 
@@ -14,17 +13,20 @@ builtins.application = application
 # code autoformatting
 if True:
     import src.bot
-    import src.oauth_server
 
 if __name__ == '__main__':
-    # Start the web server which will handle oauth redirects
-    application.start_flask()
+    # Start loading the manifest data right away, rather than when the first command needs it
+    application.start_preload()
 
-    # Connect the Twitch bot to the channel chat and request, then wait for, oauth approval
-    application.start_bot()
+    # The web server is otherwise only started when oauth approval is needed, but the debug and
+    # inventory endpoints should be available the whole time
+    if application.serves_web_routes:
+        application.start_flask()
 
-    # Bot actions occur asynchronously, so wait here as well for oauth approval
-    application.wait_for_oauth_approval()
+    # Connect the Twitch bot to the channel chat. Channels with a token stored by a previous run are
+    # ready right away. For the others, the web server which handles oauth redirects is started,
+    # and oauth approval is requested. Once a channel is authorized, the bot takes the initial
+    # inventory snapshot and announces that it is ready
+    application.start_bot()
 
-    while True:
-        time.sleep(1)
+    application.wait_for_shutdown()
@@ -1,12 +1,91 @@
+import json
+import os
+import re
+from threading import Lock
 import time
 
 import requests
 
+from src import codec
+from src.circuit_breaker import CircuitBreaker
 from src.manifest import Manifest
+from src.single_flight import SingleFlight
 
 
 BASE_URL = 'https://www.bungie.net/Platform'  # Base API url
 
+# Bungie puts ErrorCode after Response in every response body, so it can be found near the end
+# without decoding the whole body
+ERROR_CODE_PATTERN = re.compile(rb'"ErrorCode":\s*(\d+)')
+
+# Bungie ErrorCodes which mean the API as a whole is unavailable, rather than that a particular
+# request failed
+OUTAGE_ERROR_CODES = {
+    5,  # SystemDisabled, returned during maintenance
+}
+
+# Seconds to wait for a connection to the Bungie API, and then for each read of the response, so
+# that a hung endpoint fails the call rather than blocking the channel's worker thread forever
+REQUEST_TIMEOUT = (5, 30)
+
+
+def is_outage(response):
+    """
+    Returns True if the response indicates that the Bungie API is unavailable, rather than that
+    something was wrong with the particular request. Bungie also sends errors about a particular
+    request, like DestinyItemNotFound, with 5xx statuses, so the ErrorCode in the body decides. Only
+    a 5xx response without a Bungie error body, e.g. from a proxy in front of the API, is taken to
+    be an outage on its status alone
+    """
+    if response.status_code < 400:
+        return False
+    try:
+        error_code = codec.loads(response.content).get('ErrorCode')
+    except (ValueError, AttributeError):
+        error_code = None
+    if error_code is None:
+        return response.status_code >= 500
+    return error_code in OUTAGE_ERROR_CODES
+
+
+def load_token(path):
+    """
+    Load a token saved by API.save_token. Returns None if there is no saved token, or if its refresh
+    token has expired, in which case the streamer has to approve oauth access again
+    """
+    try:
+        with open(path) as f:
+            token = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() >= token.get('refresh_expiration', 0):
+        return None
+    return token
+
+
+def create_circuit_breaker(api_key, http_session, failure_threshold=3, reset_timeout=30):
+    """
+    Create a CircuitBreaker for Bungie API calls, which probes the API by requesting the manifest
+    metadata, since that is cheap and needs no access token
+    """
+    circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def probe():
+        try:
+            response = http_session.get(BASE_URL + '/Destiny2/Manifest/',
+                                        headers={'X-API-Key': api_key},
+                                        timeout=10)
+        except requests.exceptions.RequestException:
+            circuit_breaker.record_failure()
+            return
+        if is_outage(response):
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+
+    circuit_breaker.probe = probe
+    return circuit_breaker
+
 
 class API:
     """
@@ -14,7 +93,9 @@ class API:
     access tokens, and for making GET/POST calls to arbitrary Bungie endpoints.
     """
 
-    def __init__(self, api_key, client_id, client_secret, oauth_code, bungie_membership_type):
+    def __init__(self, api_key, client_id, client_secret, oauth_code, bungie_membership_type,
+                 manifest=None, http_session=None, circuit_breaker=None, token_file=None,
+                 stored_token=None, flight_recorder=None):
         self.api_key = api_key
         self.client_id = client_id
         self.client_secret = client_secret
@@ -25,8 +106,36 @@ class API:
         self.refresh_token = None
         self._membership_id = None
         self.expiration_time = None
+        self.refresh_expiration_time = None
+
+        # If given, tokens are saved to this file whenever they are issued, so that after a restart
+        # they can be passed back in as stored_token rather than asking for oauth approval again
+        self.token_file = token_file
+        if stored_token is not None:
+            self.refresh_token = stored_token['refresh_token']
+            self.refresh_expiration_time = stored_token['refresh_expiration']
+            self._membership_id = stored_token['membership_id']
+            self._membership_type = stored_token['membership_type']
+
+        # HTTP connection pool. May be shared with other API objects
+        self.http_session = http_session or requests.Session()
+
+        # Manifest data is read-only, so it may be shared with other API objects
+        self.manifest = manifest or Manifest(self.api_key, self.http_session)
 
-        self.manifest = Manifest(self.api_key)
+        # Bungie outages affect everyone, so this may also be shared with other API objects
+        self.circuit_breaker = circuit_breaker or create_circuit_breaker(self.api_key,
+                                                                         self.http_session)
+
+        # If given, every call is recorded in this FlightRecorder
+        self.flight_recorder = flight_recorder
+
+        # Concurrent token requests and identical GET calls are only sent once. GETs are keyed on
+        # the number of POSTs started and finished, so that a GET sent after a transfer or equip
+        # never shares the result of one sent before it
+        self._flights = SingleFlight()
+        self._post_count = 0
+        self._post_count_lock = Lock()
 
     @property
     def access_token(self):
@@ -34,11 +143,10 @@ class API:
         Returns the access token needed for performing protected API operations. Lazily initialized,
         so it will request the access token the first time this is called.
         """
-        if self._access_token is None:
-            self.get_token()
-        # If access token is expired, refresh it
-        if time.time() - self.expiration_time > 0:
-            self.refresh_access_token()
+        if self._access_token is None or time.time() - self.expiration_time > 0:
+            # Other threads wait for the same request, rather than each using up the oauth code or
+            # the refresh token, which can only be used once
+            self._flights.do('token', self._update_token)
         return self._access_token
 
     @property
@@ -47,7 +155,7 @@ class API:
         Get the membership type of the player
         """
         if self._membership_type is None:
-            self.get_token()
+            self._flights.do('token', self._update_token)
         return self._membership_type
 
     @property
@@ -56,46 +164,129 @@ class API:
         Get the membership ID of the player
         """
         if self._membership_id is None:
-            self.get_token()
+            self._flights.do('token', self._update_token)
         return self._membership_id
 
+    def _update_token(self):
+        """
+        Request an access token if there is none yet, or refresh it if it has expired. Only called
+        through the single flight, so only one request is made at a time
+        """
+        if self._access_token is None and self.refresh_token is not None:
+            # A stored refresh token can be exchanged for an access token directly
+            self.refresh_access_token()
+        elif self._access_token is None or self._membership_id is None:
+            self.get_token()
+        # If access token is expired, refresh it
+        elif time.time() - self.expiration_time > 0:
+            self.refresh_access_token()
+
     def get_token(self):
         """
         Request an access token for performing protected API operations on the player
         """
-        response = requests.post('https://www.bungie.net/Platform/App/OAuth/Token', data={
+        response = self._send('POST', BASE_URL + '/App/OAuth/Token', data={
             'grant_type': 'authorization_code',
             'code': self.oauth_code,
             'client_id': self.client_id,
             'client_secret': self.client_secret,
         }, headers={'X-API-Key': self.api_key})
-        response.raise_for_status()
-        output = response.json()
-        self._access_token = output['access_token']
-        self.refresh_token = output['refresh_token']
-        self.expiration_time = time.time() + output['expires_in']
+        output = codec.loads(response.content)
+        self._set_token(output)
 
         # Get platform membership id and type for the player
         output = self.make_get_call('/User/GetBungieAccount/{}/{}'.format(
             output['membership_id'], self.bungie_membership_type))
         self._membership_id = output['Response']['destinyMemberships'][0]['membershipId']
         self._membership_type = output['Response']['destinyMemberships'][0]['membershipType']
+        self.save_token()
 
     def refresh_access_token(self):
         """
         Refresh the access token. Access tokens expire an hour after they are issued
         """
-        response = requests.post('https://www.bungie.net/Platform/App/OAuth/Token', data={
+        response = self._send('POST', BASE_URL + '/App/OAuth/Token', data={
             'grant_type': 'refresh_token',
             'refresh_token': self.refresh_token,
             'client_id': self.client_id,
             'client_secret': self.client_secret
         }, headers={'X-API-Key': self.api_key})
-        response.raise_for_status()
-        output = response.json()
+        self._set_token(codec.loads(response.content))
+        self.save_token()
+
+    def _set_token(self, output):
+        """
+        Store the tokens from a response of the token endpoint
+        """
         self._access_token = output['access_token']
         self.refresh_token = output['refresh_token']
         self.expiration_time = time.time() + output['expires_in']
+        if 'refresh_expires_in' in output:
+            self.refresh_expiration_time = time.time() + output['refresh_expires_in']
+
+    def save_token(self):
+        """
+        Save the refresh token and membership to token_file, if set. The access token is not saved,
+        since it expires within the hour. The file is only readable by the current user, and is
+        written to a temporary file first and then renamed, so a crash never leaves a partial file
+        """
+        if self.token_file is None or self.refresh_expiration_time is None or \
+                self._membership_id is None:
+            return
+        token = {
+            'refresh_token': self.refresh_token,
+            'refresh_expiration': self.refresh_expiration_time,
+            'membership_id': self._membership_id,
+            'membership_type': self._membership_type
+        }
+        temp_path = self.token_file + '.tmp'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(token, f)
+        os.replace(temp_path, self.token_file)
+
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request to the Bungie API through the circuit breaker. If the breaker is open, a
+        BungieUnavailableError is raised without sending anything. Otherwise, failures indicating an
+        outage, including timeouts (see REQUEST_TIMEOUT), are recorded with the breaker, and a
+        requests.exceptions.HTTPError is raised if the request failed
+        """
+        self.circuit_breaker.before_call()
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            response = self.http_session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.circuit_breaker.record_failure()
+            self._record_call(method, url, kwargs, None, time.perf_counter() - start)
+            raise
+        self._record_call(method, url, kwargs, response, time.perf_counter() - start)
+
+        if is_outage(response):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+        response.raise_for_status()
+        return response
+
+    def _record_call(self, method, url, kwargs, response, latency):
+        """
+        Record a call in the flight recorder, if there is one. Form data is never recorded, since it
+        is only used for the token endpoint, where it holds the client secret and tokens
+        """
+        if self.flight_recorder is None:
+            return
+        status = error_code = size = None
+        if response is not None:
+            status = response.status_code
+            size = len(response.content)
+            match = ERROR_CODE_PATTERN.search(response.content, max(0, size - 512))
+            if match is not None:
+                error_code = int(match.group(1))
+        endpoint = url[len(BASE_URL):] if url.startswith(BASE_URL) else url
+        self.flight_recorder.record(method, endpoint, kwargs.get('params') or kwargs.get('json'),
+                                    status, error_code, round(latency, 4), size)
 
     def make_get_call(self, endpoint, params=None):
         """
@@ -106,14 +297,28 @@ class API:
             endpoint (str): The endpoint to call, e.g. "/Destiny2/123/Profile/456/Character/789"
             params (dict): URL parameters to use for the GET call
 
-        returns: The deserialized JSON returned by the endpoint
+        returns: The deserialized JSON returned by the endpoint. If an identical call is already in
+        flight on another thread, its result is returned, so the result must not be modified
         """
-        response = requests.get(BASE_URL + endpoint,
-                                params=params,
-                                headers={'X-API-Key': self.api_key,
-                                         'Authorization': 'Bearer {}'.format(self.access_token)})
-        response.raise_for_status()
-        return response.json()
+        key = (endpoint, tuple(sorted((params or {}).items())), self._post_count)
+        return self._flights.do(key, self._get, endpoint, params)
+
+    def _get(self, endpoint, params):
+        """
+        Make an API GET call, without checking for identical calls in flight
+        """
+        response = self._send('GET', BASE_URL + endpoint,
+                              params=params,
+                              headers={'X-API-Key': self.api_key,
+                                       'Authorization': 'Bearer {}'.format(self.access_token)})
+        return codec.loads(response.content)
+
+    def _count_post(self):
+        """
+        Count a POST call starting or finishing. POSTs can be made from several threads at once
+        """
+        with self._post_count_lock:
+            self._post_count += 1
 
     def make_post_call(self, endpoint, data=None):
         """
@@ -126,9 +331,12 @@ class API:
 
         returns: The deserialized JSON returned by the endpoint
         """
-        response = requests.post(BASE_URL + endpoint,
-                                 json=data,
-                                 headers={'X-API-Key': self.api_key,
-                                          'Authorization': 'Bearer {}'.format(self.access_token)})
-        response.raise_for_status()
-        return response.json()
+        self._count_post()
+        try:
+            response = self._send('POST', BASE_URL + endpoint,
+                                  json=data,
+                                  headers={'X-API-Key': self.api_key,
+                                           'Authorization': 'Bearer {}'.format(self.access_token)})
+        finally:
+            self._count_post()
+        return codec.loads(response.content)
@@ -1,12 +1,13 @@
 import json
-from threading import Thread
-import time
-import webbrowser
+from threading import Event, Thread
+import traceback
 
-from flask import Flask
+import requests
 
-from src.api import API
-from src.profile import Profile
+from src.api import create_circuit_breaker
+from src.budget import CommandBudget
+from src.manifest import Manifest
+from src.session import ChannelSession
 from twitchio.ext import commands
 
 
@@ -17,49 +18,66 @@ class Application:
     to allow the event decorator (for the bot) and the route decorator (for the flask webserver) to
     be accessed in other modules. This is a little weird, but makes it so that the code can be
     organized in a more logical way.
+
+    A single process can host the bot in several Twitch channels. Each channel gets a
+    ChannelSession with its own Bungie oauth approval, while the manifest data, the HTTP
+    connection pool and the circuit breaker for Bungie outages are shared between all channels.
     """
 
     def __init__(self):
-        self.flask_app = Flask(__name__)  # Flask application
+        # Flask application, created when first needed
+        self._flask_app = None
+        self.flask_started = False
 
         self.config = json.load(open('config.json'))  # Contains credentials and settings
 
+        # Shared between all channels
+        self.http_session = requests.Session()
+        self.manifest = Manifest(self.config['bungie_api_key'], self.http_session)
+        self.circuit_breaker = create_circuit_breaker(
+            self.config['bungie_api_key'],
+            self.http_session,
+            failure_threshold=self.config.get('circuit_breaker_threshold', 3),
+            reset_timeout=self.config.get('circuit_breaker_reset_timeout', 30))
+
+        # Limits on command usage, which protect the Bungie API key's rate limit across all channels
+        self.command_budget = CommandBudget.from_config(self.config)
+
+        # One session per channel, keyed on the lowercase channel name
+        self.sessions = {}
+        for channel_config in self.channel_configs:
+            session = ChannelSession(channel_config, self.manifest, self.http_session,
+                                     self.circuit_breaker, self.command_budget)
+            self.sessions[session.channel.lower()] = session
+
+        # Set when the application should shut down, which is once the Twitch bot stops running
+        self.stopped = Event()
+
         self.bot = commands.Bot(  # The Twitch bot
             irc_token=self.config['tmi_token'],
             client_id=self.config['client_id'],
             nick=self.config['bot_nickname'],
             prefix=self.config['bot_prefix'],
-            initial_channels=[self.config['channel']]
+            initial_channels=[x.channel for x in self.sessions.values()]
         )
 
-        # Oauth code which will needs to be provided every time the script is run
-        self.oauth_code = None
-
-        self._api = None
-
     @property
-    def api(self):
+    def channel_configs(self):
         """
-        Returns an API object which can be used to perform API operations. oauth_code must be set
-        before this can be used.
+        Returns the config for each channel. Channels are listed under "channels" in config.json,
+        and any setting given for a channel (e.g. "oauth_client_id") overrides the top-level
+        setting. If "channels" is not present, the top-level "channel" setting is used
         """
-        if self.oauth_code is None:
-            return None
-        if self._api is None:
-            self._api = API(self.config['bungie_api_key'],
-                            self.config['oauth_client_id'],
-                            self.config['oauth_client_secret'],
-                            self.oauth_code,
-                            self.config['bungie_membership_type'])
-        return self._api
+        base_config = {k: v for k, v in self.config.items() if k != 'channels'}
+        channels = self.config.get('channels') or [{'channel': self.config['channel']}]
+        return [dict(base_config, **x) for x in channels]
 
-    @property
-    def oauth_link(self):
+    def get_session(self, channel):
         """
-        Link to the page with the oauth approval prompt
+        Returns the ChannelSession for the given channel name, or None if the bot is not hosted
+        there
         """
-        return 'https://www.bungie.net/en/OAuth/Authorize?client_id={}&response_type=code'.format(
-            self.config['oauth_client_id'])
+        return self.sessions.get(channel.lower())
 
     @property
     def oauth_port(self):
@@ -69,40 +87,89 @@ class Application:
         return self.config['oauth_port']
 
     @property
-    def profile(self):
+    def flask_app(self):
+        """
+        Flask application. Flask is only imported when this is first used, since the web server is
+        only needed while a streamer approves oauth access
+        """
+        if self._flask_app is None:
+            from flask import Flask
+            self._flask_app = Flask(__name__)
+        return self._flask_app
+
+    @property
+    def serves_web_routes(self):
         """
-        Returns player Profile object, which can be used to perform account-level API operations
+        True if the web server serves anything besides the oauth redirect endpoint, in which case it
+        should run the whole time, rather than only while oauth approval is needed
         """
-        return Profile(self.api)
+        return self.config.get('debug_routes', False) or self.config.get('inventory_api', False)
 
     def start_flask(self):
         """
         Start the flask server, which will serve the oauth redirect endpoint to capture the oauth
-        code which will be used to make restricted api calls.
+        code which will be used to make restricted api calls. Does nothing if it is already running.
 
         This must run with ssl, because Bungie oauth does not allow redirect to http. Because adhoc
         does not use an officially signed cert, there will be a warning shown in the browser when
         the user is redirected to this endpoint.
         """
-        Thread(target=self.flask_app.run,
+        if self.flask_started:
+            return
+        self.flask_started = True
+
+        # Registers the oauth redirect endpoint, and any other enabled endpoints, on flask_app
+        import src.oauth_server
+        if self.config.get('debug_routes', False):
+            import src.debug_routes
+        if self.config.get('inventory_api', False):
+            import src.inventory_routes
+
+        # The main thread blocks in wait_for_shutdown, so the process exits when that returns
+        Thread(target=self.flask_app.run, daemon=True,
                kwargs={'host': '0.0.0.0', 'port': self.oauth_port, 'ssl_context': 'adhoc'}).start()
 
     def start_bot(self):
         """
-        Connect the Twitch bot to the channel
+        Connect the Twitch bot to the channels
+        """
+        Thread(target=self._run_bot, daemon=True).start()
+
+    def _run_bot(self):
+        """
+        Run the Twitch bot until it disconnects or fails, then mark the application as stopped
+        """
+        try:
+            self.bot.run()
+        finally:
+            self.stopped.set()
+
+    def start_preload(self):
+        """
+        Load the manifest item definitions in the background, checking the manifest version and
+        downloading it if necessary, so that this happens while the streamers are still approving
+        oauth access rather than during the first command
         """
-        Thread(target=self.bot.run).start()
+        Thread(target=self._preload_manifest, daemon=True).start()
 
-    def open_oauth_page(self):
+    def _preload_manifest(self):
         """
-        Open the oauth authentication page in the default system web browser, and wait for the user
-        to authenticate and for the oauth code to be received by the flask server.
+        Load the manifest item definitions. If this fails, the error is printed, and loading will be
+        attempted again when the item definitions are first needed
         """
-        webbrowser.open(self.oauth_link)
+        try:
+            self.manifest.item_data
+        except Exception:
+            traceback.print_exc()
 
-    def wait_for_oauth_approval(self):
+    def wait_for_shutdown(self):
         """
-        Wait until the oauth code has been received by the flask webserver and stored in oauth_code
+        Block until the application is stopped, either because the Twitch bot stopped running or
+        because of Ctrl+C
         """
-        while self.oauth_code is None:
-            time.sleep(.25)
+        # Wait with a timeout, so that the main thread still responds to Ctrl+C
+        try:
+            while not self.stopped.wait(timeout=60):
+                pass
+        except KeyboardInterrupt:
+            self.stopped.set()
@@ -1,45 +1,135 @@
+import asyncio
+from functools import partial
+import math
 import time
 import traceback
 
-from src.enums import WeaponType, WeaponSubType
-from src.exceptions import Error
+from src.enums import DamageType, WeaponType, WeaponSubType
+from src.exceptions import BungieUnavailableError, Error, TransferOrEquipError
+from src.query import parse_command
 
 # This is just to appease IDE code analyzers by defining application explicitly in this module
 if False:
     application = None
 
-# Global variable to track how long ago a chat message was sent. Needed to rate-limit chat messages
-last_message_send_time = 0
+# Channels for which the bot is waiting for oauth approval
+awaiting_approval = set()
 
-
-def is_name_command(command):
-    """
-    Checks if the command looks like a request to equip or search a weapon by name, or based on
-    criteria (type or subtype). If any words in the command can't be interpreted as either type or
-    subtype, it will be treated as a request to equip or search by name
-    """
-    words = command.split()[1:]  # Drop first word and separate into component words
-
-    # If any word looks like neither type nor subtype, return True
-    for word in words:
-        if WeaponType.get_enum_from_string(word) == WeaponType.UNKNOWN and \
-                WeaponSubType.get_enum_from_string(word) == WeaponSubType.UNKNOWN:
-            return True
-    return False
+# Minimum number of seconds between chat messages sent to a channel
+CHAT_RATE_LIMIT = 1.5
 
 
-async def rate_limited_send(context, message, rate_limit=1.5):
+async def rate_limited_send(context, message, rate_limit=None):
     """
     Send a message in the Twitch chat. There seems to be an issue with the twitchio library where
     sending messages too quickly causes an error, resulting in the message not being sent. This
-    function ensures that all messages sent are rate-limited to prevent this from happening.
+    function ensures that all messages sent are rate-limited to prevent this from happening. The
+    rate limit applies per channel, and defaults to CHAT_RATE_LIMIT
     """
-    global last_message_send_time
-    time_since_last_send = time.time() - last_message_send_time
+    if rate_limit is None:
+        rate_limit = CHAT_RATE_LIMIT
+    session = application.get_session(context.channel.name)
+    time_since_last_send = time.time() - session.last_message_send_time
     if time_since_last_send < rate_limit:
-        time.sleep(rate_limit - time_since_last_send)
+        # Set the send time before sleeping, so that other messages queue up behind this one
+        session.last_message_send_time = time.time() + rate_limit - time_since_last_send
+        await asyncio.sleep(rate_limit - time_since_last_send)
+    else:
+        session.last_message_send_time = time.time()
+    await context.send(message)
+
+
+async def send_if_idle(context, message):
+    """
+    Send a message in the Twitch chat only if it can go out straight away without breaking the
+    channel's rate limit (see rate_limited_send). Otherwise the message is dropped, so that it never
+    delays the replies queued behind it. Returns True if the message was sent
+    """
+    session = application.get_session(context.channel.name)
+    if time.time() - session.last_message_send_time < CHAT_RATE_LIMIT:
+        return False
+    session.last_message_send_time = time.time()
     await context.send(message)
-    last_message_send_time = time.time()
+    return True
+
+
+async def get_ready_session(ctx):
+    """
+    Returns the ChannelSession for the channel the command was sent in. If the streamer has not
+    approved oauth access yet, tell the viewers and return None
+    """
+    session = application.get_session(ctx.channel.name)
+    if session is None:
+        return None
+    if not session.authorized:
+        await rate_limited_send(ctx, 'The bot is waiting for the streamer to approve Bungie oauth '
+                                     'access. Please try again later')
+        return None
+    session.last_command_time = time.time()
+    return session
+
+
+async def check_budget(ctx, command):
+    """
+    Check the command budget before running a command, charging the command's estimated cost. If
+    the viewer is on cooldown, or the global budget is used up, return False. The viewer is told
+    so at most once per cooldown, and only if chat is quiet enough to tell them straight away, so
+    that a flood of rejected commands can't hold up the replies to accepted ones. Moderators are
+    not subject to the per-viewer cooldown
+    """
+    user = ctx.author.name
+    budget = application.command_budget
+    allowed, retry_after = budget.try_acquire(
+        ctx.channel.name, user, command,
+        exempt_from_cooldown=getattr(ctx.author, 'is_mod', False))
+    if not allowed and budget.should_notify(ctx.channel.name, user):
+        await send_if_idle(ctx, '@{}, too many commands right now. Try again in {} '
+                                'seconds'.format(user, math.ceil(retry_after)))
+    return allowed
+
+
+async def announce_when_approved(session):
+    """
+    Authorize a channel, then take the initial inventory snapshot, and announce that the bot is
+    ready. After a restart, the token stored by the previous run is used if it is still valid.
+    Otherwise, the oauth web server is started, and the bot prompts for oauth approval and waits
+    until it is provided. Waiting happens on a worker thread, so other channels are not held up
+    """
+    awaiting_approval.add(session.channel)
+    try:
+        try:
+            resumed = await session.run(session.resume_stored_token)
+        except Exception:
+            # Probably a Bungie outage. Keep the stored token, and let the first command try again
+            traceback.print_exc()
+            resumed = session.authorized
+
+        if not resumed:
+            application.start_flask()
+            await application.bot._ws.send_privmsg(
+                session.channel,
+                'Bot is online. You should have been directed to the Bungie oauth approval page')
+
+            session.open_oauth_page()
+            await asyncio.get_event_loop().run_in_executor(None, session.wait_for_oauth_approval)
+
+        # Take the initial inventory snapshot before announcing that the bot is ready. If this
+        # fails, the first command will try again
+        try:
+            await session.run(session.warm_up)
+        except Exception:
+            traceback.print_exc()
+
+        if resumed:
+            message = 'Bot is online and ready for use'
+        else:
+            message = 'Oauth approval received, bot is now ready for use'
+        await application.bot._ws.send_privmsg(session.channel, message)
+
+        if session.stager is not None:
+            asyncio.ensure_future(session.stager.run())
+    finally:
+        awaiting_approval.discard(session.channel)
 
 
 @application.bot.event
@@ -49,18 +139,9 @@ async def event_ready():
     """
     # This condition is included because it seems like there are times when the bot disconnects and
     # reconnects, meaning this function may be called more than once during a session
-    if application.oauth_code is None:
-        await application.bot._ws.send_privmsg(
-            application.config['channel'],
-            'Bot is online. You should have been directed to the Bungie oauth approval page')
-
-        # Prompt for oauth approval and wait until it is provided
-        application.open_oauth_page()
-        application.wait_for_oauth_approval()
-
-        await application.bot._ws.send_privmsg(
-            application.config['channel'],
-            'Oauth approval received, bot is now ready for use')
+    for session in application.sessions.values():
+        if not session.authorized and session.channel not in awaiting_approval:
+            asyncio.ensure_future(announce_when_approved(session))
 
 
 @application.bot.command(name='help')
@@ -71,20 +152,60 @@ async def command_help(ctx):
     """
     await rate_limited_send(ctx, 'Available commands:')
     await rate_limited_send(ctx, '!equip <weapon name> <slot> <type>: Equip a weapon by name, or '
-                                 'equip a random weapon with optional type and subtype. Examples: '
-                                 '"!equip jade rabbit", "!equip steelfeather", "!equip energy", '
-                                 '"!equip kinetic pulse". "!equip" by itself equips a completely '
-                                 'random weapon in a random slot.')
+                                 'equip a random weapon with optional type, subtype, element and '
+                                 'minimum power. Examples: "!equip jade rabbit", "!equip '
+                                 'steelfeather", "!equip energy", "!equip kinetic pulse", "!equip '
+                                 'solar", "!equip 1800+ handcannon". "!equip" by itself equips a '
+                                 'completely random weapon in a random slot.')
     await rate_limited_send(ctx, '!search <weapon name> <slot> <type>: Search for and display '
                                  'all weapons matching the given criteria. Format is the same as '
                                  'for !equip. If the output is >500 characters, it will be '
                                  'truncated.')
+    await rate_limited_send(ctx, '!loadout <slot> <slot>: Equip a random weapon in each of the '
+                                 'given slots at once, or in all three slots if none are given. '
+                                 'Examples: "!loadout", "!loadout kinetic energy".')
+    await rate_limited_send(ctx, '!status: Show whether the bot and the Bungie API are working.')
     await rate_limited_send(ctx, 'NOTE: Weapons cannot be equipped mid-activity, but they will be '
                                  'sent to the player\'s inventory.')
     await rate_limited_send(ctx, 'NOTE 2: Only weapons in player inventory and vault can be '
                                  'equipped. Pulling from collections is not supported.')
 
 
+def get_status_message(session):
+    """
+    Generate a short description of the bot's state for a channel, for the !status command
+    """
+    breaker_status = session.circuit_breaker.get_status()
+    if breaker_status['state'] == 'closed':
+        status = 'Bungie API: OK'
+    else:
+        status = 'Bungie API: unavailable, next check in {}s ({} commands rejected)'.format(
+            breaker_status['retry_in'], breaker_status['rejected_calls'])
+
+    budget_status = application.command_budget.get_status()
+    status += '. Command budget: {}/{} ({} accepted, {} rejected)'.format(
+        int(budget_status['tokens']), budget_status['capacity'], budget_status['accepted'],
+        budget_status['rejected_cooldown'] + budget_status['rejected_global'])
+
+    if session.stager is not None:
+        status += '. Pre-staged weapons: {} in {} passes'.format(session.stager.transfers,
+                                                                   session.stager.passes)
+
+    if not session.authorized:
+        status += '. Waiting for oauth approval'
+    return status
+
+
+@application.bot.command(name='status')
+async def command_status(ctx):
+    """
+    Respond to the !status command with the state of the bot, e.g. whether the Bungie API is down
+    """
+    session = application.get_session(ctx.channel.name)
+    if session is not None:
+        await rate_limited_send(ctx, get_status_message(session))
+
+
 @application.bot.command(name='equip')
 async def equip(ctx):
     """
@@ -94,11 +215,16 @@ async def equip(ctx):
     name, then a random weapon matching the given criteria will be randomly chosen and equipped. If
     no parameters are given, then a random weapon of a random type will be chosen and equipped
     """
-    if is_name_command(ctx.content):
-        requested_weapon = ctx.content[6:].strip()  # Drop first word (!equip)
-        await named_weapon_action(ctx, requested_weapon, equip=True)
-    else:
-        await random_weapon_action(ctx, equip=True)
+    session = await get_ready_session(ctx)
+    if session is None or not await check_budget(ctx, 'equip'):
+        return
+
+    query = parse_command(ctx.content)
+    async with session.command_lock:
+        if query.is_name:
+            await named_weapon_action(ctx, session, query.name, equip=True)
+        else:
+            await random_weapon_action(ctx, session, query, equip=True)
 
 
 @application.bot.command(name='search')
@@ -110,18 +236,45 @@ async def search(ctx):
     parameters are given, then all weapons will be displayed. Note that exotics will be excluded in
     certain cases, such as when no weapon type is specified
     """
-    if is_name_command(ctx.content):
-        requested_weapon = ctx.content[7:].strip()  # Drop first word (!search)
-        await named_weapon_action(ctx, requested_weapon, equip=False)
-    else:
-        await random_weapon_action(ctx, equip=False)
+    session = await get_ready_session(ctx)
+    if session is None or not await check_budget(ctx, 'search'):
+        return
+
+    query = parse_command(ctx.content)
+    async with session.command_lock:
+        if query.is_name:
+            await named_weapon_action(ctx, session, query.name, equip=False)
+        else:
+            await random_weapon_action(ctx, session, query, equip=False)
 
 
-def get_weapons_string(weapons, criteria):
+@application.bot.command(name='loadout')
+async def loadout(ctx):
     """
-    Generate a string showing all weapons which match the given criteria. If multiple weapons of the
-    same name are present in the list, then the quantity will be shown next to the name. If the
-    resulting string exceeds 500 characters in length, it will be truncated
+    Equip a random weapon in each of the given slots, like "!loadout kinetic energy", or in all
+    three slots if no slots are given. All of the weapons are equipped at once
+    """
+    session = await get_ready_session(ctx)
+    if session is None:
+        return
+
+    query = parse_command(ctx.content)
+    if query.is_name or query.weapon_sub_type is not None or query.has_instance_criteria:
+        await rate_limited_send(ctx, 'Only weapon slots can be given for !loadout. Try something '
+                                     'like "!loadout" or "!loadout kinetic energy"')
+        return
+    if not await check_budget(ctx, 'loadout'):
+        return
+
+    async with session.command_lock:
+        await loadout_action(ctx, session, query.weapon_types)
+
+
+def get_weapons_summary(weapons):
+    """
+    Summarize a list of weapons for display. If multiple weapons of the same name are present in the
+    list, then the quantity will be shown next to the name. Returns a tuple of the number of
+    distinct names and the sorted, comma-separated names
     """
     counted_weapons = {}
     for weapon in weapons:
@@ -139,9 +292,18 @@ def get_weapons_string(weapons, criteria):
 
     weapon_names.sort()
 
+    return len(weapon_names), ', '.join(weapon_names)
+
+
+def format_weapons_summary(summary, criteria):
+    """
+    Generate a string from a summary returned by get_weapons_summary, prefixed with the criteria.
+    If the resulting string exceeds 500 characters in length, it will be truncated
+    """
+    num_names, joined_names = summary
+
     weapons_str = criteria + \
-        ' ({} match{}): '.format(len(weapon_names), 'es' if len(weapon_names) > 1 else '') + \
-        ', '.join(weapon_names)
+        ' ({} match{}): '.format(num_names, 'es' if num_names > 1 else '') + joined_names
 
     # Truncate if necessary
     if len(weapons_str) > 500:
@@ -150,25 +312,149 @@ def get_weapons_string(weapons, criteria):
     return weapons_str
 
 
-async def random_weapon_action(ctx, equip):
+def get_weapons_string(weapons, criteria):
+    """
+    Generate a string showing all weapons which match the given criteria. If multiple weapons of the
+    same name are present in the list, then the quantity will be shown next to the name. If the
+    resulting string exceeds 500 characters in length, it will be truncated
+    """
+    return format_weapons_summary(get_weapons_summary(weapons), criteria)
+
+
+def get_cached_weapons_summary(session, search_key, select, on_options=None):
+    """
+    Get the weapons summary for a search, from the channel's search cache if possible. search_key
+    identifies the parsed search criteria, and select is a function returning a (chosen weapon,
+    options) tuple as returned by the Character.select_* methods, which is only called on a cache
+    miss. The options are cached along with the summary, and if on_options is given, it is called
+    with them whether or not they came from the cache. This makes blocking API calls, so it should
+    be run with session.run. Returns a tuple of the summary, and whether it came from the cache.
+    The cache key includes the snapshot tag, which also changes when power levels do, so that
+    searches like "1800+" are never answered from an older snapshot. Searches exclude exotics when
+    one is equipped in another slot, so the key also includes the slots the active character has
+    exotics equipped in
+    """
+    profile = session.profile
+    cache_key = (search_key, profile.get_snapshot_tag(),
+                 profile.active_character.get_equipped_exotic_slots())
+    cached = session.search_cache.get(cache_key)
+    if cached is not None:
+        summary, options = cached
+        from_cache = True
+    else:
+        _, options = select()
+        summary = get_weapons_summary(options)
+        session.search_cache.put(cache_key, (summary, options))
+        from_cache = False
+
+    if on_options is not None:
+        on_options(options)
+    return summary, from_cache
+
+
+def record_demand(session, weapons):
+    """
+    Tell the channel's pre-stager, if enabled, that viewers asked for the given weapons
+    """
+    if session.stager is not None:
+        session.stager.record_demand(weapons)
+
+
+async def send_search_result(ctx, session, search_key, select, criteria, on_options=None):
+    """
+    Send the summary of weapons found by a search. If it was served from the search cache, the
+    search's cost is returned to the command budget, since no API calls were needed. on_options is
+    passed on to get_cached_weapons_summary
+    """
+    summary, from_cache = await session.run(get_cached_weapons_summary, session, search_key, select,
+                                            on_options)
+    if from_cache:
+        application.command_budget.refund(application.command_budget.cost('search'))
+    await rate_limited_send(ctx, format_weapons_summary(summary, criteria))
+
+
+async def send_equip_result(ctx, weapon_names, equipped):
     """
-    Equip or search for a random weapon, with optional constraints. For valid weapon type
-    constraints, see WeaponType.get_enum_from_string. For valid weapon subtype constraints, see
-    WeaponSubType.get_enum_from_string. If equip is true, select from the available options and
-    equip the chosen weapon. Otherwise, display the matching options to the viewers
+    Tell the viewers the outcome of an equip. equipped is False if the weapons could only be
+    transferred, because the player is in an activity
     """
-    words = ctx.content.split()[1:]  # Drop first word (!random) and separate into component words
+    if equipped:
+        await rate_limited_send(ctx, 'Successfully equipped {}'.format(weapon_names))
+    else:
+        await rate_limited_send(ctx, 'Weapons cannot be equipped during an activity, so {} was '
+                                     'moved to the character\'s inventory instead'.format(
+                                         weapon_names))
 
-    weapon_type = None
-    weapon_sub_type = None
 
-    for word in words:
-        # Check if the word looks like a constraint on the weapon type (slot)
-        if WeaponType.get_enum_from_string(word) != WeaponType.UNKNOWN:
-            weapon_type = WeaponType.get_enum_from_string(word)
-        # Check if the word looks like a constraint on the weapon subtype (e.g. "pulserifle")
-        if WeaponSubType.get_enum_from_string(word) != WeaponSubType.UNKNOWN:
-            weapon_sub_type = WeaponSubType.get_enum_from_string(word)
+def get_criteria_string(query):
+    """
+    Describe the slot, subtype, damage type and minimum power of a parsed query, like " of type
+    Energy of subtype Hand Cannon". Returns an empty string if the query has none of them
+    """
+    criteria = ''
+    if query.weapon_type is not None:
+        criteria += ' of type {}'.format(WeaponType.get_string_representation(query.weapon_type))
+    if query.weapon_sub_type is not None:
+        criteria += ' of subtype {}'.format(WeaponSubType.get_string_representation(
+            query.weapon_sub_type))
+    if query.damage_type is not None:
+        criteria += ' with damage type {}'.format(DamageType.get_string_representation(
+            query.damage_type))
+    if query.min_power is not None:
+        criteria += ' with power {} or higher'.format(query.min_power)
+    return criteria
+
+
+async def report_error(ctx, session, error):
+    """
+    Tell the viewers about an error raised by a command. Errors from failed API calls, i.e.
+    transfers or equips that failed and Bungie being unavailable, are also saved along with the
+    flight recorder's recent API calls and the state of the inventory snapshot, so that they can
+    be looked into later
+    """
+    if isinstance(error, (TransferOrEquipError, BungieUnavailableError)):
+        try:
+            session.dump_flight_recorder(type(error).__name__, command=ctx.content,
+                                         user=ctx.author.name, error=str(error))
+        except Exception:
+            traceback.print_exc()
+    await rate_limited_send(ctx, 'An error occurred: {}'.format(error))
+
+
+async def report_unexpected_error(ctx, session):
+    """
+    Handle an unexpected error in a command. The traceback is printed, and saved along with the
+    flight recorder's recent API calls and the state of the inventory snapshot, while viewers are
+    only told that something went wrong. Must be called from an except block
+    """
+    traceback.print_exc()
+    try:
+        session.dump_flight_recorder('Unexpected error', command=ctx.content,
+                                     user=ctx.author.name, traceback=traceback.format_exc())
+    except Exception:
+        traceback.print_exc()
+    await rate_limited_send(ctx, 'An unexpected error occurred. Details have been saved for the '
+                                 'streamer')
+
+
+async def random_weapon_action(ctx, session, query, equip):
+    """
+    Equip or search for a random weapon, with the optional constraints from the parsed query. For
+    valid weapon type constraints, see WeaponType.ALIASES. For valid weapon subtype constraints,
+    see WeaponSubType.ALIASES. If equip is true, select from the available options and equip the
+    chosen weapon. Otherwise, display the matching options to the viewers
+    """
+    weapon_type = query.weapon_type
+    weapon_sub_type = query.weapon_sub_type
+    damage_type = query.damage_type
+    min_power = query.min_power
+
+    def select():
+        return session.profile.active_character.select_random_weapon(
+            weapon_type=weapon_type,
+            weapon_sub_type=weapon_sub_type,
+            damage_type=damage_type,
+            min_power=min_power)
 
     try:
         # Tell the viewers what it understood from the command
@@ -178,50 +464,72 @@ async def random_weapon_action(ctx, equip):
             msg = 'Searching for weapons'
         if weapon_type is None and weapon_sub_type is None:
             msg += ' of any type'
-        if weapon_type is not None:
-            msg += ' of type {}'.format(WeaponType.get_string_representation(weapon_type))
-        if weapon_sub_type is not None:
-            msg += ' of subtype {}'.format(WeaponSubType.get_string_representation(weapon_sub_type))
+        msg += get_criteria_string(query)
         await rate_limited_send(ctx, msg)
 
-        # Choose a random weapon, given the provided constraints
-        chosen_weapon, options = application.profile.active_character.select_random_weapon(
-            weapon_type=weapon_type,
-            weapon_sub_type=weapon_sub_type)
-
         if equip:
+            # Choose a random weapon, given the provided constraints
+            chosen_weapon, options = await session.run(select)
+
             # Tell the viewers what it selected
             await rate_limited_send(ctx, 'Selected {} from {} possibilities. Now equipping...'.format(
                 chosen_weapon.name, len(options)))
 
             # Attempt to equip
-            application.profile.active_character.equip_weapon(chosen_weapon)
+            equipped = await session.run(
+                lambda: session.profile.active_character.equip_weapon(chosen_weapon))
 
             # Tell users equipping was successful
-            await rate_limited_send(ctx, 'Successfully equipped {}'.format(chosen_weapon.name))
+            await send_equip_result(ctx, chosen_weapon.name, equipped)
         else:
             # Tell the viewers what was found
-            if weapon_type is None and weapon_sub_type is None:
-                criteria = 'All weapons'
-            else:
-                criteria = 'Weapons'
-                if weapon_type is not None:
-                    criteria += ' of type {}'.format(WeaponType.get_string_representation(
-                        weapon_type))
-                if weapon_sub_type is not None:
-                    criteria += ' of subtype {}'.format(WeaponSubType.get_string_representation(
-                        weapon_sub_type))
-            await rate_limited_send(ctx, get_weapons_string(options, criteria))
+            criteria = get_criteria_string(query)
+            criteria = 'Weapons' + criteria if criteria else 'All weapons'
+
+            await send_search_result(
+                ctx,
+                session,
+                ('criteria', weapon_type, weapon_sub_type, damage_type, min_power),
+                select,
+                criteria)
     # If a custom error was returned, show the error message
     except Error as e:
-        await rate_limited_send(ctx, 'An error occurred: {}'.format(e))
-    # If a totally unexpected error occurred, show detailed debug info
-    except Exception as e:
-        await rate_limited_send(ctx, 'An unexpected error occurred. Detailed debug information: '
-                                     '{}'.format(traceback.format_exc()))
+        await report_error(ctx, session, e)
+    # If a totally unexpected error occurred, save detailed debug info for the streamer
+    except Exception:
+        await report_unexpected_error(ctx, session)
 
 
-async def named_weapon_action(ctx, requested_weapon, equip):
+async def loadout_action(ctx, session, weapon_types):
+    """
+    Equip a random weapon in each of the given slots (or all slots, if none are given) with a single
+    batched equip
+    """
+    try:
+        await rate_limited_send(ctx, 'Now equipping a random loadout')
+
+        # Choose a weapon for each slot
+        chosen_weapons = await session.run(
+            lambda: session.profile.active_character.select_random_loadout(weapon_types))
+
+        weapon_names = ', '.join(x.name for x in chosen_weapons)
+        await rate_limited_send(ctx, 'Selected {}. Now equipping...'.format(weapon_names))
+
+        # Attempt to equip
+        equipped = await session.run(
+            lambda: session.profile.active_character.equip_weapons(chosen_weapons))
+
+        # Tell users equipping was successful
+        await send_equip_result(ctx, weapon_names, equipped)
+    # If a custom error was returned, show the error message
+    except Error as e:
+        await report_error(ctx, session, e)
+    # If a totally unexpected error occurred, save detailed debug info for the streamer
+    except Exception:
+        await report_unexpected_error(ctx, session)
+
+
+async def named_weapon_action(ctx, session, requested_weapon, equip):
     """
     Select a weapon by name, and either equip it (if equip is True) or display all weapons matching
     that name (if equip is False)
@@ -237,11 +545,12 @@ async def named_weapon_action(ctx, requested_weapon, equip):
         else:
             await rate_limited_send(ctx, 'Searching for weapons matching "{}"'.format(requested_weapon))
 
-        # Select a weapon
-        chosen_weapon, options = application.profile.active_character.select_weapon_by_name(
-            requested_weapon)
-
         if equip:
+            # Select a weapon
+            chosen_weapon, options = await session.run(
+                lambda: session.profile.active_character.select_weapon_by_name(requested_weapon))
+            record_demand(session, options)
+
             # If multiple options, tell the viewers how many options were found and which was chosen
             if len(options) > 1:
                 await rate_limited_send(ctx, '{} options found matching "{}". Selected {}. Now '
@@ -254,18 +563,25 @@ async def named_weapon_action(ctx, requested_weapon, equip):
                     chosen_weapon.name))
 
             # Attempt to equip
-            application.profile.active_character.equip_weapon(chosen_weapon)
+            equipped = await session.run(
+                lambda: session.profile.active_character.equip_weapon(chosen_weapon))
 
             # Tell users equipping was successful
-            await rate_limited_send(ctx, 'Successfully equipped {}'.format(chosen_weapon.name))
+            await send_equip_result(ctx, chosen_weapon.name, equipped)
         else:
-            # Tell the viewers what was found
+            # Tell the viewers what was found. The matches count as demand for the pre-stager,
+            # even when they come from the search cache
             criteria = 'Weapons with names matching "{}"'.format(requested_weapon)
-            await rate_limited_send(ctx, get_weapons_string(options, criteria))
+            await send_search_result(
+                ctx,
+                session,
+                ('name', ' '.join(requested_weapon.lower().split())),
+                lambda: session.profile.active_character.select_weapon_by_name(requested_weapon),
+                criteria,
+                partial(record_demand, session))
     # If a custom error was returned, show the error message
     except Error as e:
-        await rate_limited_send(ctx, 'An error occurred: {}'.format(e))
-    # If a totally unexpected error occurred, show detailed debug info
-    except Exception as e:
-        await rate_limited_send(ctx, 'An unexpected error occurred. Detailed debug information: '
-                                     '{}'.format(traceback.format_exc()))
+        await report_error(ctx, session, e)
+    # If a totally unexpected error occurred, save detailed debug info for the streamer
+    except Exception:
+        await report_unexpected_error(ctx, session)
@@ -0,0 +1,184 @@
+from threading import Lock
+import time
+
+
+# Estimated number of Bungie API calls made by each command. Equips fan out into an inventory
+# scan, owner lookups and several transfers, while searches only need the inventory snapshot
+DEFAULT_COSTS = {
+    'equip': 8,
+    'loadout': 12,
+    'search': 4,
+}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. The bucket holds up to capacity tokens, and refills at refill_rate
+    tokens per second. Consuming more tokens than the bucket holds fails. clock returns the current
+    time in seconds, and can be replaced for testing
+    """
+
+    def __init__(self, capacity, refill_rate, clock=time.monotonic):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._clock = clock
+        self._tokens = capacity
+        self._last_refill = clock()
+        self._lock = Lock()
+
+    def _refill(self):
+        """
+        Add the tokens accumulated since the last refill. Must be called with the lock held
+        """
+        now = self._clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last_refill) * self.refill_rate)
+        self._last_refill = now
+
+    @property
+    def tokens(self):
+        """
+        Number of tokens currently in the bucket
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_consume(self, amount):
+        """
+        Remove amount tokens from the bucket if there are enough. Returns True if they were removed
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < amount:
+                return False
+            self._tokens -= amount
+            return True
+
+    def refund(self, amount):
+        """
+        Return tokens to the bucket, e.g. when a command turned out to be cheaper than estimated
+        """
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def seconds_until(self, amount):
+        """
+        Seconds until the bucket will hold amount tokens
+        """
+        with self._lock:
+            self._refill()
+            return max(0, (amount - self._tokens) / self.refill_rate)
+
+
+class CommandBudget:
+    """
+    Limits on how often chat commands can be used, to protect the Bungie API key's rate limit. Each
+    viewer has a cooldown between commands in each channel, and all commands in all channels draw
+    from one token bucket, where each command costs its estimated number of Bungie API calls.
+    clock is as for TokenBucket
+    """
+
+    def __init__(self, user_cooldown=10, capacity=60, refill_rate=1.0, costs=None,
+                 clock=time.monotonic):
+        self.user_cooldown = user_cooldown
+        self._clock = clock
+        self.bucket = TokenBucket(capacity, refill_rate, clock)
+        self.costs = dict(DEFAULT_COSTS, **(costs or {}))
+
+        self._last_command_times = {}  # Keyed on (channel, user)
+        self._last_notice_times = {}  # When each viewer was last told they were rejected
+        self._lock = Lock()
+
+        # Counters for monitoring
+        self.accepted = 0
+        self.rejected_cooldown = 0
+        self.rejected_global = 0
+        self.refunded_tokens = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a CommandBudget from the "command_budget" section of config.json, if present
+        """
+        budget_config = config.get('command_budget', {})
+        return cls(user_cooldown=budget_config.get('user_cooldown', 10),
+                   capacity=budget_config.get('global_capacity', 60),
+                   refill_rate=budget_config.get('global_refill_per_second', 1.0),
+                   costs=budget_config.get('costs'))
+
+    def cost(self, command):
+        """
+        Estimated number of Bungie API calls made by a command
+        """
+        return self.costs.get(command, 0)
+
+    def try_acquire(self, channel, user, command, exempt_from_cooldown=False):
+        """
+        Check whether a viewer may run a command now, and if so, charge the command's cost to the
+        budget. Returns a tuple of whether the command may run, and if not, the number of seconds
+        after which it could
+        """
+        now = self._clock()
+        key = (channel, user)
+        with self._lock:
+            if not exempt_from_cooldown:
+                last_command_time = self._last_command_times.get(key)
+                if last_command_time is not None and \
+                        now - last_command_time < self.user_cooldown:
+                    self.rejected_cooldown += 1
+                    return False, self.user_cooldown - (now - last_command_time)
+
+            cost = self.cost(command)
+            if not self.bucket.try_consume(cost):
+                self.rejected_global += 1
+                return False, self.bucket.seconds_until(cost)
+
+            self.accepted += 1
+            self._last_command_times[key] = now
+
+            # Forget viewers whose cooldown is long over, so this doesn't grow forever
+            if len(self._last_command_times) > 10000:
+                self._last_command_times = {k: v for k, v in self._last_command_times.items()
+                                            if now - v < self.user_cooldown}
+        return True, 0
+
+    def should_notify(self, channel, user):
+        """
+        Returns True if a viewer whose command was rejected should be told so. Each viewer is told
+        at most once per user_cooldown seconds, so spamming commands doesn't also spam chat
+        """
+        now = self._clock()
+        key = (channel, user)
+        with self._lock:
+            last_notice_time = self._last_notice_times.get(key)
+            if last_notice_time is not None and now - last_notice_time < self.user_cooldown:
+                return False
+            self._last_notice_times[key] = now
+
+            # Forget viewers who were told long ago, so this doesn't grow forever
+            if len(self._last_notice_times) > 10000:
+                self._last_notice_times = {k: v for k, v in self._last_notice_times.items()
+                                           if now - v < self.user_cooldown}
+        return True
+
+    def refund(self, amount):
+        """
+        Return part of a command's cost to the budget, when it made fewer API calls than estimated
+        """
+        if amount > 0:
+            self.bucket.refund(amount)
+            self.refunded_tokens += amount
+
+    def get_status(self):
+        """
+        Returns a dictionary of the budget's counters, for monitoring
+        """
+        return {
+            'tokens': round(self.bucket.tokens, 1),
+            'capacity': self.bucket.capacity,
+            'accepted': self.accepted,
+            'rejected_cooldown': self.rejected_cooldown,
+            'rejected_global': self.rejected_global,
+            'refunded_tokens': self.refunded_tokens
+        }
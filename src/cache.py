@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache. Once maxsize entries are stored, adding a new entry evicts
+    the entry that was used least recently
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for key, marking it as recently used, or default if not present
+        """
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        """
+        Store a value for key, evicting the least recently used entry if the cache is full
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._data.clear()
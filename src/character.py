@@ -1,12 +1,43 @@
 from datetime import datetime
+from functools import partial
 import random
 import time
 
 import requests.exceptions
 
-from src.enums import WeaponSubType, WeaponType
-from src.exceptions import NoAvailableWeaponsError, InvalidSelectionError, TransferOrEquipError
+from src.api import is_outage
+from src.enums import DamageType, WeaponSubType, WeaponType
+from src.exceptions import BungieUnavailableError, NoAvailableWeaponsError, \
+    InvalidSelectionError, TransferOrEquipError
 from src.item import Weapon
+from src.plan import Plan
+
+
+# Bungie error code for a successful operation, as reported per item by EquipItems
+SUCCESS_ERROR_CODE = 1
+
+# Bungie error code for an item that is not where the request said it was
+ITEM_NOT_FOUND_ERROR_CODE = 1623
+
+# Maximum number of unequipped weapons a character can hold in each slot
+SLOT_CAPACITY = 9
+
+# Maximum number of items the vault can hold
+VAULT_CAPACITY = 700
+
+# Activity modes in which items can be equipped through the API. Outside of activities, the
+# activity mode is None (0), which covers being in orbit or offline
+EQUIPPABLE_ACTIVITY_MODES = (0, 40)  # None, Social (e.g. the Tower)
+
+
+def get_error_code(response):
+    """
+    Returns the Bungie error code of a failed API response, or None if it has none
+    """
+    try:
+        return response.json().get('ErrorCode')
+    except ValueError:
+        return None
 
 
 class Character:
@@ -22,9 +53,10 @@ class Character:
             return False
         return self.character_id == obj.character_id
 
-    def __init__(self, api, data, profile):
+    def __init__(self, api, data, profile, activities=None):
         self.api = api
         self.data = data
+        self.activities = activities or {}  # CharacterActivities component, if requested
 
         # Needed because some equip operations require moving items from other characters, which is
         # an account-level operation
@@ -58,6 +90,18 @@ class Character:
         """
         return datetime.strptime(self.data['dateLastPlayed'], '%Y-%m-%dT%H:%M:%SZ')
 
+    @property
+    def in_activity(self):
+        """
+        Whether the character is in an activity where items can't be equipped through the API, as
+        of when the character was fetched. Items can only be equipped in orbit, in social spaces,
+        or while offline
+        """
+        if not self.activities.get('currentActivityHash'):
+            return False
+        mode = self.activities.get('currentActivityModeType') or 0
+        return mode not in EQUIPPABLE_ACTIVITY_MODES
+
     @property
     def equipped_weapons(self):
         """
@@ -96,20 +140,23 @@ class Character:
         items = self.api.make_get_call(
             '/Destiny2/{}/Profile/{}/Character/{}'.format(
                 self.membership_type, self.membership_id, self.character_id),
-            {'components': '201,205'}
+            {'components': '201,205,300'}
         )['Response']
+        instances = items.get('itemComponents', {}).get('instances', {}).get('data', {})
         all_unequipped_weapons = [
-            Weapon(x, self.api.manifest) for x in items['inventory']['data']['items']
+            Weapon(x, self.api.manifest, instances.get(x['itemInstanceId']))
+            for x in items['inventory']['data']['items']
             if self.api.manifest.item_data[x['itemHash']]['itemType'] == 3]
         equipped_weapons = [
-            Weapon(x, self.api.manifest) for x in items['equipment']['data']['items']
+            Weapon(x, self.api.manifest, instances.get(x['itemInstanceId']))
+            for x in items['equipment']['data']['items']
             if self.api.manifest.item_data[x['itemHash']]['itemType'] == 3]
 
         # This is to exclude postmaster weapons, which are in a separate bucket
         owned_unequipped_weapons = [x for x in all_unequipped_weapons
-                                    if x.data['bucketHash'] in WeaponType.values()]
+                                    if x.bucket_hash in WeaponType.values()]
         postmaster_weapons = [x for x in all_unequipped_weapons
-                              if x.data['bucketHash'] not in WeaponType.values()]
+                              if x.bucket_hash not in WeaponType.values()]
 
         return {'equipped': equipped_weapons,
                 'unequipped': owned_unequipped_weapons,
@@ -143,84 +190,274 @@ class Character:
             raise TransferOrEquipError('Unable to equip item. Error message: {}'.format(
                 response['Message']))
 
-    def equip_weapon(self, weapon, retries=3):
+    def equip_owned_weapons(self, weapons):
         """
-        Attempt to equip the specified weapon on this character, transferring from other characters
-        and from the vault as necessary
+        Equip several weapons that are currently in the character's possession, with a single
+        EquipItems call
         """
-        while True:
-            try:
-                # Determine which character has the item, or if it is in the vault
-                owner = self.profile.get_weapon_owner(weapon)
+        # Items are equipped in order. Equip exotics last, so that an exotic being replaced in
+        # another slot is already gone by the time the new exotic is equipped
+        weapons = sorted(weapons, key=lambda x: x.is_exotic)
+        response = self.api.make_post_call(
+            '/Destiny2/Actions/Items/EquipItems',
+            {
+                'itemIds': [x.item_id for x in weapons],
+                'characterId': self.character_id,
+                'membershipType': self.membership_type
+            }
+        )
+        if response['ErrorStatus'] != 'Success':
+            raise TransferOrEquipError('Unable to equip items. Error message: {}'.format(
+                response['Message']))
 
-                # If item is not owned by current character
-                if owner != self:
-                    # If owned by other character, transfer to vault
-                    if owner is not None:
-                        owner.transfer_to_vault(weapon)
+        # EquipItems reports success or failure for each item individually
+        weapons_by_id = {x.item_id: x for x in weapons}
+        failed = [weapons_by_id[x['itemInstanceId']].name
+                  for x in response['Response']['equipResults']
+                  if x['equipStatus'] != SUCCESS_ERROR_CODE]
+        if failed:
+            raise TransferOrEquipError('Unable to equip {}'.format(', '.join(failed)))
 
-                    # Get the number of weapons in the same slot as the requested weapon
-                    same_slot_weapons = [
-                        x for x in self.unequipped_weapons if x.type == weapon.type]
+    def plan_transfers(self, weapons):
+        """
+        Plan the transfers needed to bring the given weapons (at most one per slot) into this
+        character's possession. Returns the Plan, and the steps which must finish before the weapons
+        can be equipped. Moving a weapon from another character to the vault and making room in
+        this character's slot don't depend on each other, so they can run at the same time. Only
+        the transfer of each weapon from the vault to this character has to wait for both.
+
+        Where each weapon is, and what this character holds, are taken from the inventory snapshot,
+        so planning makes no API calls while the snapshot is fresh. If the snapshot turns out to be
+        stale, a transfer fails with DestinyItemNotFound, and _run_equip looks up the item then
+        """
+        plan = Plan()
+
+        # Determine which character has each item, or if it is in the vault
+        owners = {x: self.profile.get_snapshot_owner(x) for x in weapons}
+        incoming = [x for x in weapons if owners[x] != self]
+        if not incoming:
+            return plan, []
+
+        unequipped = self.profile.get_snapshot_unequipped_weapons(self)
+        final_steps = []
+        for weapon in incoming:
+            # If owned by other character, transfer to vault
+            vault_step = None
+            if owners[weapon] is not None:
+                vault_step = plan.add('Transfer {} to the vault'.format(weapon.name),
+                                      partial(owners[weapon].transfer_to_vault, weapon),
+                                      item=weapon, destination=None)
+
+            # If necessary, move last weapon in that slot to the vault to make room
+            room_step = None
+            same_slot_weapons = [x for x in unequipped
+                                 if x.type == weapon.type and x not in weapons]
+            if len(same_slot_weapons) >= SLOT_CAPACITY:
+                room_step = plan.add(
+                    'Transfer {} to the vault to make room'.format(same_slot_weapons[-1].name),
+                    partial(self.transfer_to_vault, same_slot_weapons[-1]),
+                    item=same_slot_weapons[-1], destination=None)
+
+            # Transfer from vault to current character
+            final_steps.append(plan.add('Transfer {} to the character'.format(weapon.name),
+                                        partial(self.transfer_to_character, weapon),
+                                        [vault_step, room_step],
+                                        item=weapon, destination=self))
+
+        return plan, final_steps
+
+    def preflight(self, weapons):
+        """
+        Check whether the given weapons (at most one per slot) can be equipped on this character,
+        using only the inventory snapshot, so that equips which are bound to fail are caught before
+        any API calls are made. Raises InvalidSelectionError if equipping them would leave more than
+        one exotic equipped, or TransferOrEquipError if the vault has no room for the transfers.
+        Returns True if the weapons can be equipped, or False if they can only be transferred to
+        this character, because it is in an activity
+        """
+        # Only one exotic can be equipped, counting those staying equipped in other slots
+        slots = set(x.type for x in weapons)
+        new_exotics = [x for x in weapons if x.is_exotic]
+        kept_exotics = [x for x in self.profile.get_snapshot_equipped_weapons(self)
+                        if x.is_exotic and x.type not in slots]
+        if len(new_exotics) > 1:
+            raise InvalidSelectionError('Cannot equip {}, because only one exotic weapon can be '
+                                        'equipped at a time'.format(
+                                            ' and '.join(x.name for x in new_exotics)))
+        if new_exotics and kept_exotics:
+            raise InvalidSelectionError('Cannot equip {}, because the exotic {} is already '
+                                        'equipped in another slot'.format(new_exotics[0].name,
+                                                                          kept_exotics[0].name))
+
+        # Weapons coming from other characters, and weapons moved out of the way in full slots,
+        # pass through the vault before anything leaves it
+        incoming = [x for x in weapons if self.profile.get_snapshot_owner(x) != self]
+        unequipped = self.profile.get_snapshot_unequipped_weapons(self)
+        to_vault = len([x for x in incoming if self.profile.get_snapshot_owner(x) is not None])
+        for weapon in incoming:
+            same_slot_weapons = [x for x in unequipped
+                                 if x.type == weapon.type and x not in weapons]
+            if len(same_slot_weapons) >= SLOT_CAPACITY:
+                to_vault += 1
+        if to_vault and self.profile.vault_item_count + to_vault > VAULT_CAPACITY:
+            raise TransferOrEquipError('The vault is too full to make the transfers needed to '
+                                       'equip {}'.format(', '.join(x.name for x in incoming)))
+
+        return not self.in_activity
+
+    def _move_weapon(self, weapon, location, destination):
+        """
+        Move a weapon from location to destination, where each is a character, or None for the
+        vault. Moving between characters goes through the vault
+        """
+        if location is not None:
+            location.transfer_to_vault(weapon)
+        if destination is not None:
+            destination.transfer_to_character(weapon)
 
-                    # If necessary, move last weapon in that slot to the vault to make room
-                    if len(same_slot_weapons) == 9:
-                        self.transfer_to_vault(same_slot_weapons[-1])
+    def _reconcile(self, plan, error):
+        """
+        After a transfer in plan failed because the item was not found where it was expected (which
+        happens when Bungie's data is stale), look up where that one item actually is, and correct
+        the failed step, so the plan can resume from it. Returns False if the failure can't be
+        corrected this way, in which case the whole plan should be made again
+        """
+        step = plan.failed_step if plan is not None else None
+        if step is None or step.item is None or \
+                get_error_code(error.response) != ITEM_NOT_FOUND_ERROR_CODE:
+            return False
 
-                    # Transfer from vault to current character
-                    self.transfer_to_character(weapon)
+        try:
+            location = self.profile.locate_weapon(step.item)
+        except requests.exceptions.HTTPError:
+            return False  # E.g. the item no longer exists
 
-                # Finally, equip the weapon
-                self.equip_owned_weapon(weapon)
+        if location == step.destination:
+            step.done = True  # Already where it was being moved to
+        else:
+            step.function = partial(self._move_weapon, step.item, location, step.destination)
+        return True
 
-                self.profile.last_equip_time = time.time()
+    def _run_equip(self, weapons, equip, retries):
+        """
+        Plan and run the transfers needed for the given weapons, then call equip, unless it is None,
+        in which case the weapons are only transferred. If a transfer fails because an item was not
+        where it was expected, only that item is looked up, and the plan resumes from the failed
+        step. If any API call fails in another way, the whole thing is planned again. Either way,
+        up to the given number of retries are made. Outages, timeouts and connection failures are
+        not retried, and raise BungieUnavailableError
+        """
+        plan = None
+        while True:
+            try:
+                if plan is None:
+                    plan, transfer_steps = self.plan_transfers(weapons)
+                    if equip is not None:
+                        plan.add('Equip', equip, transfer_steps)
+                plan.run()
+
+                # Keep the snapshot up to date with what was moved, rather than fetching it again
+                moves = [(x.item, x.destination, False) for x in plan.steps if x.item is not None]
+                if equip is not None:
+                    self.profile.last_equip_time = time.time()
+                    self.profile.record_equipped(weapons)
+                    moves += [(x, self, True) for x in weapons]
+                self.profile.record_moves(moves)
             except requests.exceptions.HTTPError as e:
+                # There is no point retrying while Bungie is down
+                if is_outage(e.response):
+                    self.profile.invalidate_inventory()
+                    raise BungieUnavailableError('The Bungie API appears to be down, possibly for '
+                                                 'maintenance. Please try again later')
                 if retries <= 0:
-                    response_json = e.response.json()
-                    if response_json['ErrorCode'] == 1623:  # Item requested was not found
+                    # Some transfers may have gone through before the failure
+                    self.profile.invalidate_inventory()
+                    if get_error_code(e.response) == ITEM_NOT_FOUND_ERROR_CODE:
                         raise TransferOrEquipError(
                             'Unable to transfer or equip item. Please try again')
                     else:
-                        raise TransferOrEquipError(response_json['Message'])
+                        raise TransferOrEquipError(e.response.json()['Message'])
                 retries -= 1
-                time.sleep(3)
+                if not self._reconcile(plan, e):
+                    self.profile.invalidate_inventory()
+                    plan = None
+                    time.sleep(3)
+            except BungieUnavailableError:
+                # The circuit breaker opened part way through the plan, after some transfers may
+                # have gone through
+                self.profile.invalidate_inventory()
+                raise
+            except requests.exceptions.RequestException:
+                # A timeout or connection failure, which the circuit breaker counts as an outage
+                self.profile.invalidate_inventory()
+                raise BungieUnavailableError('Unable to reach the Bungie API. Please try again '
+                                             'later')
             else:
                 break
 
-    def select_random_weapon(self, weapon_type=None, weapon_sub_type=None):
+    def equip_weapons(self, weapons, retries=3):
+        """
+        Attempt to equip several weapons (at most one per slot) on this character, transferring from
+        other characters and from the vault as necessary. Transfers that don't depend on each other
+        run concurrently, and all weapons are then equipped with a single EquipItems call. The
+        weapons are checked with preflight first. If the character is in an activity, the weapons
+        are only transferred. Returns True if they were equipped, or False if only transferred
+        """
+        can_equip = self.preflight(weapons)
+        self._run_equip(weapons, partial(self.equip_owned_weapons, weapons) if can_equip else None,
+                        retries)
+        return can_equip
+
+    def equip_weapon(self, weapon, retries=3):
+        """
+        Attempt to equip the specified weapon on this character, transferring from other characters
+        and from the vault as necessary. Transfers that don't depend on each other run concurrently.
+        The weapon is checked with preflight first. If the character is in an activity, the weapon
+        is only transferred. Returns True if it was equipped, or False if only transferred
+        """
+        can_equip = self.preflight([weapon])
+        self._run_equip([weapon], partial(self.equip_owned_weapon, weapon) if can_equip else None,
+                        retries)
+        return can_equip
+
+    def get_equipped_exotic_slots(self):
+        """
+        Returns the set of slots (WeaponType values) in which this character has an exotic weapon
+        equipped, according to the inventory snapshot. Random selections depend on it, since only
+        one exotic can be equipped at a time
+        """
+        return frozenset(x.type for x in self.profile.get_snapshot_equipped_weapons(self)
+                         if x.is_exotic)
+
+    def select_random_weapon(self, weapon_type=None, weapon_sub_type=None, damage_type=None,
+                             min_power=None):
         """
         Select a random weapon, given certain optional constraints. For valid weapon type
         constraints, see WeaponType.get_enum_from_string. For valid weapon subtype constraints, see
-        WeaponSubType.get_enum_from_string
+        WeaponSubType.get_enum_from_string. damage_type is a DamageType enum value, and min_power
+        is the lowest power level allowed. The selection is weighted as configured for the
+        profile (see WeaponSampler)
         """
         if weapon_sub_type == WeaponSubType.TRACE_RIFLE:
             raise InvalidSelectionError('Random selections of Trace Rifles are not supported at '
                                         'this time. However, you may use !equip to equip a '
                                         'specific trace rifle')
 
-        weapons = self.profile.get_all_weapons()
-
-        # Restrict by weapon subtype if specified
-        if weapon_sub_type is not None:
-            weapons = [x for x in weapons if x.sub_type == weapon_sub_type]
-
         # If weapon type not specified, and an exotic weapon is equipped, then exclude exotics
-        # from the pool of weapons to choose from
-        if weapon_type is None:
-            for weapon in self.equipped_weapons:
-                if weapon.is_exotic:
-                    weapons = [x for x in weapons if not x.is_exotic]
-                    break
+        # from the pool of weapons to choose from. Else if weapon type is specified, check if an
+        # exotic is equipped in one of the other slots, and if so, exclude exotics
+        allow_exotics = not any(weapon_type is None or x != weapon_type
+                                for x in self.get_equipped_exotic_slots())
+
+        # Slot, subtype and exotic combinations have precomputed selections. Other criteria are
+        # filtered on the inventory table
+        sampler = self.profile.get_sampler()
+        precomputed = damage_type is None and min_power is None
+        if precomputed:
+            weapons = sampler.options(weapon_type, weapon_sub_type, allow_exotics)
         else:
-            # Else if weapon type is specified, restrict to the appropriate type
-            weapons = [x for x in weapons if x.type == weapon_type]
-
-            # Then check if exotic is equipped in one of the other slots. If so, exclude exotics
-            # from the pool of weapons to choose from
-            for weapon in self.equipped_weapons:
-                if weapon.type != weapon_type and weapon.is_exotic:
-                    weapons = [x for x in weapons if not x.is_exotic]
-                    break
+            weapons = self.profile.get_inventory_table().select(
+                weapon_type, weapon_sub_type, damage_type, min_power, allow_exotics)
 
         if len(weapons) == 0:
             msg = 'No weapons available to equip'
@@ -230,30 +467,57 @@ class Character:
             if weapon_sub_type is not None:
                 msg += ' with weapon subtype {}'.format(
                     WeaponSubType.get_string_representation(weapon_sub_type))
+            if damage_type is not None:
+                msg += ' with damage type {}'.format(
+                    DamageType.get_string_representation(damage_type))
+            if min_power is not None:
+                msg += ' with power {} or higher'.format(min_power)
             raise NoAvailableWeaponsError(msg)
 
-        return random.choice(weapons), weapons
+        if precomputed:
+            return sampler.sample(weapon_type, weapon_sub_type, allow_exotics), weapons
+        return sampler.choose(weapons), weapons
 
-    def select_weapon_by_name(self, weapon_name):
+    def select_random_loadout(self, weapon_types=None):
         """
-        Search for and select a weapon by name. If one or more exact matches is found, choose one of
-        those. If not, then look for partial matches and choose one of those. The matching is not
-        case-sensitive
+        Select a random weapon for each of the given weapon types (slots), or for all three slots if
+        none are given. As with select_random_weapon, at most one exotic will end up equipped,
+        counting the weapons already equipped in slots that are not being changed. Returns a list
+        of the chosen weapons
         """
-        weapon_name_lowercase = weapon_name.lower()
+        weapon_types = list(weapon_types or WeaponType.values())
 
-        weapons = self.profile.get_all_weapons()
+        # An exotic can only be chosen if no exotic stays equipped in another slot
+        exotic_chosen = any(x not in weapon_types for x in self.get_equipped_exotic_slots())
 
-        # Look for exact matches
-        matching = [x for x in weapons if x.name.lower() == weapon_name_lowercase]
+        sampler = self.profile.get_sampler()
 
-        # If none found, look for partial matches
-        if len(matching) == 0:
-            matching = [x for x in weapons if weapon_name_lowercase in x.name.lower()]
+        # Fill the slots in random order, so no slot is favored when it comes to exotics
+        random.shuffle(weapon_types)
+        chosen = []
+        for weapon_type in weapon_types:
+            weapon = sampler.sample(weapon_type, allow_exotics=not exotic_chosen)
+            if weapon is None:
+                raise NoAvailableWeaponsError('No weapons available to equip with weapon type '
+                                              '{}'.format(WeaponType.get_string_representation(
+                                                  weapon_type)))
+            exotic_chosen = exotic_chosen or weapon.is_exotic
+            chosen.append(weapon)
 
+        # Return in slot order, for displaying to viewers
+        return sorted(chosen, key=lambda x: WeaponType.values().index(x.type))
+
+    def select_weapon_by_name(self, weapon_name):
+        """
+        Search for and select a weapon by name. If one or more exact matches is found, choose one of
+        those. If not, then look for partial matches and choose one of those. If there are still no
+        matches, allow for typos, and choose one of the closest matches (see FuzzyNameIndex). The
+        matching is not case-sensitive
+        """
+        matching = self.profile.find_weapons_by_name(weapon_name)
         if len(matching) == 0:
             raise NoAvailableWeaponsError(
                 'Could not find any unequipped weapons matching "{}"'.format(weapon_name))
 
         # In case there's multiple options, choose a random one
-        return random.choice(matching), matching
+        return self.profile.get_sampler().choose(matching), matching
@@ -0,0 +1,134 @@
+from threading import Lock, Timer
+import time
+
+from src.exceptions import BungieUnavailableError
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for calls to the Bungie API. After failure_threshold consecutive failures that
+    indicate an outage (e.g. Bungie maintenance), the breaker opens, and calls fail instantly with
+    a BungieUnavailableError instead of going through retries and timeouts. While open, a probe is
+    sent every reset_timeout seconds. When a probe succeeds, the breaker closes again.
+
+    If no probe function is given, the first call made after reset_timeout is let through as the
+    probe instead
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30, probe=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+
+        self.state = CircuitBreaker.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.rejected_calls = 0  # Total number of calls rejected while open
+        self.times_opened = 0
+
+        self._lock = Lock()
+        self._probe_timer = None
+
+    @property
+    def retry_in(self):
+        """
+        Seconds until the next probe, if the breaker is open
+        """
+        if self.opened_at is None:
+            return 0
+        return max(0, int(self.opened_at + self.reset_timeout - time.time()))
+
+    def before_call(self):
+        """
+        Call before making an API call. Raises BungieUnavailableError if the breaker is open. If
+        the breaker is open and it is time for a probe, and no probe function was given, this call
+        is let through as the probe
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return
+            if self.state == CircuitBreaker.OPEN and self.probe is None and self.retry_in == 0:
+                self.state = CircuitBreaker.HALF_OPEN
+                return
+            self.rejected_calls += 1
+        raise BungieUnavailableError('The Bungie API appears to be down, possibly for '
+                                     'maintenance. Try again in {} seconds'.format(
+                                         max(self.retry_in, 1)))
+
+    def record_success(self):
+        """
+        Call after an API call succeeded, or failed for a reason that does not indicate an outage
+        """
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CircuitBreaker.CLOSED:
+                self._close()
+
+    def record_failure(self):
+        """
+        Call after an API call failed in a way that indicates an outage
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or \
+                    self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        """
+        Open the breaker, and schedule the next probe. Does nothing if it is already open, which
+        happens when calls that were in flight when it opened fail too, so that only one probe is
+        ever scheduled. Must be called with the lock held
+        """
+        if self.state == CircuitBreaker.OPEN:
+            return
+        self.times_opened += 1
+        self.state = CircuitBreaker.OPEN
+        self.opened_at = time.time()
+        if self.probe is not None:
+            self._probe_timer = Timer(self.reset_timeout, self._run_probe)
+            self._probe_timer.daemon = True
+            self._probe_timer.start()
+
+    def _close(self):
+        """
+        Close the breaker. Must be called with the lock held
+        """
+        self.state = CircuitBreaker.CLOSED
+        self.opened_at = None
+        if self._probe_timer is not None:
+            self._probe_timer.cancel()
+            self._probe_timer = None
+
+    def _run_probe(self):
+        """
+        Send a probe while the breaker is open. The probe function is expected to call
+        record_success or record_failure, so only unexpected exceptions are recorded here
+        """
+        with self._lock:
+            if self.state != CircuitBreaker.OPEN:
+                return
+            self.state = CircuitBreaker.HALF_OPEN
+        try:
+            self.probe()
+        except Exception:
+            pass
+        with self._lock:
+            # If the probe did not record its outcome, treat it as a failure
+            if self.state == CircuitBreaker.HALF_OPEN:
+                self._open()
+
+    def get_status(self):
+        """
+        Returns a dictionary describing the state of the breaker, for status reporting
+        """
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'retry_in': self.retry_in if self.state != CircuitBreaker.CLOSED else None,
+            'rejected_calls': self.rejected_calls,
+            'times_opened': self.times_opened
+        }
@@ -0,0 +1,44 @@
+"""
+JSON decoding for API responses and manifest rows. A faster optional backend (orjson or ujson) is
+used if one is installed, and the json module from the standard library is used otherwise
+"""
+
+import importlib
+import json
+
+
+# Optional backends, in order of preference
+OPTIONAL_BACKENDS = ('orjson', 'ujson')
+
+
+def get_backends():
+    """
+    Returns a dictionary mapping the name of each available backend to its loads function. The
+    standard library backend is always available, as "json"
+    """
+    backends = {}
+    for name in OPTIONAL_BACKENDS:
+        try:
+            backends[name] = importlib.import_module(name).loads
+        except ImportError:
+            pass
+    backends['json'] = json.loads
+    return backends
+
+
+def _select_backend():
+    """
+    Returns the name and loads function of the preferred available backend
+    """
+    name, backend_loads = next(iter(get_backends().items()))
+    return name, backend_loads
+
+
+BACKEND, _loads = _select_backend()
+
+
+def loads(data):
+    """
+    Deserialize a JSON document, given as str or bytes. Raises ValueError if it is not valid JSON
+    """
+    return _loads(data)
@@ -0,0 +1,48 @@
+from flask import abort, jsonify, request
+
+# This is just to appease IDE code analyzers by defining application explicitly in this module
+if False:
+    application = None
+
+# Debug endpoints only answer requests from the machine the bot is running on
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+@application.flask_app.route('/debug/calls', methods=['GET'])
+def debug_calls():
+    """
+    Endpoint showing the recent Bungie API calls of each channel from its flight recorder, and the
+    state of its inventory snapshot. A channel can be given with ?channel=<name>
+    """
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        abort(403)
+
+    if 'channel' in request.args:
+        session = application.get_session(request.args['channel'])
+        if session is None:
+            abort(404)
+        sessions = [session]
+    else:
+        sessions = application.sessions.values()
+
+    return jsonify({
+        x.channel: {
+            'calls': x.flight_recorder.get_calls(),
+            'dumps': x.flight_recorder.dumps,
+            'snapshot': x.describe_snapshot()
+        }
+        for x in sessions
+    })
+
+
+@application.flask_app.route('/debug/manifest', methods=['GET'])
+def debug_manifest():
+    """
+    Endpoint showing how each manifest table loaded so far was loaded: from its cache file, from
+    the manifest database or incrementally, how long it took, and the number of rows and the size
+    of its cache file
+    """
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        abort(403)
+
+    return jsonify({name: vars(stats) for name, stats in application.manifest.table_stats.items()})
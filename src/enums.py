@@ -1,3 +1,16 @@
+import re
+
+# Matches any character that is not a letter
+_NON_LETTERS = re.compile(r'[\W\d_]+')
+
+
+def normalize_word(word):
+    """
+    Remove all nonletters from a word of viewer chat input, and convert it to lowercase
+    """
+    return _NON_LETTERS.sub('', word).lower()
+
+
 class WeaponType:
     """
     Enum representing different weapon types. These values correspond to values used in the
@@ -8,6 +21,22 @@ class WeaponType:
     POWER = 953998645
     UNKNOWN = 0
 
+    # User-friendly names for each weapon type
+    NAMES = {
+        KINETIC: 'Kinetic',
+        ENERGY: 'Energy',
+        POWER: 'Power'
+    }
+
+    # Strings viewers may use for each weapon type. Note that both power and heavy are valid,
+    # because viewers might use either term
+    ALIASES = {
+        'kinetic': KINETIC,
+        'energy': ENERGY,
+        'power': POWER,
+        'heavy': POWER
+    }
+
     @staticmethod
     def values():
         return [WeaponType.KINETIC, WeaponType.ENERGY, WeaponType.POWER]
@@ -17,32 +46,20 @@ class WeaponType:
         """
         Get a user-friendly string representation of the weapon type
         """
-        return {
-            WeaponType.KINETIC: "Kinetic",
-            WeaponType.ENERGY: 'Energy',
-            WeaponType.POWER: 'Power'
-        }.get(weapon_type, 'Unknown')
+        return WeaponType.NAMES.get(weapon_type, 'Unknown')
 
     @staticmethod
     def get_enum_from_string(sub_type_string):
         """
         Convert a weapon type string to a weapon type enum value. Used for parsing viewer chat
-        input. Note that both power and heavy are valid, because viewers might use either term
+        input. For valid values, see WeaponType.ALIASES
         """
-        # Remove all nonletters, and convert to lowercase
-        sub_type_string = ''.join(ch for ch in sub_type_string if ch.isalpha()).lower()
-
-        return {
-            'kinetic': WeaponType.KINETIC,
-            'energy': WeaponType.ENERGY,
-            'power': WeaponType.POWER,
-            'heavy': WeaponType.POWER
-        }.get(sub_type_string, WeaponType.UNKNOWN)
+        return WeaponType.ALIASES.get(normalize_word(sub_type_string), WeaponType.UNKNOWN)
 
 
 class TierType:
     """
-    Weapon tier type. Exotic is the only one used in the code at the moment
+    Weapon tier type (rarity). These values correspond to values used in the Destiny 2 API
     """
     BASIC = 2
     COMMON = 3
@@ -50,6 +67,65 @@ class TierType:
     SUPERIOR = 5
     EXOTIC = 6
 
+    # User-friendly names for each tier
+    NAMES = {
+        BASIC: 'Basic',
+        COMMON: 'Common',
+        RARE: 'Rare',
+        SUPERIOR: 'Legendary',
+        EXOTIC: 'Exotic'
+    }
+
+    @staticmethod
+    def get_string_representation(tier):
+        """
+        Get a user-friendly string representation of the tier
+        """
+        return TierType.NAMES.get(tier, 'Unknown')
+
+
+class DamageType:
+    """
+    Enum representing the damage type (element) of a weapon instance. These values correspond to
+    values used in the Destiny 2 API
+    """
+    NONE = 0
+    KINETIC = 1
+    ARC = 2
+    THERMAL = 3
+    VOID = 4
+    RAID = 5
+    STASIS = 6
+    STRAND = 7
+
+    # User-friendly names for each damage type
+    NAMES = {
+        KINETIC: 'Kinetic',
+        ARC: 'Arc',
+        THERMAL: 'Solar',
+        VOID: 'Void',
+        STASIS: 'Stasis',
+        STRAND: 'Strand'
+    }
+
+    # Strings viewers may use for each damage type. "kinetic" is not included, since it means the
+    # kinetic slot (see WeaponType.ALIASES)
+    ALIASES = {
+        'arc': ARC,
+        'solar': THERMAL,
+        'thermal': THERMAL,
+        'void': VOID,
+        'stasis': STASIS,
+        'strand': STRAND
+    }
+
+    @staticmethod
+    def get_string_representation(damage_type):
+        """
+        Get a user-friendly string representation of the damage type
+        """
+        return DamageType.NAMES.get(damage_type, 'Unknown')
+
 
 class WeaponSubType:
     """
@@ -74,61 +150,64 @@ class WeaponSubType:
     BOW = 31
     UNKNOWN = 0
 
+    # User-friendly names for each weapon subtype
+    NAMES = {
+        AUTO_RIFLE: 'Auto Rifle',
+        SHOTGUN: 'Shotgun',
+        MACHINE_GUN: 'Machine Gun',
+        HAND_CANNON: 'Hand Cannon',
+        ROCKET_LAUNCHER: 'Rocket Launcher',
+        FUSION_RIFLE: 'Fusion Rifle',
+        SNIPER_RIFLE: 'Sniper Rifle',
+        PULSE_RIFLE: 'Pulse Rifle',
+        SCOUT_RIFLE: 'Scout Rifle',
+        SIDEARM: 'Sidearm',
+        SWORD: 'Sword',
+        LINEAR_FUSION_RIFLE: 'Linear Fusion Rifle',
+        GRENADE_LAUNCHER: 'Grenade Launcher',
+        SUBMACHINE_GUN: 'Submachine Gun',
+        TRACE_RIFLE: 'Trace Rifle',
+        BOW: 'Bow'
+    }
+
+    # Strings viewers may use for each weapon subtype. Some abbreviated forms are permitted
+    ALIASES = {
+        'autorifle': AUTO_RIFLE,
+        'auto': AUTO_RIFLE,
+        'shotgun': SHOTGUN,
+        'machinegun': MACHINE_GUN,
+        'handcannon': HAND_CANNON,
+        'rocketlauncher': ROCKET_LAUNCHER,
+        'fusionrifle': FUSION_RIFLE,
+        'fusion': FUSION_RIFLE,
+        'sniperrifle': SNIPER_RIFLE,
+        'sniper': SNIPER_RIFLE,
+        'pulserifle': PULSE_RIFLE,
+        'pulse': PULSE_RIFLE,
+        'scoutrifle': SCOUT_RIFLE,
+        'scout': SCOUT_RIFLE,
+        'sidearm': SIDEARM,
+        'sword': SWORD,
+        'linearfusionrifle': LINEAR_FUSION_RIFLE,
+        'linearfusion': LINEAR_FUSION_RIFLE,
+        'grenadelauncher': GRENADE_LAUNCHER,
+        'submachinegun': SUBMACHINE_GUN,
+        'smg': SUBMACHINE_GUN,
+        'tracerifle': TRACE_RIFLE,
+        'bow': BOW
+    }
+
     @staticmethod
     def get_string_representation(sub_type):
         """
         Get a user-friendly string representation of the weapon subtype
         """
-        return {
-            WeaponSubType.AUTO_RIFLE: 'Auto Rifle',
-            WeaponSubType.SHOTGUN: 'Shotgun',
-            WeaponSubType.MACHINE_GUN: 'Machine Gun',
-            WeaponSubType.HAND_CANNON: 'Hand Cannon',
-            WeaponSubType.ROCKET_LAUNCHER: 'Rocket Launcher',
-            WeaponSubType.FUSION_RIFLE: 'Fusion Rifle',
-            WeaponSubType.SNIPER_RIFLE: 'Sniper Rifle',
-            WeaponSubType.PULSE_RIFLE: 'Pulse Rifle',
-            WeaponSubType.SCOUT_RIFLE: 'Scout Rifle',
-            WeaponSubType.SIDEARM: 'Sidearm',
-            WeaponSubType.SWORD: 'Sword',
-            WeaponSubType.LINEAR_FUSION_RIFLE: 'Linear Fusion Rifle',
-            WeaponSubType.GRENADE_LAUNCHER: 'Grenade Launcher',
-            WeaponSubType.SUBMACHINE_GUN: 'Submachine Gun',
-            WeaponSubType.TRACE_RIFLE: 'Trace Rifle',
-            WeaponSubType.BOW: 'Bow'
-        }.get(sub_type, 'Unknown')
+        return WeaponSubType.NAMES.get(sub_type, 'Unknown')
 
     @staticmethod
     def get_enum_from_string(sub_type_string):
         """
         Convert a weapon subtype string to a weapon subtype enum value. Used for parsing viewer chat
-        input. Some abbreviated forms are permitted
+        input. For valid values, see WeaponSubType.ALIASES
         """
-        # Remove all nonletters, and convert to lowercase
-        sub_type_string = ''.join(ch for ch in sub_type_string if ch.isalpha()).lower()
-
-        return {
-            'autorifle': WeaponSubType.AUTO_RIFLE,
-            'auto': WeaponSubType.AUTO_RIFLE,
-            'shotgun': WeaponSubType.SHOTGUN,
-            'machinegun': WeaponSubType.MACHINE_GUN,
-            'handcannon': WeaponSubType.HAND_CANNON,
-            'rocketlauncher': WeaponSubType.ROCKET_LAUNCHER,
-            'fusionrifle': WeaponSubType.FUSION_RIFLE,
-            'fusion': WeaponSubType.FUSION_RIFLE,
-            'sniperrifle': WeaponSubType.SNIPER_RIFLE,
-            'sniper': WeaponSubType.SNIPER_RIFLE,
-            'pulserifle': WeaponSubType.PULSE_RIFLE,
-            'pulse': WeaponSubType.PULSE_RIFLE,
-            'scoutrifle': WeaponSubType.SCOUT_RIFLE,
-            'scout': WeaponSubType.SCOUT_RIFLE,
-            'sidearm': WeaponSubType.SIDEARM,
-            'sword': WeaponSubType.SWORD,
-            'linearfusionrifle': WeaponSubType.LINEAR_FUSION_RIFLE,
-            'linearfusion': WeaponSubType.LINEAR_FUSION_RIFLE,
-            'grenadelauncher': WeaponSubType.GRENADE_LAUNCHER,
-            'submachinegun': WeaponSubType.SUBMACHINE_GUN,
-            'smg': WeaponSubType.SUBMACHINE_GUN,
-            'tracerifle': WeaponSubType.TRACE_RIFLE,
-            'bow': WeaponSubType.BOW
-        }.get(sub_type_string, WeaponSubType.UNKNOWN)
+        return WeaponSubType.ALIASES.get(normalize_word(sub_type_string), WeaponSubType.UNKNOWN)
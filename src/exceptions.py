@@ -24,3 +24,10 @@ class TransferOrEquipError(Error):
     Error when an item could either not be transferred or equipped
     """
     pass
+
+
+class BungieUnavailableError(Error):
+    """
+    Error when the Bungie API is unavailable, e.g. during maintenance
+    """
+    pass
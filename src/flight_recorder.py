@@ -0,0 +1,76 @@
+"""
+Flight recorder for Bungie API calls. The most recent calls are kept in a fixed-size ring buffer,
+which costs one tuple per call and never grows. When something goes wrong, the buffer is dumped to a
+local JSONL file, along with whatever context the caller has (like the command and the state of the
+inventory snapshot), so that failures can be looked into after the fact without the details being
+posted in chat. The file is rotated when it gets too large, so it never grows without bound either
+"""
+
+from collections import deque
+import json
+from logging import ERROR, LogRecord
+from logging.handlers import RotatingFileHandler
+import time
+
+
+# Fields of each recorded call, in the order they are stored
+CALL_FIELDS = ('time', 'method', 'endpoint', 'params', 'status', 'error_code', 'latency', 'size')
+
+
+class FlightRecorder:
+    """
+    Ring buffer of the last size API calls. If dump_file is given, dump appends the buffer to it as
+    one JSON line, and the file is rotated once it reaches max_bytes, keeping backups old files
+    """
+
+    def __init__(self, size=200, dump_file=None, max_bytes=1000000, backups=3):
+        # Appending to a deque with a maxlen is atomic, so no lock is needed to record calls
+        self._calls = deque(maxlen=size)
+        self.dump_file = dump_file
+        self._handler = None
+        if dump_file is not None:
+            # The file is only created when the first dump is written
+            self._handler = RotatingFileHandler(dump_file, maxBytes=max_bytes, backupCount=backups,
+                                                encoding='utf-8', delay=True)
+
+        # Counter for monitoring
+        self.dumps = 0
+
+    @classmethod
+    def from_config(cls, config, dump_file=None):
+        """
+        Create a FlightRecorder from the "flight_recorder" section of config.json, if present
+        """
+        recorder_config = config.get('flight_recorder', {})
+        return cls(size=recorder_config.get('size', 200),
+                   dump_file=dump_file,
+                   max_bytes=recorder_config.get('max_bytes', 1000000),
+                   backups=recorder_config.get('backups', 3))
+
+    def record(self, method, endpoint, params, status, error_code, latency, size):
+        """
+        Record a call. status is the HTTP status, or None if no response was received, error_code
+        is the Bungie ErrorCode, if known, latency is in seconds and size is in bytes
+        """
+        self._calls.append((time.time(), method, endpoint, params, status, error_code, latency,
+                            size))
+
+    def get_calls(self):
+        """
+        Returns the recorded calls, oldest first, as dictionaries
+        """
+        return [dict(zip(CALL_FIELDS, x)) for x in list(self._calls)]
+
+    def dump(self, reason, **context):
+        """
+        Append the recorded calls to the dump file, along with the reason and any other context
+        given as keyword arguments. Does nothing if there is no dump file
+        """
+        if self._handler is None:
+            return
+        entry = {'time': time.time(), 'reason': reason, 'context': context,
+                 'calls': self.get_calls()}
+        # The handler takes care of rotating the file, and of writes from several threads
+        self._handler.handle(LogRecord('flight_recorder', ERROR, __file__, 0,
+                                       json.dumps(entry, default=str), None, None))
+        self.dumps += 1
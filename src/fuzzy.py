@@ -0,0 +1,149 @@
+"""
+Typo-tolerant matching of weapon names, e.g. "jade rabit" matching "The Jade Rabbit". Names are
+split into words, and the distinct words are stored in a BK-tree, so that looking up the words
+within a small edit distance of a query word only has to compare against a fraction of them
+"""
+
+import re
+
+
+# Characters that are dropped from names and queries entirely, rather than splitting words
+_DROPPED = re.compile("['’]")
+# Sequences of characters that make up words
+_WORD = re.compile('[^\\W_]+')
+
+
+def tokenize(text):
+    """
+    Split a weapon name or query into lowercase words, e.g. "Hawthorne's Field-Forged Shotgun"
+    becomes ["hawthornes", "field", "forged", "shotgun"]
+    """
+    return _WORD.findall(_DROPPED.sub('', text.lower()))
+
+
+def max_distance(word):
+    """
+    Maximum edit distance allowed when matching a query word. Short words must match exactly,
+    since allowing typos in them would match nearly everything
+    """
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance between two strings
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ch_a in enumerate(a, 1):
+        current = [i]
+        for j, ch_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ch_a != ch_b)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of words, for finding all words within a given edit distance of a query.
+    Each node's children are keyed on their distance from the node, so by the triangle inequality
+    only children whose key is within the allowed distance of the query's distance need searching
+    """
+
+    def __init__(self, words=()):
+        self._root = None  # Nodes are (word, {distance: child node}) tuples
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """
+        Add a word to the tree
+        """
+        if self._root is None:
+            self._root = (word, {})
+            return
+
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return  # Already present
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word, max_dist):
+        """
+        Returns a list of (distance, word) tuples for all words within max_dist of the given word
+        """
+        if self._root is None:
+            return []
+
+        results = []
+        to_visit = [self._root]
+        while to_visit:
+            node_word, children = to_visit.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_dist:
+                results.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - max_dist <= child_distance <= distance + max_dist:
+                    to_visit.append(child)
+        return results
+
+
+class FuzzyNameIndex:
+    """
+    Index over a set of weapon names for typo-tolerant lookups. Every word of a query must match a
+    word of the name within the distance allowed by max_distance. Word order does not matter, and
+    name words not mentioned in the query are ignored, so "jade rabit" matches "The Jade Rabbit"
+    """
+
+    def __init__(self, names):
+        self._names_by_word = {}
+        for name in set(names):
+            words = tokenize(name)
+            # Also index adjacent pairs of words joined together, so that e.g. "multitool" matches
+            # "MIDA Multi-Tool"
+            words += [a + b for a, b in zip(words, words[1:])]
+            for word in words:
+                self._names_by_word.setdefault(word, set()).add(name)
+        self._tree = BKTree(self._names_by_word)
+
+    def search(self, query):
+        """
+        Returns the set of names that best match the query, i.e. the names with the lowest total
+        edit distance over the query's words. Returns an empty set if no name matches every word
+        """
+        words = tokenize(query)
+        if not words:
+            return set()
+
+        scores = None  # Total distance for each name matching all words so far
+        for word in words:
+            # Lowest distance from this query word to a word of each candidate name
+            word_scores = {}
+            for distance, matched_word in self._tree.search(word, max_distance(word)):
+                for name in self._names_by_word[matched_word]:
+                    if distance < word_scores.get(name, distance + 1):
+                        word_scores[name] = distance
+
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {name: score + word_scores[name] for name, score in scores.items()
+                          if name in word_scores}
+            if not scores:
+                return set()
+
+        best_score = min(scores.values())
+        return {name for name, score in scores.items() if score == best_score}
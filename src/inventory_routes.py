@@ -0,0 +1,148 @@
+from collections import Counter
+import json
+import traceback
+
+from flask import request
+
+from src.cache import LRUCache
+from src.enums import DamageType, TierType, WeaponSubType, WeaponType
+from src.query import parse_command
+
+# This is just to appease IDE code analyzers by defining application explicitly in this module
+if False:
+    application = None
+
+# Serialized responses, keyed on the channel, the request path and query, and the snapshot tag, so
+# repeated polls between inventory changes are answered without serializing the inventory again
+response_cache = LRUCache(maxsize=128)
+
+# Fields the counts endpoint counts weapons by
+FACETS = ('slot', 'sub_type', 'element', 'tier', 'location')
+
+
+def serialize_weapon(weapon, character_id, equipped):
+    """
+    Returns the JSON representation of a weapon in the inventory snapshot
+    """
+    return {
+        'item_id': weapon.item_id,
+        'name': weapon.name,
+        'slot': WeaponType.get_string_representation(weapon.type),
+        'sub_type': WeaponSubType.get_string_representation(weapon.sub_type),
+        'element': DamageType.get_string_representation(weapon.damage_type),
+        'tier': TierType.get_string_representation(weapon.tier),
+        'power': weapon.power,
+        'location': character_id if character_id is not None else 'vault',
+        'equipped': equipped
+    }
+
+
+def json_response(body, etag=None, status=200):
+    """
+    Create a response with a serialized JSON body. Overlays are usually pages from another origin,
+    so any origin may read it. Clients must revalidate with the ETag before reusing a response
+    """
+    response = application.flask_app.response_class(body, status=status,
+                                                    mimetype='application/json')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = 'no-cache'
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def error_response(message, status):
+    return json_response(json.dumps({'error': message}), status=status)
+
+
+def inventory_response(channel, build):
+    """
+    Respond with the JSON that build returns for the channel's inventory snapshot, given as a list
+    of (weapon, character ID, equipped) tuples. The ETag is the snapshot tag, so a poll with an
+    unchanged snapshot gets a 304 without the snapshot being read at all. Like commands, this
+    fetches the snapshot from Bungie again once it has expired, so every consumer shares the bot's
+    reads
+    """
+    session = application.get_session(channel)
+    if session is None:
+        return error_response('Unknown channel', 404)
+    if not session.authorized:
+        return error_response('Waiting for oauth approval', 503)
+
+    try:
+        tag = session.profile.get_snapshot_tag()
+        if request.if_none_match.contains(tag):
+            response = json_response(b'', etag=tag, status=304)
+            response.headers.pop('Content-Type', None)
+            return response
+
+        cache_key = (session.channel.lower(), request.full_path, tag)
+        body = response_cache.get(cache_key)
+        if body is None:
+            tag, listing = session.profile.get_snapshot_listing()
+            body = json.dumps(build(listing))
+            response_cache.put((session.channel.lower(), request.full_path, tag), body)
+    except Exception:
+        traceback.print_exc()
+        return error_response('Unable to get the inventory', 503)
+    return json_response(body, etag=tag)
+
+
+def sort_weapons(listing):
+    """
+    Sort a listing of weapons by name, so that responses are stable
+    """
+    return sorted(listing, key=lambda x: (x[0].name, x[0].item_id))
+
+
+@application.flask_app.route('/inventory/<channel>/weapons', methods=['GET'])
+def inventory_weapons(channel):
+    """
+    Endpoint listing every weapon in the streamer's inventory and vault
+    """
+    return inventory_response(channel, lambda listing: {
+        'weapons': [serialize_weapon(*x) for x in sort_weapons(listing)]
+    })
+
+
+@application.flask_app.route('/inventory/<channel>/counts', methods=['GET'])
+def inventory_counts(channel):
+    """
+    Endpoint with the number of weapons for each slot, subtype, element, tier and location
+    """
+    def build(listing):
+        weapons = [serialize_weapon(*x) for x in listing]
+        counts = {'total': len(weapons)}
+        for facet in FACETS:
+            counts[facet] = dict(Counter(x[facet] for x in weapons))
+        return counts
+
+    return inventory_response(channel, build)
+
+
+@application.flask_app.route('/inventory/<channel>/search', methods=['GET'])
+def inventory_search(channel):
+    """
+    Endpoint listing the weapons matching ?q=<query>, where the query is written the same way as
+    for the !search command, e.g. "jade rabbit" or "energy solar 1800+", and matched against the
+    same weapons
+    """
+    if 'q' not in request.args:
+        return error_response('No query given. Use ?q=<query>', 400)
+    # The first word of a command is the command name, which the parser drops
+    query = parse_command('!search ' + request.args['q'])
+    session = application.get_session(channel)
+
+    def build(listing):
+        # Select the weapons the same way as !search does, which leaves out equipped weapons
+        if query.is_name:
+            weapons = session.profile.find_weapons_by_name(query.name)
+        else:
+            weapons = session.profile.get_inventory_table().select(
+                query.weapon_type, query.weapon_sub_type, query.damage_type, query.min_power)
+        placements = {x[0].item_id: x for x in listing}
+        listing = [placements[x.item_id] for x in weapons if x.item_id in placements]
+        return {'query': request.args['q'],
+                'weapons': [serialize_weapon(*x) for x in sort_weapons(listing)]}
+
+    return inventory_response(channel, build)
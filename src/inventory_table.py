@@ -0,0 +1,109 @@
+"""
+Columnar storage of the inventory snapshot. Each attribute that weapons can be filtered on is kept
+in its own column, parallel to the list of weapons, so a filter is a combination of whole-column
+comparisons rather than a Python loop over Weapon objects. If numpy is installed, the columns are
+numpy arrays and filters are evaluated as vectorized boolean masks. Otherwise the columns are
+array.array objects, and the same masks are computed with map
+"""
+
+from array import array
+from itertools import compress, repeat
+import operator
+
+from src.enums import TierType
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Columns, with the array typecode and the equivalent numpy dtype of each
+COLUMNS = {
+    'item_id': ('q', 'int64'),
+    'item_hash': ('I', 'uint32'),
+    'slot': ('I', 'uint32'),
+    'sub_type': ('B', 'uint8'),
+    'tier': ('B', 'uint8'),
+    'damage_type': ('B', 'uint8'),
+    'power': ('H', 'uint16'),
+    'location': ('B', 'uint8'),  # Index into InventoryTable.locations
+}
+
+
+class InventoryTable:
+    """
+    Table of weapons, with one row per weapon. owners maps the item ID of each weapon to the
+    character in possession of it, or to None if it is in the vault. The location column holds an
+    index into locations, where 0 is the vault and each character ID follows
+    """
+
+    def __init__(self, weapons, owners=None):
+        owners = owners or {}
+        self.weapons = list(weapons)
+
+        self.locations = [None]
+        location_indexes = {None: 0}
+        locations = []
+        for weapon in self.weapons:
+            owner = owners.get(weapon.item_id)
+            character_id = owner.character_id if owner is not None else None
+            if character_id not in location_indexes:
+                location_indexes[character_id] = len(self.locations)
+                self.locations.append(character_id)
+            locations.append(location_indexes[character_id])
+
+        values = {
+            'item_id': [int(x.item_id) for x in self.weapons],
+            'item_hash': [x.item_hash for x in self.weapons],
+            'slot': [x.type for x in self.weapons],
+            'sub_type': [x.sub_type for x in self.weapons],
+            'tier': [x.tier for x in self.weapons],
+            'damage_type': [x.damage_type for x in self.weapons],
+            'power': [x.power for x in self.weapons],
+            'location': locations,
+        }
+        self.columns = {}
+        for name, (typecode, dtype) in COLUMNS.items():
+            if numpy is not None:
+                self.columns[name] = numpy.array(values[name], dtype=dtype)
+            else:
+                self.columns[name] = array(typecode, values[name])
+
+    def __len__(self):
+        return len(self.weapons)
+
+    def mask(self, conditions):
+        """
+        Returns a boolean mask of the rows matching all of the given conditions. Each condition is a
+        (column name, operator, value) tuple, like ('power', operator.ge, 1800)
+        """
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for column, op, value in conditions:
+                mask &= op(self.columns[column], value)
+            return mask
+
+        mask = [True] * len(self)
+        for column, op, value in conditions:
+            mask = list(map(operator.and_, mask, map(op, self.columns[column], repeat(value))))
+        return mask
+
+    def select(self, weapon_type=None, weapon_sub_type=None, damage_type=None, min_power=None,
+               allow_exotics=True):
+        """
+        Returns the weapons matching the given criteria, any of which may be None to match all
+        weapons
+        """
+        conditions = []
+        if weapon_type is not None:
+            conditions.append(('slot', operator.eq, weapon_type))
+        if weapon_sub_type is not None:
+            conditions.append(('sub_type', operator.eq, weapon_sub_type))
+        if damage_type is not None:
+            conditions.append(('damage_type', operator.eq, damage_type))
+        if min_power is not None:
+            conditions.append(('power', operator.ge, min_power))
+        if not allow_exotics:
+            conditions.append(('tier', operator.ne, TierType.EXOTIC))
+        return list(compress(self.weapons, self.mask(conditions)))
@@ -1,11 +1,16 @@
-from src.enums import WeaponType, TierType
+from src.enums import DamageType, TierType
 
 
 class Item:
     """
-    Class representing an instanced item, like a specific weapon or a stack of consumables. Right 
-    now it is only used for weapons, but could be expanded in the future
+    Class representing an instanced item, like a specific weapon or a stack of consumables. Right
+    now it is only used for weapons, but could be expanded in the future.
+
+    The fields needed by the bot are resolved from the API data and the manifest once, when the
+    item is constructed, rather than looked up in the manifest every time they are accessed. The
+    raw API data is not kept around
     """
+    __slots__ = ('item_hash', 'item_id', 'bucket_hash', 'name')
 
     def __eq__(self, obj):
         """
@@ -15,60 +20,68 @@ class Item:
             return False
         return self.item_id == obj.item_id
 
-    def __init__(self, data, manifest):
-        self.data = data
-        self.manifest = manifest
-
-    @property
-    def manifest_data(self):
+    def __hash__(self):
         """
-        The manifest data for this item. Includes things like the name and item type
+        Hash on the item ID, so that items can be used in sets and as dictionary keys
         """
-        return self.manifest.item_data[self.data['itemHash']]
+        return hash(self.item_id)
 
-    @property
-    def name(self):
-        """
-        Item name according to the manifest data
-        """
-        return self.manifest_data['displayProperties']['name']
+    def __repr__(self):
+        return '{}({!r}, {})'.format(type(self).__name__, self.name, self.item_id)
 
-    @property
-    def item_hash(self):
+    def __init__(self, data, manifest, instance=None):
+        manifest_data = manifest.item_data[data['itemHash']]
+
+        # Item hash, used to cross-reference with the manifest data
+        self.item_hash = data['itemHash']
+        # Unique id for this instance of this item
+        self.item_id = data['itemInstanceId']
+        # Bucket the item is currently in. For weapons in a character's inventory, this is the
+        # weapon slot, and for weapons in the postmaster, this is the postmaster bucket
+        self.bucket_hash = data['bucketHash']
+        # Item name according to the manifest data
+        self.name = manifest_data['displayProperties']['name']
+
+        self._init_manifest_fields(manifest_data)
+        self._init_instance_fields(instance or {})
+
+    def _init_manifest_fields(self, manifest_data):
         """
-        Item hash, used to cross-reference with the manifest data
+        Hook for subclasses to resolve additional fields from the manifest data
         """
-        return self.data['itemHash']
+        pass
 
-    @property
-    def item_id(self):
+    def _init_instance_fields(self, instance):
         """
-        Unique id for this instance of this item
+        Hook for subclasses to resolve additional fields from the item's instance data (the
+        ItemInstances component), which is empty if it was not requested
         """
-        return self.data['itemInstanceId']
+        pass
 
 
 class Weapon(Item):
     """
     Class representing an instanced weapon
     """
-    @property
-    def type(self):
-        """
-        Returns weapon type as a WeaponType enum value
-        """
-        return self.manifest_data['inventory']['bucketTypeHash']
+    __slots__ = ('type', 'sub_type', 'tier', 'damage_type', 'power')
+
+    def _init_manifest_fields(self, manifest_data):
+        # Weapon type as a WeaponType enum value
+        self.type = manifest_data['inventory']['bucketTypeHash']
+        # Weapon subtype as a WeaponSubType enum value
+        self.sub_type = manifest_data['itemSubType']
+        # Weapon tier as a TierType enum value
+        self.tier = manifest_data['inventory']['tierType']
+
+    def _init_instance_fields(self, instance):
+        # Damage type of this instance as a DamageType enum value
+        self.damage_type = instance.get('damageType', DamageType.NONE)
+        # Power level of this instance, or 0 if unknown
+        self.power = instance.get('primaryStat', {}).get('value', 0)
 
     @property
     def is_exotic(self):
         """
         Returns true if this is an exotic weapon
         """
-        return self.manifest_data['inventory']['tierType'] == TierType.EXOTIC
-
-    @property
-    def sub_type(self):
-        """
-        Returns weapon subtype as a WeaponSubType enum value
-        """
-        return self.manifest_data['itemSubType']
+        return self.tier == TierType.EXOTIC
@@ -1,17 +1,134 @@
 """
 This module mostly based on the code found here:
 http://destinydevs.github.io/BungieNetPlatform/docs/Manifest#/Python-v3X
+
+Each manifest table the bot uses is registered with register_table, and is loaded independently
+the first time it is accessed. Each table has its own cache file, stamped with the manifest version
+it was extracted from, so a table that no command uses is never loaded.
+
+Alongside each cache file, a content hash of every row is kept. When the manifest version changes,
+rows whose hash is unchanged are reused from the old cache file, so only new and changed rows need
+to be decoded
 """
 
-from builtins import property
-import json
+from hashlib import blake2b
 import os
 import pickle
+import shutil
 import sqlite3
+import time
 import zipfile
 
 import requests
 
+from src import codec
+from src.single_flight import SingleFlight
+
+
+# File the manifest sqlite database is extracted to, and the file holding its version
+MANIFEST_DB_FILE = 'manifest.content'
+MANIFEST_DB_VERSION_FILE = 'manifest.content.version'
+
+
+class ManifestTable:
+    """
+    Declaration of a manifest table used by the bot. Rows are stored in a dictionary keyed on the
+    key field of each row. If projection is given, it is called with each row, and only what it
+    returns is kept, which keeps memory use down for large tables. schema_version must be increased
+    whenever the projection changes, so that rows cached with the old projection are not reused
+    """
+
+    def __init__(self, name, key='hash', projection=None, schema_version=1):
+        self.name = name
+        self.key = key
+        self.projection = projection
+        self.schema_version = schema_version
+
+    @property
+    def cache_file(self):
+        """
+        File the extracted rows for this table are saved to
+        """
+        return 'manifest.{}.data'.format(self.name)
+
+    @property
+    def hash_file(self):
+        """
+        File the content hash of each row is saved to. It is kept separate from the cache file,
+        since it is only needed when the manifest version changes
+        """
+        return 'manifest.{}.hashes'.format(self.name)
+
+
+class TableStats:
+    """
+    Measurements taken when a manifest table was loaded
+    """
+
+    def __init__(self, source, load_time, rows, changed_rows, cache_size):
+        self.source = source  # 'cache', 'database' or 'incremental'
+        self.load_time = load_time  # Seconds
+        self.rows = rows
+        self.changed_rows = changed_rows  # Rows that had to be decoded from the database
+        self.cache_size = cache_size  # Size of the cache file, in bytes
+
+    def __repr__(self):
+        return 'TableStats(source={!r}, load_time={:.3f}, rows={}, changed_rows={}, ' \
+               'cache_size={})'.format(self.source, self.load_time, self.rows,
+                                       self.changed_rows, self.cache_size)
+
+
+# All tables the bot can use, keyed on table name
+TABLES = {}
+
+
+def register_table(name, key='hash', projection=None, schema_version=1):
+    """
+    Register a manifest table, so that it can be loaded with Manifest.table
+    """
+    TABLES[name] = ManifestTable(name, key, projection, schema_version)
+    return TABLES[name]
+
+
+def _project_item(row):
+    """
+    Keep only the fields of an item definition which are used by the bot, in the same structure
+    """
+    inventory = row.get('inventory', {})
+    return {
+        'hash': row['hash'],
+        'displayProperties': {'name': row['displayProperties']['name']},
+        'itemType': row.get('itemType'),
+        'itemSubType': row.get('itemSubType'),
+        'inventory': {
+            'bucketTypeHash': inventory.get('bucketTypeHash'),
+            'tierType': inventory.get('tierType')
+        }
+    }
+
+
+def _project_name(row):
+    """
+    Keep only the hash and name of a definition
+    """
+    return {'hash': row['hash'], 'displayProperties': {'name': row['displayProperties']['name']}}
+
+
+ITEM_TABLE = register_table('DestinyInventoryItemDefinition', projection=_project_item)
+DAMAGE_TYPE_TABLE = register_table('DestinyDamageTypeDefinition', projection=_project_name)
+BUCKET_TABLE = register_table('DestinyInventoryBucketDefinition', projection=_project_name)
+
+
+def _dump_atomically(data, path):
+    """
+    Pickle data to a file. It is written to a temporary file first and then renamed, so a crash
+    while writing never leaves a partial file
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
 
 class Manifest:
     """
@@ -19,47 +136,109 @@ class Manifest:
     names, lore, etc.
     """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, http_session=None):
         self.api_key = api_key
-        self._data = None
+        self.http_session = http_session or requests.Session()
         self._manifest_info = None
 
-        # For now, only one table is needed by the bot. If more data is needed later, then
-        # more tables can be added to this dictionary
-        self.required_db_info = {
-            'DestinyInventoryItemDefinition': 'hash'
-        }
+        # Loaded tables, keyed on table name
+        self._tables = {}
 
-    @property
-    def data(self):
-        """
-        Lazily initialized. Gets the manifest data, either by loading saved manifest data or by
-        downloading the latest manifest db file and extracting the desired data. If manifest data
-        is loaded from a saved file, the version is compared against the current version to see if
-        it is out of date. If so, the latest manifest data will be downloaded
-        """
-        if self._data is None:
-            # Load saved manifest data, and check if it is out of date. If so, discard it
-            if os.path.isfile('manifest.data'):
-                self._data = pickle.load(open('manifest.data', 'rb'))
-                if self._data.get('version') != self.manifest_version:
-                    self._data = None
-
-            # If, after checking for saved manifest data, we still need to acquire the manifest data
-            if self._data is None:
-                # Download and parse manifest data, and save to a file
-                self._data = self.get_manifest()
-                self._data['version'] = self.manifest_version  # Include version info before saving
-                with open('manifest.data', 'wb') as f:
-                    pickle.dump(self._data, f)
-        return self._data
+        # Measurements for each loaded table, keyed on table name
+        self.table_stats = {}
+
+        # The manifest may be shared between several channels, whose commands run on different
+        # threads, as well as the preload thread. Callers that need the metadata, the database or a
+        # table while another thread is already loading it wait for that load instead
+        self._loads = SingleFlight()
+
+    def table(self, name):
+        """
+        Returns the rows of a registered table, as a dictionary keyed on the table's key field.
+        Lazily initialized. The rows are loaded from the table's cache file if it is for the latest
+        manifest version, or otherwise extracted from the latest manifest database
+        """
+        rows = self._tables.get(name)
+        if rows is None:
+            rows = self._loads.do(('table', name), self._load_and_store_table, name)
+        return rows
+
+    def _load_and_store_table(self, name):
+        """
+        Load a table and keep its rows, unless a load that finished in the meantime already did
+        """
+        rows = self._tables.get(name)
+        if rows is None:
+            rows = self._load_table(TABLES[name])
+            self._tables[name] = rows
+        return rows
 
     @property
     def item_data(self):
         """
-        Returns the item section of the manifest data
+        Returns the item definitions
+        """
+        return self.table(ITEM_TABLE.name)
+
+    @property
+    def damage_type_data(self):
+        """
+        Returns the damage type definitions
+        """
+        return self.table(DAMAGE_TYPE_TABLE.name)
+
+    @property
+    def bucket_data(self):
         """
-        return self.data['DestinyInventoryItemDefinition']
+        Returns the inventory bucket definitions
+        """
+        return self.table(BUCKET_TABLE.name)
+
+    def _load_table(self, table):
+        """
+        Load a table from its cache file, or extract it from the manifest database if the cache
+        file is missing or out of date, recording the time taken in table_stats. If the cache file
+        is only out of date because the manifest version changed, unchanged rows are reused from it
+        """
+        start_time = time.time()
+
+        cached = None
+        if os.path.isfile(table.cache_file):
+            with open(table.cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('schema') != table.schema_version:
+                cached = None  # Rows were projected differently, so none can be reused
+
+        if cached is not None and cached['version'] == self.manifest_version:
+            rows = cached['rows']
+            source = 'cache'
+            changed_rows = 0
+        else:
+            previous = None
+            if cached is not None and os.path.isfile(table.hash_file):
+                with open(table.hash_file, 'rb') as f:
+                    previous = pickle.load(f)
+                # The hashes can only be used with the rows they were saved with
+                if previous.get('version') == cached['version']:
+                    previous['rows'] = cached['rows']
+                else:
+                    previous = None
+            source = 'database' if previous is None else 'incremental'
+
+            rows, keys, hashes, changed_rows = self.extract_table(table, previous)
+
+            _dump_atomically({'version': self.manifest_version,
+                              'schema': table.schema_version,
+                              'rows': rows},
+                             table.cache_file)
+            _dump_atomically({'version': self.manifest_version, 'keys': keys, 'hashes': hashes},
+                             table.hash_file)
+
+        # Shown on the /debug/manifest page
+        stats = TableStats(source, time.time() - start_time, len(rows), changed_rows,
+                           os.path.getsize(table.cache_file))
+        self.table_stats[table.name] = stats
+        return rows
 
     @property
     def manifest_info(self):
@@ -68,13 +247,19 @@ class Manifest:
         the current version. This is lazily initialized, so it is downloaded once per session
         """
         if self._manifest_info is None:
-            response = requests.get(
-                'http://www.bungie.net/Platform/Destiny2/Manifest',
-                headers={'X-API-Key': self.api_key})
-            response.raise_for_status()
-            self._manifest_info = response.json()['Response']
+            self._manifest_info = self._loads.do('info', self._get_manifest_info)
         return self._manifest_info
 
+    def _get_manifest_info(self):
+        """
+        Download the manifest metadata
+        """
+        response = self.http_session.get(
+            'http://www.bungie.net/Platform/Destiny2/Manifest',
+            headers={'X-API-Key': self.api_key})
+        response.raise_for_status()
+        return codec.loads(response.content)['Response']
+
     @property
     def manifest_version(self):
         """
@@ -89,44 +274,90 @@ class Manifest:
         """
         return 'http://www.bungie.net' + self.manifest_info['mobileWorldContentPaths']['en']
 
-    def get_manifest(self):
+    def get_manifest_db(self):
+        """
+        Returns the path to the latest manifest sqlite database, downloading it if the local copy is
+        missing or out of date. The database is kept, so that tables loaded later in the session, or
+        in later sessions, can be extracted without downloading it again
         """
-        Download the manifest data and extract the desired information from it
+        return self._loads.do('database', self._get_manifest_db)
+
+    def _get_manifest_db(self):
         """
-        # Download the sqlite db zip file, write it to 'manifest.zip'
-        r = requests.get(self.manifest_db_url)
-        with open("manifest.zip", "wb") as zip_file:
-            zip_file.write(r.content)
+        Download and extract the manifest database, unless the local copy is up to date
+        """
+        if os.path.isfile(MANIFEST_DB_FILE) and os.path.isfile(MANIFEST_DB_VERSION_FILE):
+            with open(MANIFEST_DB_VERSION_FILE) as f:
+                if f.read() == self.manifest_version:
+                    return MANIFEST_DB_FILE
+
+        # Download the sqlite db zip file, write it to 'manifest.zip'. Both the download and the
+        # extraction are streamed in chunks, since the extracted database is hundreds of MB
+        with self.http_session.get(self.manifest_db_url, stream=True) as r:
+            r.raise_for_status()
+            with open("manifest.zip", "wb") as zip_file:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    zip_file.write(chunk)
 
         # Extract the zip file
         with zipfile.ZipFile('manifest.zip') as zip_file:
-            name = zip_file.namelist()
-            if os.path.exists(name[0]):
-                os.remove(name[0])
-            zip_file.extractall()
+            name = zip_file.namelist()[0]
+            with zip_file.open(name) as source, open(MANIFEST_DB_FILE, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        with open(MANIFEST_DB_VERSION_FILE, 'w') as f:
+            f.write(self.manifest_version)
 
-        connection = sqlite3.connect(name[0])
-        cursor = connection.cursor()
+        # Clean up
+        os.remove('manifest.zip')
+
+        return MANIFEST_DB_FILE
 
-        all_data = {}
-        # for every table that data is to be extracted from
-        for table_name, hash_value in self.required_db_info.items():
+    def extract_table(self, table, previous=None):
+        """
+        Extract a table from the manifest database. previous may hold the rows extracted from an
+        older version of the database, with the key and content hash of each database row, in
+        which case rows whose content is unchanged are reused rather than decoded again.
+
+        returns: A tuple of the rows (a dictionary where the keys are the values of the table's key
+        field, and the values are the projected rows), the key for each database row id, the
+        content hash for each database row id, and the number of rows that had to be decoded
+        """
+        previous_rows = previous['rows'] if previous else {}
+        previous_keys = previous['keys'] if previous else {}
+        previous_hashes = previous['hashes'] if previous else {}
+
+        rows = {}
+        keys = {}
+        hashes = {}
+        changed_rows = 0
+
+        connection = sqlite3.connect(self.get_manifest_db())
+        try:
             # Get all json strings from the table
-            cursor.execute('SELECT json from ' + table_name)
-            rows = cursor.fetchall()
+            cursor = connection.cursor()
+            cursor.execute('SELECT id, json from ' + table.name)
 
-            # Deserialize json for each row, and convert to a dictionary, where the keys are the
-            # hashes specified in hash_dict and the values are the dictionaries just loaded
-            table_data = {}
-            for row in rows:
-                row_data = json.loads(row[0])  # db rows are returned as tuples, hence row[0]
-                table_data[row_data[hash_value]] = row_data
+            for row_id, row_json in cursor:
+                row_hash = blake2b(row_json.encode(), digest_size=8).digest()
 
-            all_data[table_name] = table_data
+                # If unchanged since the previous version, reuse the decoded row
+                row_data = None
+                if previous_hashes.get(row_id) == row_hash:
+                    key = previous_keys[row_id]
+                    row_data = previous_rows.get(key)
 
-        # Clean up
-        connection.close()
-        os.remove('manifest.zip')
-        os.remove(name[0])
+                # Otherwise it is new or changed, so deserialize and project it
+                if row_data is None:
+                    row_data = codec.loads(row_json)
+                    if table.projection is not None:
+                        row_data = table.projection(row_data)
+                    key = row_data[table.key]
+                    changed_rows += 1
+
+                rows[key] = row_data
+                keys[row_id] = key
+                hashes[row_id] = row_hash
+        finally:
+            connection.close()
 
-        return all_data
+        return rows, keys, hashes, changed_rows
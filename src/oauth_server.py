@@ -10,8 +10,19 @@ def oauth_redirect():
     """
     Endpoint to accept oauth code from Bungie
     """
-    application.oauth_code = request.args['code']
-    with open('auth.data', 'w') as f:
-        f.write(application.oauth_code)
+    # The channel is passed through the oauth flow as the state. If there is only one channel, the
+    # state is not needed
+    if 'state' in request.args:
+        session = application.get_session(request.args['state'])
+    elif len(application.sessions) == 1:
+        session = next(iter(application.sessions.values()))
+    else:
+        session = None
+    if session is None:
+        return 'Unknown channel, unable to accept the oauth code', 400
+
+    session.oauth_code = request.args['code']
+    with open('auth.{}.data'.format(session.channel.lower()), 'w') as f:
+        f.write(session.oauth_code)
     return 'Thank you for authenticating, the Twitch bot can now perform actions on behalf of ' \
            'the authenticated account.'
@@ -0,0 +1,105 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Step:
+    """
+    A single step of a Plan, like transferring one item. A step only starts once all of the steps
+    it depends on have finished. Steps that move an item also record the item, and where it is
+    being moved to (a character, or None for the vault), so that the step can be corrected if the
+    item turns out not to be where it was expected
+    """
+
+    def __init__(self, description, function, depends_on=(), item=None, destination=None):
+        self.description = description
+        self.function = function
+        self.depends_on = list(depends_on)
+        self.item = item
+        self.destination = destination
+        self.done = False
+
+    def __repr__(self):
+        return 'Step({!r})'.format(self.description)
+
+
+class Plan:
+    """
+    A set of steps with dependencies between them. Running the plan runs steps concurrently
+    whenever they don't depend on each other, so ordering is only enforced where it is required
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.failed_step = None  # The step whose exception was raised by the last run
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, description, function, depends_on=(), item=None, destination=None):
+        """
+        Add a step which calls function, after all steps in depends_on have finished. Steps that
+        are None in depends_on are ignored, for convenience when a step is optional. item and
+        destination are recorded for steps that move an item (see Step). Returns the new step, so
+        that later steps can depend on it
+        """
+        step = Step(description, function, [x for x in depends_on if x is not None], item,
+                    destination)
+        self.steps.append(step)
+        return step
+
+    def _ready_steps(self, pending):
+        """
+        Returns the pending steps whose dependencies have all finished
+        """
+        return [x for x in pending if all(y.done for y in x.depends_on)]
+
+    def run(self, max_workers=4):
+        """
+        Run all steps, each as soon as the steps it depends on have finished. If a step raises an
+        exception, no further steps are started, and the exception is re-raised once the steps
+        already running have finished. Steps that finished are marked as done, so running the plan
+        again after a failure resumes from the failed step, which is recorded in failed_step
+        """
+        self.failed_step = None
+        pending = [x for x in self.steps if not x.done]
+
+        # With a single worker, or a single step, there is no need for any threads
+        if max_workers <= 1 or len(pending) <= 1:
+            while pending:
+                ready = self._ready_steps(pending)
+                if not ready:
+                    raise ValueError('Steps with unsatisfiable dependencies: {}'.format(pending))
+                for step in ready:
+                    try:
+                        step.function()
+                    except Exception:
+                        self.failed_step = step
+                        raise
+                    step.done = True
+                    pending.remove(step)
+            return
+
+        error = None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while pending or running:
+                # Start every step that is ready, unless something has already failed
+                if error is None:
+                    for step in self._ready_steps(pending):
+                        pending.remove(step)
+                        running[executor.submit(step.function)] = step
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if future.exception() is None:
+                        step.done = True
+                    elif error is None:
+                        error = future.exception()
+                        self.failed_step = step
+
+        if error is not None:
+            raise error
+        if pending:
+            raise ValueError('Steps with unsatisfiable dependencies: {}'.format(pending))
@@ -1,7 +1,23 @@
+from collections import deque
 from datetime import datetime
+import os
+import pickle
+from threading import Lock
+import time
 
 from src.character import Character
+from src.fuzzy import FuzzyNameIndex
+from src.inventory_table import InventoryTable
 from src.item import Weapon
+from src.sampling import PER_INSTANCE, WeaponSampler
+from src.single_flight import SingleFlight
+
+
+# Hash of the vault inventory bucket
+VAULT_BUCKET_HASH = 138197802
+
+# Increase whenever the layout of saved inventory snapshots changes, so that old files are ignored
+SNAPSHOT_FORMAT = 2
 
 
 class Profile:
@@ -9,44 +25,86 @@ class Profile:
     Class representing a Profile. Allows for performing account-level API operations for a player
     """
 
-    def __init__(self, api):
+    def __init__(self, api, inventory_max_age=30, weighting=None, snapshot_file=None):
         self.api = api
         self._active_character = None
+        self._lookups = SingleFlight()
         self.last_equip_time = 0
 
+        # Snapshot of all weapons returned by get_all_weapons. It is reused until it is older than
+        # inventory_max_age seconds, or until it is invalidated after a failed transfer or equip.
+        # Moves the bot makes successfully are recorded in it with record_moves. If
+        # snapshot_file is given, each new snapshot is saved to it, so that it can be loaded with
+        # load_snapshot after a restart
+        self.inventory_max_age = inventory_max_age
+        self.snapshot_file = snapshot_file
+        self._refresh_lock = Lock()
+        self._inventory = None
+        self._inventory_ids = None
+        self._inventory_time = 0
+        self._inventory_version = 0
+        self._weapon_owners = {}  # Owning character of each weapon (None for the vault), by item ID
+        self._equipped_weapons = {}  # Equipped weapons, by character ID
+        self._unequipped_weapons = {}  # Unequipped weapons, by character ID
+        self._vault_item_count = 0
+        self._characters = []
+        self._name_index = None
+        self._name_index_version = None
+
+        # Changes whenever anything in the snapshot changes, including where weapons are and their
+        # power levels, which don't change the inventory version
+        self._contents_version = 0
+        self._placements = None
+
+        # How random selections are weighted, from the "weighting" section of config.json. The
+        # sampler is rebuilt whenever the inventory version changes
+        weighting = weighting or {}
+        self.weighting_mode = weighting.get('mode', PER_INSTANCE)
+        self.recent_penalty = weighting.get('recent_penalty', 1.0)
+        self.recently_equipped = deque(maxlen=weighting.get('recent_count', 5))
+        self._sampler = None
+        self._sampler_version = None
+        self._table = None
+
     @property
     def active_character(self):
         """
         Gets the currently-active character on the account. If all characters are offline, this will
-        be the character that was played most recently. This is lazily initialized, so it is only
-        evaluated once. If the player changes characters, then the bot will need to be restarted
+        be the character that was played most recently. This is lazily initialized, and is
+        re-evaluated whenever the inventory snapshot is refreshed
         """
         if self._active_character is None:
-            self._active_character = self.get_most_recent_character()
+            # The snapshot may be revalidated on another thread at the same time
+            character = self._lookups.do('active_character', self.get_most_recent_character)
+            if self._active_character is None:
+                self._active_character = character
         return self._active_character
 
     @property
     def characters(self):
         """
-        Get all characters in the account
+        Get all characters in the account, along with what each is currently doing
         """
-        characters = self.api.make_get_call(
+        response = self.api.make_get_call(
             '/Destiny2/{}/Profile/{}'.format(self.api.membership_type, self.api.membership_id),
-            {'components': '200'}
-        )['Response']['characters']['data']
-        return [Character(self.api, x, self) for x in characters.values()]
+            {'components': '200,204'}
+        )['Response']
+        activities = response.get('characterActivities', {}).get('data', {})
+        return [Character(self.api, x, self, activities.get(x['characterId']))
+                for x in response['characters']['data'].values()]
 
-    def get_most_recent_character(self):
+    def get_most_recent_character(self, characters=None):
         """
-        Returns the character that was played most recently. If currently playing, then that means
-        the active character will be returned
+        Returns the character that was played most recently, out of the given characters, or all
+        characters in the account if none are given. If currently playing, then that means the
+        active character will be returned
         """
         most_recent_character = None
         most_recent_playtime = None
         current_datetime = datetime.utcnow()
 
         # Figure out which character has the most recent playtime
-        for character in self.characters:
+        for character in (characters if characters is not None else self.characters):
 
             if most_recent_character is None:
                 most_recent_character = character
@@ -61,46 +119,492 @@ class Profile:
 
         return most_recent_character
 
-    def get_vault_weapons(self):
+    def _get_profile_items(self):
         """
-        Get all weapons in the vault
+        Get all account-wide items, which includes everything in the vault. Returns a tuple of the
+        items, and the instance data of each item keyed on item ID
         """
-        items = self.api.make_get_call(
+        response = self.api.make_get_call(
             '/Destiny2/{}/Profile/{}'.format(self.api.membership_type, self.api.membership_id),
-            {'components': '102'}
-        )['Response']['profileInventory']['data']['items']
+            {'components': '102,300'}
+        )['Response']
+        instances = response.get('itemComponents', {}).get('instances', {}).get('data', {})
+        return response['profileInventory']['data']['items'], instances
+
+    def _get_weapons(self, items, instances):
+        """
+        Returns Weapon objects for the weapons among the given items
+        """
         return [
-            Weapon(x, self.api.manifest) for x in items
+            Weapon(x, self.api.manifest, instances.get(x['itemInstanceId'])) for x in items
             if self.api.manifest.item_data[x['itemHash']]['itemType'] == 3
         ]
 
+    def get_vault_weapons(self):
+        """
+        Get all weapons in the vault
+        """
+        return self._get_weapons(*self._get_profile_items())
+
+    @property
+    def inventory_version(self):
+        """
+        Version number of the inventory snapshot. This changes whenever the set of weapons in the
+        snapshot changes (including when the bot equips something), or when it is invalidated, so
+        it can be used as part of a cache key for anything derived from the inventory
+        """
+        self._refresh_inventory()
+        return self._inventory_version
+
+    def invalidate_inventory(self):
+        """
+        Discard the inventory snapshot, so the next access fetches it again. Called when a transfer
+        or equip fails, since the snapshot is then known to be stale. Waits for a refresh that is
+        in progress, so that other threads never see the snapshot half discarded
+        """
+        with self._refresh_lock:
+            self._inventory = None
+            self._inventory_ids = None
+            self._inventory_version += 1
+
+    def _refresh_inventory(self):
+        """
+        Fetch the inventory snapshot if there is none, or if it has expired
+        """
+        with self._refresh_lock:
+            if self._inventory is not None and \
+                    time.time() - self._inventory_time < self.inventory_max_age:
+                return
+
+            profile_items, instances = self._get_profile_items()
+            all_weapons = self._get_weapons(profile_items, instances)
+            weapon_owners = dict.fromkeys((x.item_id for x in all_weapons), None)
+            equipped_weapons = {}
+            unequipped_weapons = {}
+            characters = self.characters
+            for character in characters:
+                character_weapons = character.get_character_weapons()
+                all_weapons += character_weapons['unequipped']
+                for weapon in character_weapons['equipped'] + character_weapons['unequipped']:
+                    weapon_owners[weapon.item_id] = character
+                equipped_weapons[character.character_id] = character_weapons['equipped']
+                unequipped_weapons[character.character_id] = character_weapons['unequipped']
+            vault_item_count = sum(1 for x in profile_items
+                                   if x.get('bucketHash') == VAULT_BUCKET_HASH)
+
+            self._set_snapshot(all_weapons, weapon_owners, equipped_weapons, unequipped_weapons,
+                               vault_item_count, characters)
+            if self.snapshot_file is not None:
+                self.save_snapshot(self.snapshot_file)
+
+    def _set_snapshot(self, all_weapons, weapon_owners, equipped_weapons, unequipped_weapons,
+                      vault_item_count, characters):
+        """
+        Replace the inventory snapshot, and rebuild everything derived from it. Must be called with
+        the refresh lock held
+        """
+        # Only change the version if the weapons themselves changed
+        inventory_ids = frozenset(x.item_id for x in all_weapons)
+        if inventory_ids != self._inventory_ids:
+            self._inventory_version += 1
+
+        self._inventory = all_weapons
+        self._inventory_ids = inventory_ids
+        self._inventory_time = time.time()
+        self._weapon_owners = weapon_owners
+        self._equipped_weapons = equipped_weapons
+        self._unequipped_weapons = unequipped_weapons
+        self._vault_item_count = vault_item_count
+        self._characters = characters
+
+        # The player may have switched characters since the active character was determined
+        self._active_character = self.get_most_recent_character(characters)
+
+        # Rebuild the indexes for the new inventory, so each search and each draw is fast
+        if self._name_index_version != self._inventory_version:
+            self._name_index = FuzzyNameIndex(x.name for x in self._inventory)
+            self._name_index_version = self._inventory_version
+        if self._sampler_version != self._inventory_version:
+            self._sampler = WeaponSampler(self._inventory, self.weighting_mode,
+                                          self.recently_equipped, self.recent_penalty)
+            self._sampler_version = self._inventory_version
+
+        # Power levels and owners can change without the set of weapons changing, so the table is
+        # rebuilt on every refresh
+        self._table = InventoryTable(self._inventory, self._weapon_owners)
+        self._update_contents_version()
+
+    def _list_weapons(self):
+        """
+        Returns a (weapon, character ID, equipped) tuple for every weapon in the snapshot, including
+        equipped weapons, where the character ID is None for the vault. Must be called with the
+        refresh lock held, or while no refresh can happen
+        """
+        weapons = []
+        for character_id, equipped in self._equipped_weapons.items():
+            weapons += [(x, character_id, True) for x in equipped]
+        for weapon in self._inventory:
+            owner = self._weapon_owners.get(weapon.item_id)
+            weapons.append((weapon, owner.character_id if owner is not None else None, False))
+        return weapons
+
+    def _update_contents_version(self):
+        """
+        Change the contents version if any weapon was added, removed or moved, or its power level
+        changed. Must be called with the refresh lock held
+        """
+        placements = frozenset((x.item_id, character_id, equipped, x.power)
+                               for x, character_id, equipped in self._list_weapons())
+        if placements != self._placements:
+            self._contents_version += 1
+            self._placements = placements
+
+    def get_snapshot_tag(self):
+        """
+        Returns a string which changes whenever anything in the inventory snapshot changes, made of
+        the inventory version and the contents version. Like inventory_version, this refreshes the
+        snapshot if it has expired
+        """
+        self._refresh_inventory()
+        return '{}.{}'.format(self._inventory_version, self._contents_version)
+
+    def get_snapshot_listing(self):
+        """
+        Returns the snapshot's tag (see get_snapshot_tag), and a (weapon, character ID, equipped)
+        tuple for every weapon in the snapshot, including equipped weapons, where the character ID
+        is None for the vault. Both are taken from the same snapshot, even if another thread
+        refreshes it at the same time
+        """
+        while True:
+            self._refresh_inventory()
+            with self._refresh_lock:
+                # The snapshot may have been invalidated since it was refreshed
+                if self._inventory is not None:
+                    tag = '{}.{}'.format(self._inventory_version, self._contents_version)
+                    return tag, self._list_weapons()
+
+    def save_snapshot(self, path):
+        """
+        Save the inventory snapshot to a file. The file is written to a temporary file first and
+        then renamed, so a crash while saving never leaves a partial file. Only plain data is saved:
+        weapons are saved as tuples of their API fields, which is far more compact than pickling
+        Weapon objects, and the name index is rebuilt when the file is loaded, so the file stays
+        valid if any of the bot's classes change
+        """
+        if self._inventory is None:
+            return
+
+        weapons = self._list_weapons()
+        snapshot = {
+            'format': SNAPSHOT_FORMAT,
+            'membership_id': self.api.membership_id,
+            'manifest_version': self.api.manifest.manifest_version,
+            'minted': self._inventory_time,
+            'characters': [(x.data, x.activities) for x in self._characters],
+            'vault_item_count': self._vault_item_count,
+            'weapons': [(x.item_hash, x.item_id, x.bucket_hash, x.damage_type, x.power,
+                         character_id, equipped)
+                        for x, character_id, equipped in weapons]
+        }
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def load_snapshot(self, path):
+        """
+        Load an inventory snapshot saved by save_snapshot, if it is for this account and for the
+        current manifest version. The loaded snapshot is treated as fresh, so revalidate_snapshot
+        should be called soon after, e.g. in the background. Returns True if it was loaded
+        """
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('format') != SNAPSHOT_FORMAT or \
+                snapshot['membership_id'] != self.api.membership_id or \
+                snapshot['manifest_version'] != self.api.manifest.manifest_version:
+            return False
+
+        characters = {x['characterId']: Character(self.api, x, self, activities)
+                      for x, activities in snapshot['characters']}
+        item_data = self.api.manifest.item_data
+        all_weapons = []
+        weapon_owners = {}
+        equipped_weapons = {x: [] for x in characters}
+        unequipped_weapons = {x: [] for x in characters}
+        for item_hash, item_id, bucket_hash, damage_type, power, character_id, equipped in \
+                snapshot['weapons']:
+            if item_hash not in item_data:
+                continue
+            weapon = Weapon({'itemHash': item_hash, 'itemInstanceId': item_id,
+                             'bucketHash': bucket_hash},
+                            self.api.manifest,
+                            {'damageType': damage_type, 'primaryStat': {'value': power}})
+            owner = characters.get(character_id)
+            weapon_owners[item_id] = owner
+            if owner is None:
+                all_weapons.append(weapon)
+            elif equipped:
+                equipped_weapons[character_id].append(weapon)
+            else:
+                unequipped_weapons[character_id].append(weapon)
+        for weapons in unequipped_weapons.values():
+            all_weapons += weapons
+
+        with self._refresh_lock:
+            self._set_snapshot(all_weapons, weapon_owners, equipped_weapons, unequipped_weapons,
+                               snapshot['vault_item_count'], list(characters.values()))
+        return True
+
+    def revalidate_snapshot(self):
+        """
+        Fetch a new inventory snapshot, replacing the current one even if it has not expired. Used
+        after load_snapshot, since the player may have changed their inventory while the bot was
+        not running
+        """
+        with self._refresh_lock:
+            self._inventory_time = 0
+        self._refresh_inventory()
+
     def get_all_weapons(self):
         """
         Get all weapons, across all characters and the vault. Does not include postmaster weapons
-        or currently equipped weapons
+        or currently equipped weapons. Served from the inventory snapshot when it is still fresh
+        """
+        while True:
+            self._refresh_inventory()
+            with self._refresh_lock:
+                # The snapshot may have been invalidated since it was refreshed
+                if self._inventory is not None:
+                    return list(self._inventory)
+
+    def get_name_index(self):
+        """
+        Get a FuzzyNameIndex over the names of all weapons returned by get_all_weapons. The index is
+        rebuilt only when the inventory version changes
+        """
+        self._refresh_inventory()
+        return self._name_index
+
+    def find_weapons_by_name(self, weapon_name, weapons=None):
+        """
+        Returns the weapons matching a name, out of the given weapons, or all weapons returned by
+        get_all_weapons if none are given. If there are exact matches, only those are returned. If
+        not, partial matches are returned, and if there are none of those either, matches allowing
+        for typos (see FuzzyNameIndex). The matching is not case-sensitive
+        """
+        weapon_name_lowercase = weapon_name.lower()
+        if weapons is None:
+            weapons = self.get_all_weapons()
+
+        # Look for exact matches
+        matching = [x for x in weapons if x.name.lower() == weapon_name_lowercase]
+
+        # If none found, look for partial matches
+        if len(matching) == 0:
+            matching = [x for x in weapons if weapon_name_lowercase in x.name.lower()]
+
+        # If still none found, look for matches with typos
+        if len(matching) == 0:
+            names = self.get_name_index().search(weapon_name)
+            matching = [x for x in weapons if x.name in names]
+
+        return matching
+
+    def locate_weapon(self, weapon):
+        """
+        Look up where a single weapon is now, with one small request rather than a scan of the whole
+        inventory, and correct the inventory snapshot to match. Returns the character in possession
+        of the weapon, or None if it is in the vault
+        """
+        response = self.api.make_get_call(
+            '/Destiny2/{}/Profile/{}/Item/{}/'.format(
+                self.api.membership_type, self.api.membership_id, weapon.item_id),
+            {'components': '300,307'}
+        )['Response']
+        character_id = response.get('characterId')
+        equipped = response.get('instance', {}).get('data', {}).get('isEquipped', False)
+
+        owner = None
+        if character_id is not None:
+            characters = self._characters or self.characters
+            owner = next((x for x in characters if x.character_id == character_id), None)
+
+        with self._refresh_lock:
+            if self._inventory is not None:
+                self._move_in_snapshot(weapon, owner, equipped)
+        return owner
+
+    def _move_in_snapshot(self, weapon, owner, equipped):
+        """
+        Move a weapon within the inventory snapshot, to the given character (equipped or not), or
+        to the vault if owner is None. Must be called with the refresh lock held
+        """
+        if weapon.item_id in self._weapon_owners and self._weapon_owners[weapon.item_id] is None:
+            self._vault_item_count -= 1
+        for weapons in list(self._equipped_weapons.values()) + \
+                list(self._unequipped_weapons.values()):
+            if weapon in weapons:
+                weapons.remove(weapon)
+        if weapon in self._inventory:
+            self._inventory.remove(weapon)
+
+        self._weapon_owners[weapon.item_id] = owner
+        if owner is None:
+            self._vault_item_count += 1
+            self._inventory.append(weapon)
+        elif equipped:
+            self._equipped_weapons.setdefault(owner.character_id, []).append(weapon)
+        else:
+            self._unequipped_weapons.setdefault(owner.character_id, []).append(weapon)
+            self._inventory.append(weapon)
+
+        # The set of weapons is unchanged, so the version stays the same, but locations changed
+        self._table = InventoryTable(self._inventory, self._weapon_owners)
+        self._update_contents_version()
+
+    def record_moves(self, moves):
+        """
+        Record moves the bot made in the inventory snapshot, so that it stays correct without being
+        fetched again. moves is a list of (weapon, owner, equipped) tuples, in the order the moves
+        were made, where owner is the character the weapon was moved to, or None for the vault. A
+        weapon equipped in a slot replaces the weapon equipped there before, which becomes
+        unequipped. The snapshot keeps its age, so changes the player makes are still picked up once
+        it expires. Does nothing if there is no snapshot
+        """
+        with self._refresh_lock:
+            if self._inventory is None:
+                return
+            for weapon, owner, equipped in moves:
+                if equipped:
+                    for replaced in [x for x in self._equipped_weapons.get(owner.character_id, [])
+                                     if x.type == weapon.type and x != weapon]:
+                        self._move_in_snapshot(replaced, owner, False)
+                self._move_in_snapshot(weapon, owner, equipped)
+
+            # Equipped weapons are not in the inventory, so equips change the set of weapons, and
+            # everything derived from it has to be rebuilt
+            inventory_time = self._inventory_time
+            self._set_snapshot(self._inventory, self._weapon_owners, self._equipped_weapons,
+                               self._unequipped_weapons, self._vault_item_count, self._characters)
+            self._inventory_time = inventory_time
+
+    def describe_snapshot(self):
         """
-        all_weapons = self.get_vault_weapons()
+        Returns a summary of the inventory snapshot as it is, without refreshing it or making any
+        API calls, e.g. to record what the bot believed when something went wrong. Returns None if
+        no snapshot has been taken
+        """
+        if self._inventory is None:
+            return None
+        active_character = self._active_character
+        return {
+            'version': self._inventory_version,
+            'age': round(time.time() - self._inventory_time, 1),
+            'active_character': active_character.character_id if active_character else None,
+            'vault_item_count': self._vault_item_count,
+            'equipped': {character_id: [(x.name, x.item_id) for x in weapons]
+                         for character_id, weapons in self._equipped_weapons.items()},
+            'unequipped': {character_id: len(weapons)
+                           for character_id, weapons in self._unequipped_weapons.items()},
+            'vault_weapons': sum(x is None for x in self._weapon_owners.values())
+        }
+
+    def get_snapshot_owner(self, weapon):
+        """
+        Returns the character in possession of a weapon according to the inventory snapshot, or None
+        if it is in the vault. Unlike get_weapon_owner, this makes no API calls while the snapshot
+        is fresh, but may be out of date
+        """
+        self._refresh_inventory()
+        return self._weapon_owners.get(weapon.item_id)
+
+    def get_snapshot_equipped_weapons(self, character):
+        """
+        Returns the weapons equipped on a character according to the inventory snapshot
+        """
+        self._refresh_inventory()
+        return self._equipped_weapons.get(character.character_id, [])
+
+    def get_snapshot_unequipped_weapons(self, character):
+        """
+        Returns the unequipped weapons in a character's possession according to the inventory
+        snapshot
+        """
+        self._refresh_inventory()
+        return self._unequipped_weapons.get(character.character_id, [])
+
+    @property
+    def vault_item_count(self):
+        """
+        Number of items (of any kind) in the vault, according to the inventory snapshot
+        """
+        self._refresh_inventory()
+        return self._vault_item_count
+
+    def get_inventory_table(self):
+        """
+        Get an InventoryTable of the weapons returned by get_all_weapons, for filtering on any
+        combination of criteria
+        """
+        self._refresh_inventory()
+        return self._table
+
+    def get_sampler(self):
+        """
+        Get the WeaponSampler for the weapons returned by get_all_weapons, which is used for all
+        random selections
+        """
+        self._refresh_inventory()
+        return self._sampler
+
+    def record_equipped(self, weapons):
+        """
+        Remember the names of weapons the bot has equipped, so that they can be made less likely to
+        be chosen again (see recent_penalty)
+        """
+        self.recently_equipped.extend(x.name for x in weapons)
+
+    def get_weapon_owners(self, weapons):
+        """
+        Return a dictionary mapping each of the specified weapons to the character currently in
+        possession of it, or to None if no character has it. Fetches the vault and each character's
+        weapons only once, no matter how many weapons are specified
+        """
+        owners = {}
+        remaining = set(weapons)
+
+        vault_weapons = set(self.get_vault_weapons())
+        for weapon in remaining & vault_weapons:
+            owners[weapon] = None
+        remaining -= vault_weapons
 
         for character in self.characters:
-            unequipped = character.unequipped_weapons
-            all_weapons += unequipped
+            if not remaining:
+                break
+            character_weapons = character.get_character_weapons()
+            owned = remaining & set(character_weapons['equipped'] + character_weapons['unequipped'])
+            for weapon in owned:
+                owners[weapon] = character
+            remaining -= owned
+
+        for weapon in remaining:
+            owners[weapon] = None  # No character has this weapon
 
-        return all_weapons
+        return owners
 
     def get_weapon_owner(self, weapon):
         """
         Return the character currently in possession of a specified weapon. If no character has it,
         then return None
         """
-        if weapon in self.get_vault_weapons():
+        if weapon in set(self.get_vault_weapons()):
             return None
 
         for character in self.characters:
-            for char_weapon in character.equipped_weapons:
-                if char_weapon == weapon:
-                    return character
-            for char_weapon in character.unequipped_weapons:
-                if char_weapon == weapon:
-                    return character
+            character_weapons = character.get_character_weapons()
+            if weapon in set(character_weapons['equipped'] + character_weapons['unequipped']):
+                return character
 
         return None  # No character has this weapon
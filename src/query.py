@@ -0,0 +1,123 @@
+"""
+Parsing of viewer chat commands like "!equip kinetic pulse", "!equip 1800+ solar" or
+"!search jade rabbit" into a structured query. All of the strings that can be recognized in a
+command are compiled into a single token table when this module is imported, so each word of a
+command is looked up once
+"""
+
+import re
+
+from src.enums import DamageType, normalize_word, WeaponSubType, WeaponType
+
+
+# Words that are allowed in a slot/subtype command without turning it into a name search, e.g.
+# "!equip random kinetic"
+STOP_WORDS = ('random', 'any', 'weapon', 'weapons')
+
+# Token kinds
+SLOT = 1
+SUB_TYPE = 2
+STOP_WORD = 3
+DAMAGE_TYPE = 4
+
+# A minimum power level, like "1800+"
+_MIN_POWER = re.compile(r'^(\d+)\+$')
+
+
+def _build_token_table():
+    """
+    Build the token table, mapping each normalized word to a (token kind, enum value) tuple
+    """
+    table = {}
+    for word in STOP_WORDS:
+        table[word] = (STOP_WORD, None)
+    for word, weapon_type in WeaponType.ALIASES.items():
+        table[word] = (SLOT, weapon_type)
+    for word, weapon_sub_type in WeaponSubType.ALIASES.items():
+        table[word] = (SUB_TYPE, weapon_sub_type)
+    for word, damage_type in DamageType.ALIASES.items():
+        table[word] = (DAMAGE_TYPE, damage_type)
+    return table
+
+
+TOKEN_TABLE = _build_token_table()
+
+
+class Query:
+    """
+    A parsed command. If any word of the command could not be interpreted as a slot, subtype,
+    damage type, minimum power or stop word, then it is a request to equip or search a weapon by
+    name, and name holds the requested name. Otherwise, weapon_type, weapon_sub_type, damage_type
+    and min_power hold the requested criteria, any of which may be None. weapon_types holds every
+    slot mentioned, in order, for commands which can act on several slots at once
+    """
+    __slots__ = ('name', 'name_terms', 'weapon_type', 'weapon_sub_type', 'weapon_types',
+                 'damage_type', 'min_power')
+
+    def __init__(self, name, name_terms, weapon_type=None, weapon_sub_type=None,
+                 weapon_types=(), damage_type=None, min_power=None):
+        self.name = name
+        self.name_terms = name_terms
+        self.weapon_type = weapon_type
+        self.weapon_sub_type = weapon_sub_type
+        self.weapon_types = weapon_types
+        self.damage_type = damage_type
+        self.min_power = min_power
+
+    def __repr__(self):
+        return 'Query(name={!r}, weapon_type={!r}, weapon_sub_type={!r}, damage_type={!r}, ' \
+               'min_power={!r})'.format(self.name, self.weapon_type, self.weapon_sub_type,
+                                        self.damage_type, self.min_power)
+
+    @property
+    def has_instance_criteria(self):
+        """
+        True if the query has criteria that depend on the weapon instance, rather than only on its
+        definition in the manifest
+        """
+        return self.damage_type is not None or self.min_power is not None
+
+    @property
+    def is_name(self):
+        """
+        True if this is a request to equip or search a weapon by name
+        """
+        return self.name is not None
+
+
+def parse_command(command):
+    """
+    Parse a command in a single pass over its words. The first word (e.g. "!equip") is dropped. If
+    the same kind of criteria is given more than once, the last one wins
+    """
+    parts = command.split(None, 1)
+    argument = parts[1].strip() if len(parts) > 1 else ''
+    words = argument.split()
+
+    weapon_type = None
+    weapon_sub_type = None
+    weapon_types = []
+    damage_type = None
+    min_power = None
+
+    for word in words:
+        # Most words are already lowercase letters, so try the table before normalizing
+        token = TOKEN_TABLE.get(word) or TOKEN_TABLE.get(normalize_word(word))
+        if token is None:
+            match = _MIN_POWER.match(word)
+            if match is None:
+                return Query(argument, words)
+            min_power = int(match.group(1))
+            continue
+
+        kind, value = token
+        if kind == SLOT:
+            weapon_type = value
+            if value not in weapon_types:
+                weapon_types.append(value)
+        elif kind == SUB_TYPE:
+            weapon_sub_type = value
+        elif kind == DAMAGE_TYPE:
+            damage_type = value
+
+    return Query(None, [], weapon_type, weapon_sub_type, weapon_types, damage_type, min_power)
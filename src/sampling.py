@@ -0,0 +1,131 @@
+"""
+Weighted random selection of weapons. For every combination of the criteria used by random
+selection (slot, subtype, and whether exotics are allowed), an alias table is built when the
+inventory snapshot is taken, so each draw takes constant time no matter how large the vault is
+"""
+
+from collections import Counter
+import random
+
+
+# Weighting modes
+PER_INSTANCE = 'instance'  # Every weapon is equally likely
+PER_NAME = 'name'  # Every distinct weapon name is equally likely, no matter how many copies exist
+PER_RARITY = 'rarity'  # Every tier (exotic, legendary, ...) is equally likely
+
+WEIGHTING_MODES = (PER_INSTANCE, PER_NAME, PER_RARITY)
+
+
+class AliasTable:
+    """
+    Walker's alias method, built with Vose's algorithm. Building takes linear time in the number of
+    items, and each sample takes constant time
+    """
+
+    def __init__(self, items, weights):
+        self.items = items
+        count = len(items)
+        total = float(sum(weights))
+        if count == 0 or total <= 0:
+            raise ValueError('An alias table needs at least one item with a positive weight')
+
+        self._probability = [0.0] * count
+        self._alias = [0] * count
+
+        scaled = [x * count / total for x in weights]
+        small = [i for i, x in enumerate(scaled) if x < 1]
+        large = [i for i, x in enumerate(scaled) if x >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left over is 1, apart from floating point error
+        for i in small + large:
+            self._probability[i] = 1.0
+
+    def sample(self, rng=random):
+        """
+        Returns a random item, with probability proportional to its weight
+        """
+        i = rng.randrange(len(self.items))
+        if rng.random() < self._probability[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+
+class WeaponSampler:
+    """
+    Weighted random selection over a snapshot of weapons. mode is one of WEIGHTING_MODES. Weapons
+    whose names are in recent_names (e.g. recently equipped weapons) have their weight multiplied
+    by recent_penalty, so a value below 1 makes them less likely to be chosen again
+    """
+
+    def __init__(self, weapons, mode=PER_INSTANCE, recent_names=(), recent_penalty=1.0):
+        if mode not in WEIGHTING_MODES:
+            raise ValueError('Unknown weighting mode "{}"'.format(mode))
+        self.mode = mode
+        self.recent_names = set(recent_names)
+        self.recent_penalty = recent_penalty
+
+        # Weapons and their alias table for each (weapon type, subtype, exotics allowed) bucket,
+        # where None for weapon type or subtype means any
+        self._buckets = {}
+        for weapon in weapons:
+            for weapon_type in (None, weapon.type):
+                for weapon_sub_type in (None, weapon.sub_type):
+                    for allow_exotics in ((True, False) if not weapon.is_exotic else (True,)):
+                        key = (weapon_type, weapon_sub_type, allow_exotics)
+                        self._buckets.setdefault(key, []).append(weapon)
+        self._buckets = {key: tuple(x) for key, x in self._buckets.items()}
+        self._tables = {key: AliasTable(x, self.get_weights(x))
+                        for key, x in self._buckets.items()}
+
+    def get_weights(self, weapons):
+        """
+        Returns the weight of each of the given weapons, relative to the others
+        """
+        if self.mode == PER_NAME:
+            counts = Counter(x.name for x in weapons)
+            weights = [1.0 / counts[x.name] for x in weapons]
+        elif self.mode == PER_RARITY:
+            counts = Counter(x.tier for x in weapons)
+            weights = [1.0 / counts[x.tier] for x in weapons]
+        else:
+            weights = [1.0] * len(weapons)
+
+        if self.recent_names and self.recent_penalty != 1:
+            penalized = [w * self.recent_penalty if x.name in self.recent_names else w
+                         for w, x in zip(weights, weapons)]
+            # If the penalty leaves no weapon with any weight, ignore it
+            if sum(penalized) > 0:
+                weights = penalized
+        return weights
+
+    def options(self, weapon_type=None, weapon_sub_type=None, allow_exotics=True):
+        """
+        Returns a tuple of all weapons matching the given criteria
+        """
+        return self._buckets.get((weapon_type, weapon_sub_type, allow_exotics), ())
+
+    def sample(self, weapon_type=None, weapon_sub_type=None, allow_exotics=True, rng=random):
+        """
+        Returns a random weapon matching the given criteria, or None if there are none
+        """
+        table = self._tables.get((weapon_type, weapon_sub_type, allow_exotics))
+        if table is None:
+            return None
+        return table.sample(rng)
+
+    def choose(self, weapons, rng=random):
+        """
+        Returns a random weapon from an arbitrary list of weapons, such as the results of a name
+        search, using the same weighting. This takes linear time, since there is no precomputed
+        table for an arbitrary list
+        """
+        return rng.choices(weapons, weights=self.get_weights(weapons))[0]
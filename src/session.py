@@ -0,0 +1,242 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import traceback
+import os
+import webbrowser
+
+import requests.exceptions
+
+from src.api import API, load_token
+from src.cache import LRUCache
+from src.flight_recorder import FlightRecorder
+from src.profile import Profile
+from src.stager import Stager
+
+
+class ChannelSession:
+    """
+    State for one Twitch channel hosted by the bot: the Bungie oauth code, API and Profile objects
+    for the streamer's account, and the queue that commands from the channel's chat go through.
+    Channels share the application's manifest and HTTP connection pool, so each additional channel
+    only costs one inventory's worth of memory
+    """
+
+    def __init__(self, config, manifest, http_session, circuit_breaker=None, command_budget=None):
+        self.config = config  # Application config, merged with the settings for this channel
+        self.channel = config['channel']
+        self.manifest = manifest
+        self.http_session = http_session
+        self.circuit_breaker = circuit_breaker
+
+        # Oauth code, which is provided when the streamer approves oauth access. After a restart, a
+        # refresh token stored by the previous run is used instead, if it is still valid
+        self._oauth_code = None
+        self._stored_token = None
+        self.oauth_approved = Event()
+
+        self._api = None
+        self._profile = None
+
+        # Recent Bungie API calls for this channel, which are dumped to a file when a command fails
+        self.flight_recorder = FlightRecorder.from_config(config, self.flight_recorder_file)
+
+        # Commands from this channel are handled one at a time, in the order they were received.
+        # Blocking API calls for this channel run on its own worker thread, so that a slow command
+        # in one channel does not hold up commands in other channels
+        self.command_lock = asyncio.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix='channel-{}'.format(self.channel))
+
+        # Time the last chat message was sent to this channel. Needed to rate-limit chat messages
+        self.last_message_send_time = 0
+
+        # Time the last command was received from this channel's chat
+        self.last_command_time = 0
+
+        # Background pre-stager, if enabled with "prestage" in the config
+        self.stager = Stager.from_config(self, command_budget)
+
+        # Cache of weapon summaries for !search results. Keys include the snapshot tag, so entries
+        # stop being served as soon as the inventory or any power level changes
+        self.search_cache = LRUCache(maxsize=64)
+
+    @property
+    def oauth_code(self):
+        """
+        Oauth code for the streamer's Bungie account, or None if it has not been received yet
+        """
+        return self._oauth_code
+
+    @oauth_code.setter
+    def oauth_code(self, value):
+        self._oauth_code = value
+        if value is not None:
+            self.oauth_approved.set()
+
+    @property
+    def authorized(self):
+        """
+        True if API operations can be performed for the streamer's account, either because oauth
+        access was approved, or because a stored token was resumed
+        """
+        return self.oauth_approved.is_set()
+
+    @property
+    def api(self):
+        """
+        Returns an API object which can be used to perform API operations. The session must be
+        authorized before this can be used.
+        """
+        if not self.authorized:
+            return None
+        if self._api is None:
+            self._api = API(self.config['bungie_api_key'],
+                            self.config['oauth_client_id'],
+                            self.config['oauth_client_secret'],
+                            self.oauth_code,
+                            self.config['bungie_membership_type'],
+                            manifest=self.manifest,
+                            http_session=self.http_session,
+                            circuit_breaker=self.circuit_breaker,
+                            token_file=self.token_file,
+                            stored_token=self._stored_token,
+                            flight_recorder=self.flight_recorder)
+        return self._api
+
+    @property
+    def profile(self):
+        """
+        Returns player Profile object, which can be used to perform account-level API operations.
+        The same object is reused for the whole session, so that its inventory snapshot is shared
+        between commands. The session must be authorized before this can be used.
+        """
+        if self.api is None:
+            return None
+        if self._profile is None:
+            self._profile = Profile(self.api, self.config.get('inventory_max_age', 30),
+                                    self.config.get('weighting'), self.snapshot_file)
+        return self._profile
+
+    @property
+    def snapshot_file(self):
+        """
+        File the channel's inventory snapshot is saved to, next to the manifest cache files
+        """
+        return 'inventory.{}.data'.format(self.channel.lower())
+
+    @property
+    def token_file(self):
+        """
+        File the channel's Bungie refresh token is saved to, so that restarts don't need approval
+        """
+        return 'token.{}.data'.format(self.channel.lower())
+
+    @property
+    def flight_recorder_file(self):
+        """
+        File the flight recorder is dumped to when a command fails
+        """
+        return 'flight_recorder.{}.jsonl'.format(self.channel.lower())
+
+    def resume_stored_token(self):
+        """
+        Authorize the session with the token stored by a previous run, if there is one and Bungie
+        still accepts it, so that the streamer does not have to approve oauth access again. This
+        makes a blocking API call, so it should be run with run. Returns True if the session is
+        authorized
+        """
+        token = load_token(self.token_file)
+        if token is None:
+            return False
+
+        self._stored_token = token
+        self.oauth_approved.set()
+        try:
+            self.api.access_token
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code >= 500:
+                raise
+            # The token was revoked, so forget it and ask for approval again
+            self._stored_token = None
+            self._api = None
+            self.oauth_approved.clear()
+            os.remove(self.token_file)
+            return False
+        return True
+
+    @property
+    def oauth_link(self):
+        """
+        Link to the page with the oauth approval prompt. The channel name is passed as the state,
+        which Bungie includes in the redirect, so the code can be matched up with this channel
+        """
+        return 'https://www.bungie.net/en/OAuth/Authorize?client_id={}&response_type=code' \
+               '&state={}'.format(self.config['oauth_client_id'], self.channel)
+
+    def open_oauth_page(self):
+        """
+        Open the oauth authentication page in the default system web browser
+        """
+        print('Oauth approval for channel {}: {}'.format(self.channel, self.oauth_link))
+        webbrowser.open(self.oauth_link)
+
+    def wait_for_oauth_approval(self, timeout=None):
+        """
+        Wait until the oauth code has been received by the flask webserver and stored in oauth_code.
+        Returns True if it was received
+        """
+        return self.oauth_approved.wait(timeout)
+
+    def warm_up(self):
+        """
+        Fetch the oauth access token, the inventory snapshot and the active character, and build the
+        name index, so that the first command is as fast as every later one. If an inventory
+        snapshot was saved by a previous run, it is loaded instead, and fetched again in the
+        background. This makes blocking API calls, so it should be run with run
+        """
+        try:
+            loaded = self.profile.load_snapshot(self.snapshot_file)
+        except Exception:
+            traceback.print_exc()
+            loaded = False
+
+        if loaded:
+            Thread(target=self._revalidate_snapshot, daemon=True).start()
+        else:
+            self.profile.get_all_weapons()
+        self.profile.active_character
+
+    def _revalidate_snapshot(self):
+        """
+        Replace a loaded inventory snapshot with a freshly fetched one. If this fails, the error is
+        printed, and the snapshot will be fetched again when it expires
+        """
+        try:
+            self.profile.revalidate_snapshot()
+        except Exception:
+            traceback.print_exc()
+
+    def describe_snapshot(self):
+        """
+        Returns a summary of the channel's inventory snapshot, without making any API calls, or None
+        if there is none yet
+        """
+        if self._profile is None:
+            return None
+        return self._profile.describe_snapshot()
+
+    def dump_flight_recorder(self, reason, **context):
+        """
+        Dump the flight recorder, along with the state of the inventory snapshot and any other
+        context given as keyword arguments
+        """
+        self.flight_recorder.dump(reason, channel=self.channel, snapshot=self.describe_snapshot(),
+                                  **context)
+
+    async def run(self, function, *args):
+        """
+        Run a blocking function, like an API call, on this channel's worker thread without blocking
+        the bot's event loop, and return its result
+        """
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
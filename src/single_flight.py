@@ -0,0 +1,91 @@
+"""
+Deduplication of concurrent identical work. When several callers ask for the same thing at the same
+time, e.g. two threads both finding the manifest not loaded yet, only the first actually does the
+work, and the others wait for its result instead of repeating it. Once the work finishes, the next
+caller starts afresh, so nothing is cached beyond the calls that overlapped
+"""
+
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+    """
+    Runs at most one call at a time for each key. Callers that arrive while a call for the same key
+    is in flight get its result, or its exception, rather than making the call again. In-flight
+    calls are shared between threads and coroutines, so a coroutine can wait for a call started on
+    a worker thread, and vice versa
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._flights = {}  # Future of the call in flight for each key
+
+        # Counters for monitoring
+        self.calls = 0  # Calls that actually ran
+        self.shared = 0  # Callers that got the result of another caller's call
+
+    def _join(self, key):
+        """
+        Returns the future for the call in flight for key, and whether the caller has to make the
+        call. If there is no call in flight, a new future is registered, and the caller has to make
+        the call
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.calls += 1
+            return future, True
+
+    def _land(self, key, future, result=None, error=None):
+        """
+        Finish the call in flight for key. It is removed before the waiting callers are woken, so
+        that anyone arriving afterwards makes a new call
+        """
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, function, *args):
+        """
+        Call function with args, unless a call for key is already in flight, in which case wait for
+        it and return its result. Blocks the calling thread, so it should not be used from a
+        coroutine (see do_async)
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
+
+    async def do_async(self, key, function, *args, executor=None):
+        """
+        Like do, for coroutines. function is a blocking function, which is run in executor (or the
+        event loop's default executor), so the event loop is never blocked, whether this caller
+        makes the call or waits for one in flight
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(executor, function, *args)
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result)
+        return result
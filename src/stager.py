@@ -0,0 +1,230 @@
+"""
+Optional background pre-staging of weapons. An equip of a weapon the active character already holds
+takes a single EquipItem call, while one from the vault or another character first needs up to
+three transfers. While a channel is idle, the stager moves the weapons most likely to be requested
+next onto the active character, so that most equips need no transfers at all.
+
+Each slot is kept one short of SLOT_CAPACITY, so a transfer into the character never has to make
+room first
+"""
+
+import asyncio
+from collections import Counter
+from functools import partial
+import time
+import traceback
+
+import requests.exceptions
+
+from src.character import SLOT_CAPACITY
+from src.enums import WeaponType
+from src.exceptions import Error
+
+
+# Demand for a name decays by this factor on every staging pass, so old requests stop counting
+DEMAND_DECAY = 0.9
+
+
+class Stager:
+    """
+    Background pre-stager for one channel. Candidates for each slot are ranked by demand (names
+    that were recently searched for or requested), then by popularity (names that were recently
+    equipped). Weapons the character already holds fill the remaining space, so that staging does
+    not churn, and any space left after that is filled with weighted random picks from the vault
+    """
+
+    def __init__(self, session, interval=60, idle_seconds=30, max_transfers=4, budget=None):
+        self.session = session
+        self.interval = interval  # Seconds between staging passes
+        self.idle_seconds = idle_seconds  # Seconds without commands before a pass may run
+        self.max_transfers = max_transfers  # Maximum number of transfers per pass
+        self.budget = budget  # CommandBudget that transfers are charged to, if any
+
+        self.demand = Counter()  # Demand for each weapon name
+
+        # Counters for monitoring
+        self.passes = 0
+        self.transfers = 0
+
+    @classmethod
+    def from_config(cls, session, budget=None):
+        """
+        Create a Stager from the "prestage" section of the channel's config, or return None if
+        pre-staging is not enabled
+        """
+        stager_config = session.config.get('prestage', {})
+        if not stager_config.get('enabled', False):
+            return None
+        return cls(session,
+                   interval=stager_config.get('interval', 60),
+                   idle_seconds=stager_config.get('idle_seconds', 30),
+                   max_transfers=stager_config.get('max_transfers', 4),
+                   budget=budget)
+
+    def record_demand(self, weapons):
+        """
+        Record that viewers asked for the given weapons, e.g. the matches of a name search
+        """
+        for name in set(x.name for x in weapons):
+            self.demand[name] += 1
+
+    def _scores(self):
+        """
+        Returns the score of each weapon name. Demand counts for more than popularity
+        """
+        scores = Counter()
+        for name, count in self.demand.items():
+            scores[name] += 2 * count
+        for name in self.session.profile.recently_equipped:
+            scores[name] += 1
+        return scores
+
+    def choose_targets(self, weapon_type, held):
+        """
+        Choose the weapons the active character should hold in a slot, given the weapons it holds in
+        that slot now
+        """
+        profile = self.session.profile
+        capacity = SLOT_CAPACITY - 1
+        candidates = [x for x in profile.get_all_weapons() if x.type == weapon_type]
+
+        # Prefer the copy of a weapon the character already holds, then one in the vault
+        held_ids = set(x.item_id for x in held)
+        candidates.sort(key=lambda x: (x.item_id not in held_ids,
+                                       profile.get_snapshot_owner(x) is not None))
+        best_by_name = {}
+        for weapon in candidates:
+            best_by_name.setdefault(weapon.name, weapon)
+
+        targets = []
+        for name, _ in self._scores().most_common():
+            if len(targets) >= capacity:
+                break
+            if name in best_by_name:
+                targets.append(best_by_name[name])
+
+        for weapon in held:
+            if len(targets) >= capacity:
+                break
+            if weapon not in targets:
+                targets.append(weapon)
+
+        # Random picks are limited to the vault, so other characters' weapons are left alone
+        sampler = profile.get_sampler()
+        for _ in range(capacity * 3):
+            if len(targets) >= capacity:
+                break
+            weapon = sampler.sample(weapon_type)
+            if weapon is not None and weapon not in targets and \
+                    profile.get_snapshot_owner(weapon) is None:
+                targets.append(weapon)
+
+        return targets
+
+    def plan_moves(self):
+        """
+        Returns a list of (description, function) tuples for the transfers to make on this pass,
+        at most max_transfers of them. Transfers that only make sense together, like making room
+        for a weapon and then bringing it in, are either all included or all left for a later pass
+        """
+        profile = self.session.profile
+        character = profile.active_character
+        unequipped = profile.get_snapshot_unequipped_weapons(character)
+
+        groups = []
+        for weapon_type in WeaponType.values():
+            held = [x for x in unequipped if x.type == weapon_type]
+            targets = self.choose_targets(weapon_type, held)
+            outgoing = [x for x in reversed(held) if x not in targets]
+            incoming = [x for x in targets if x not in held]
+            count = len(held)
+
+            # Always leave one free space in the slot
+            while count >= SLOT_CAPACITY and outgoing:
+                weapon = outgoing.pop(0)
+                groups.append([('Move {} to the vault'.format(weapon.name),
+                                partial(character.transfer_to_vault, weapon))])
+                count -= 1
+
+            for weapon in incoming:
+                group = []
+                if count >= SLOT_CAPACITY - 1:
+                    if not outgoing:
+                        break
+                    old_weapon = outgoing.pop(0)
+                    group.append(('Move {} to the vault'.format(old_weapon.name),
+                                  partial(character.transfer_to_vault, old_weapon)))
+                    count -= 1
+                owner = profile.get_snapshot_owner(weapon)
+                if owner is not None:
+                    group.append(('Move {} to the vault'.format(weapon.name),
+                                  partial(owner.transfer_to_vault, weapon)))
+                group.append(('Move {} to the character'.format(weapon.name),
+                              partial(character.transfer_to_character, weapon)))
+                groups.append(group)
+                count += 1
+
+        moves = []
+        for group in groups:
+            if len(moves) + len(group) > self.max_transfers:
+                break
+            moves += group
+        return moves
+
+    def stage_once(self):
+        """
+        Run one staging pass. This makes blocking API calls, so it should be run with session.run.
+        Returns the number of transfers made
+        """
+        profile = self.session.profile
+        self.passes += 1
+        for name in list(self.demand):
+            self.demand[name] *= DEMAND_DECAY
+            if self.demand[name] < 0.1:
+                del self.demand[name]
+
+        moves = self.plan_moves()
+        if not moves:
+            return 0
+        if self.budget is not None and not self.budget.bucket.try_consume(len(moves)):
+            return 0  # Leave the API budget for viewers' commands
+
+        done = 0
+        try:
+            for _, move in moves:
+                move()
+                done += 1
+        except (Error, requests.exceptions.HTTPError):
+            # The snapshot was probably stale. Try again on the next pass
+            traceback.print_exc()
+            self.session.dump_flight_recorder('Pre-staging failed',
+                                              traceback=traceback.format_exc())
+            profile.invalidate_inventory()
+        else:
+            # Fetch the snapshot again while the channel is idle, rather than in the next command
+            profile.revalidate_snapshot()
+        finally:
+            self.transfers += done
+        return done
+
+    def is_idle(self):
+        """
+        True if no command is running in the channel, and none has been run for idle_seconds
+        """
+        return not self.session.command_lock.locked() and \
+            time.time() - self.session.last_command_time >= self.idle_seconds
+
+    async def run(self):
+        """
+        Run staging passes every interval seconds, whenever the channel is idle. Commands wait for
+        a pass that is already running, so each pass is kept short with max_transfers
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.is_idle():
+                continue
+            try:
+                async with self.session.command_lock:
+                    await self.session.run(self.stage_once)
+            except Exception:
+                traceback.print_exc()
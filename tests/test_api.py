@@ -0,0 +1,88 @@
+import pytest
+import requests
+
+from src.api import API, is_outage
+from src.circuit_breaker import CircuitBreaker
+from src.exceptions import BungieUnavailableError
+
+
+def make_response(status_code, body=b''):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    return response
+
+
+def error_body(error_code):
+    return '{{"Response": {{}}, "ErrorCode": {}, "ErrorStatus": "Error"}}'.format(
+        error_code).encode()
+
+
+class FakeHTTPSession:
+    """
+    Stands in for requests.Session, answering every request with the given responses in turn
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+@pytest.mark.parametrize('status_code, body, expected', [
+    (200, error_body(1), False),
+    (500, error_body(1623), False),  # DestinyItemNotFound is sent with a 500
+    (503, error_body(5), True),  # SystemDisabled
+    (400, error_body(5), True),
+    (400, error_body(7), False),
+    (502, b'<html>Bad Gateway</html>', True),
+    (500, b'{}', True),
+    (500, b'', True),
+    (404, b'<html>Not Found</html>', False),
+])
+def test_is_outage(status_code, body, expected):
+    assert is_outage(make_response(status_code, body)) == expected
+
+
+def make_api(responses, failure_threshold=2):
+    circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout=60)
+    api = API('key', 1, 'secret', 'code', 254, manifest=object(),
+              http_session=FakeHTTPSession(responses), circuit_breaker=circuit_breaker)
+    return api, circuit_breaker
+
+
+def test_request_errors_do_not_open_breaker():
+    api, circuit_breaker = make_api([make_response(500, error_body(1623))] * 3)
+
+    for _ in range(3):
+        with pytest.raises(requests.exceptions.HTTPError):
+            api._send('GET', 'https://www.bungie.net/Platform/Destiny2/')
+
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    assert circuit_breaker.consecutive_failures == 0
+
+
+def test_outages_open_breaker():
+    api, circuit_breaker = make_api([make_response(503, error_body(5))] * 2)
+
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.HTTPError):
+            api._send('GET', 'https://www.bungie.net/Platform/Destiny2/')
+
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BungieUnavailableError):
+        api._send('GET', 'https://www.bungie.net/Platform/Destiny2/')
+    assert len(api.http_session.requests) == 2
+
+
+def test_send_has_default_timeout():
+    api, _ = make_api([make_response(200, error_body(1))] * 2)
+
+    api._send('GET', 'https://www.bungie.net/Platform/Destiny2/')
+    api._send('GET', 'https://www.bungie.net/Platform/Destiny2/', timeout=1)
+
+    assert api.http_session.requests[0][2]['timeout'] is not None
+    assert api.http_session.requests[1][2]['timeout'] == 1
@@ -0,0 +1,108 @@
+import pytest
+
+from src.budget import CommandBudget, TokenBucket
+
+
+class FakeClock:
+    """
+    Clock which only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_bucket_exhaustion_and_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2.0, clock=clock)
+
+    assert bucket.try_consume(6)
+    assert bucket.try_consume(4)
+    assert not bucket.try_consume(1)
+    assert bucket.seconds_until(3) == pytest.approx(1.5)
+
+    clock.advance(1.5)
+    assert bucket.tokens == pytest.approx(3)
+    assert not bucket.try_consume(4)
+    assert bucket.try_consume(3)
+
+
+def test_bucket_never_refills_past_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2.0, clock=clock)
+    bucket.try_consume(4)
+
+    clock.advance(3600)
+    assert bucket.tokens == 10
+    bucket.refund(5)
+    assert bucket.tokens == 10
+    assert not bucket.try_consume(11)
+
+
+def test_user_cooldown_expires():
+    clock = FakeClock()
+    budget = CommandBudget(user_cooldown=10, capacity=100, clock=clock)
+
+    assert budget.try_acquire('channel', 'viewer', 'search') == (True, 0)
+    assert budget.try_acquire('channel', 'moderator', 'search', exempt_from_cooldown=True)[0]
+    clock.advance(4)
+    allowed, retry_after = budget.try_acquire('channel', 'viewer', 'search')
+    assert not allowed
+    assert retry_after == pytest.approx(6)
+
+    # Other viewers, the same viewer in another channel, and moderators are not held up
+    assert budget.try_acquire('channel', 'other', 'search')[0]
+    assert budget.try_acquire('other channel', 'viewer', 'search')[0]
+    assert budget.try_acquire('channel', 'moderator', 'search', exempt_from_cooldown=True)[0]
+
+    clock.advance(6)
+    assert budget.try_acquire('channel', 'viewer', 'search')[0]
+    assert budget.rejected_cooldown == 1
+
+
+def test_global_budget_exhaustion():
+    clock = FakeClock()
+    budget = CommandBudget(user_cooldown=0, capacity=20, refill_rate=1.0,
+                           costs={'equip': 8}, clock=clock)
+
+    assert budget.try_acquire('channel', 'a', 'equip')[0]
+    assert budget.try_acquire('channel', 'b', 'equip')[0]
+    allowed, retry_after = budget.try_acquire('channel', 'c', 'equip')
+    assert not allowed
+    assert retry_after == pytest.approx(4)
+    # A rejected command is not charged
+    assert budget.bucket.tokens == pytest.approx(4)
+
+    clock.advance(4)
+    assert budget.try_acquire('channel', 'c', 'equip')[0]
+    assert (budget.accepted, budget.rejected_global) == (3, 1)
+
+
+def test_refund():
+    clock = FakeClock()
+    budget = CommandBudget(capacity=20, costs={'search': 4}, clock=clock)
+    budget.try_acquire('channel', 'viewer', 'search')
+
+    budget.refund(4)
+    budget.refund(0)
+
+    assert budget.bucket.tokens == 20
+    assert budget.refunded_tokens == 4
+
+
+def test_rejection_notices_once_per_cooldown():
+    clock = FakeClock()
+    budget = CommandBudget(user_cooldown=10, clock=clock)
+
+    assert budget.should_notify('channel', 'viewer')
+    clock.advance(9)
+    assert not budget.should_notify('channel', 'viewer')
+    assert budget.should_notify('channel', 'other')
+    clock.advance(1)
+    assert budget.should_notify('channel', 'viewer')
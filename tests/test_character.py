@@ -0,0 +1,167 @@
+import types
+
+import pytest
+import requests
+
+from src.character import Character
+from src.exceptions import BungieUnavailableError
+from src.plan import Plan
+
+
+def make_error(status_code, error_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = '{{"ErrorCode": {}}}'.format(error_code).encode()
+    return requests.exceptions.HTTPError(response=response)
+
+
+class FakeProfile:
+    """
+    Stands in for Profile, reporting that every weapon is at the given location
+    """
+
+    def __init__(self, location=None, error=None):
+        self.location = location
+        self.error = error
+        self.located = []
+        self.invalidated = False
+
+    def invalidate_inventory(self):
+        self.invalidated = True
+
+    def locate_weapon(self, weapon):
+        self.located.append(weapon)
+        if self.error is not None:
+            raise self.error
+        return self.location
+
+
+def make_character(character_id, profile):
+    return Character(None, {'characterId': character_id}, profile)
+
+
+def fail(error):
+    def function():
+        raise error
+    return function
+
+
+def make_failed_plan(error, item='weapon', destination=None):
+    """
+    Returns a plan whose single transfer step failed with error, and the failed step
+    """
+    plan = Plan()
+    step = plan.add('Transfer', fail(error), item=item, destination=destination)
+    with pytest.raises(requests.exceptions.HTTPError):
+        plan.run()
+    return plan, step
+
+
+def test_reconcile_corrects_step_to_move_from_actual_location():
+    error = make_error(500, 1623)
+    destination = make_character('1', None)
+    actual = make_character('2', None)
+    profile = FakeProfile(location=actual)
+    character = make_character('1', profile)
+    moves = []
+    character._move_weapon = lambda *args: moves.append(args)
+    plan, step = make_failed_plan(error, destination=destination)
+
+    assert character._reconcile(plan, error)
+    assert not step.done
+    assert profile.located == ['weapon']
+
+    # Resuming the plan runs the corrected step
+    plan.run()
+    assert moves == [('weapon', actual, destination)]
+    assert step.done
+
+
+def test_reconcile_marks_step_done_if_already_at_destination():
+    error = make_error(500, 1623)
+    destination = make_character('1', None)
+    character = make_character('1', FakeProfile(location=make_character('1', None)))
+    plan, step = make_failed_plan(error, destination=destination)
+
+    assert character._reconcile(plan, error)
+    assert step.done
+
+
+@pytest.mark.parametrize('error', [
+    make_error(500, 1642),  # DestinyNoRoomInDestination
+    make_error(503, 5),
+    make_error(502, 'null'),
+])
+def test_reconcile_ignores_other_errors(error):
+    profile = FakeProfile()
+    character = make_character('1', profile)
+    plan, _ = make_failed_plan(error)
+
+    assert not character._reconcile(plan, error)
+    assert profile.located == []
+
+
+def test_reconcile_fails_if_item_cannot_be_located():
+    error = make_error(500, 1623)
+    profile = FakeProfile(error=make_error(500, 1623))
+    character = make_character('1', profile)
+    plan, step = make_failed_plan(error)
+
+    assert not character._reconcile(plan, error)
+    assert not step.done
+
+
+@pytest.mark.parametrize('plan', [None, types.SimpleNamespace(failed_step=None)])
+def test_reconcile_without_failed_step(plan):
+    character = make_character('1', FakeProfile())
+
+    assert not character._reconcile(plan, make_error(500, 1623))
+
+
+def test_reconcile_ignores_steps_without_item():
+    error = make_error(500, 1623)
+    profile = FakeProfile()
+    character = make_character('1', profile)
+    plan, _ = make_failed_plan(error, item=None)
+
+    assert not character._reconcile(plan, error)
+    assert profile.located == []
+
+
+@pytest.mark.parametrize('activities, expected', [
+    ({}, False),  # Offline
+    ({'currentActivityHash': 0, 'currentActivityModeType': None}, False),
+    ({'currentActivityHash': 82913930, 'currentActivityModeType': None}, False),  # Orbit
+    ({'currentActivityHash': 82913930, 'currentActivityModeType': 0}, False),
+    ({'currentActivityHash': 3737830648, 'currentActivityModeType': 40}, False),  # Social
+    ({'currentActivityHash': 2122313384, 'currentActivityModeType': 4}, True),  # Raid
+    ({'currentActivityHash': 1070049743, 'currentActivityModeType': 87}, True),  # Lost Sector
+])
+def test_in_activity(activities, expected):
+    character = Character(None, {'characterId': '1'}, None, activities)
+
+    assert character.in_activity == expected
+
+
+@pytest.mark.parametrize('error', [
+    requests.exceptions.Timeout(),
+    requests.exceptions.ConnectionError(),
+    BungieUnavailableError('The Bungie API appears to be down'),
+])
+def test_run_equip_invalidates_snapshot_when_bungie_cannot_be_reached(error):
+    profile = FakeProfile()
+    character = make_character('1', profile)
+    moves = []
+
+    def plan_transfers(weapons):
+        plan = Plan()
+        first = plan.add('Transfer', lambda: moves.append('first'), item='first')
+        plan.add('Transfer', fail(error), [first], item='second')
+        return plan, plan.steps
+
+    character.plan_transfers = plan_transfers
+
+    with pytest.raises(BungieUnavailableError):
+        character._run_equip(['first', 'second'], None, retries=3)
+    assert moves == ['first']
+    assert profile.invalidated
@@ -0,0 +1,112 @@
+from threading import Event
+
+import pytest
+
+from src.circuit_breaker import CircuitBreaker
+from src.exceptions import BungieUnavailableError
+
+
+def open_breaker(circuit_breaker):
+    for _ in range(circuit_breaker.failure_threshold):
+        circuit_breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    circuit_breaker.before_call()
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BungieUnavailableError):
+        circuit_breaker.before_call()
+    status = circuit_breaker.get_status()
+    assert status['rejected_calls'] == 1
+    assert status['times_opened'] == 1
+    assert 0 < status['retry_in'] <= 60
+
+
+def test_success_resets_failure_count():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_call_after_reset_timeout_is_probe_without_probe_function():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    open_breaker(circuit_breaker)
+
+    # The first call is let through as the probe, and the rest are rejected until it finishes
+    circuit_breaker.before_call()
+    assert circuit_breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(BungieUnavailableError):
+        circuit_breaker.before_call()
+
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    circuit_breaker.before_call()
+
+
+def test_failed_probe_reopens():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0)
+    open_breaker(circuit_breaker)
+    circuit_breaker.before_call()
+
+    # A single failure is enough, rather than failure_threshold of them
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+
+
+def test_probe_function_closes_breaker():
+    probed = Event()
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+
+    def probe():
+        circuit_breaker.record_success()
+        probed.set()
+
+    circuit_breaker.probe = probe
+    open_breaker(circuit_breaker)
+
+    # With a probe function, calls are never let through while open
+    with pytest.raises(BungieUnavailableError):
+        circuit_breaker.before_call()
+    assert probed.wait(5)
+    assert circuit_breaker.state == CircuitBreaker.CLOSED
+    circuit_breaker.before_call()
+
+
+def test_probe_that_records_nothing_counts_as_failure():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    circuit_breaker.probe = lambda: None
+    open_breaker(circuit_breaker)
+    circuit_breaker._probe_timer.cancel()
+
+    circuit_breaker._run_probe()
+
+    assert circuit_breaker.state == CircuitBreaker.OPEN
+    circuit_breaker._probe_timer.cancel()
+
+
+def test_failures_while_open_schedule_one_probe():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    circuit_breaker.probe = lambda: None
+    open_breaker(circuit_breaker)
+    timer = circuit_breaker._probe_timer
+    opened_at = circuit_breaker.opened_at
+
+    # Calls that were already in flight when the breaker opened
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+
+    assert circuit_breaker._probe_timer is timer
+    assert circuit_breaker.opened_at == opened_at
+    assert circuit_breaker.times_opened == 1
+    timer.cancel()
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from src.fuzzy import BKTree, FuzzyNameIndex, edit_distance, max_distance, tokenize
+
+
+NAMES = ['The Jade Rabbit', 'MIDA Multi-Tool', 'Hawthorne\'s Field-Forged Shotgun', 'Ace of Spades',
+         'Cold Front', 'Coldheart', 'Gjallarhorn', 'Sunshot', 'Sunshot', 'Ikelos_SG_v1.0.2']
+
+
+def test_tokenize():
+    assert tokenize('Hawthorne\'s Field-Forged Shotgun') == ['hawthornes', 'field', 'forged',
+                                                              'shotgun']
+    assert tokenize('Ikelos_SG_v1.0.2') == ['ikelos', 'sg', 'v1', '0', '2']
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ('', '', 0),
+    ('rabbit', '', 6),
+    ('rabbit', 'rabbit', 0),
+    ('rabit', 'rabbit', 1),
+    ('rabbbit', 'rabbit', 1),
+    ('rabbot', 'rabbit', 1),
+    ('kitten', 'sitting', 3),
+])
+def test_edit_distance(a, b, expected):
+    assert edit_distance(a, b) == expected
+    assert edit_distance(b, a) == expected
+
+
+@pytest.mark.parametrize('word, expected', [
+    ('ace', 0),
+    ('jade', 1),
+    ('rabbits', 1),
+    ('gjallarh', 2),
+    ('gjallarhorn', 2),
+])
+def test_max_distance(word, expected):
+    assert max_distance(word) == expected
+
+
+def test_bk_tree_matches_linear_search():
+    rng = random.Random(0)
+    words = {''.join(rng.choice('abcde') for _ in range(rng.randint(1, 8))) for _ in range(300)}
+    tree = BKTree(words)
+    for query in ['abc', 'eeeee', 'abcdeab', 'a', 'dd']:
+        for max_dist in range(3):
+            expected = sorted((edit_distance(query, x), x) for x in words
+                              if edit_distance(query, x) <= max_dist)
+            assert sorted(tree.search(query, max_dist)) == expected
+
+
+def test_bk_tree_ignores_duplicates():
+    tree = BKTree(['rabbit', 'rabbit', 'rabbi'])
+
+    assert sorted(tree.search('rabbit', 1)) == [(0, 'rabbit'), (1, 'rabbi')]
+    assert BKTree().search('rabbit', 2) == []
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('jade rabbit', {'The Jade Rabbit'}),
+    ('rabbit jade', {'The Jade Rabbit'}),  # Word order does not matter
+    ('jade rabit', {'The Jade Rabbit'}),
+    ('jdae rabbit', set()),  # A transposition is two edits, and "jade" only allows one
+    ('multitool', {'MIDA Multi-Tool'}),  # Adjacent words joined together
+    ('hawthornes shotgun', {'Hawthorne\'s Field-Forged Shotgun'}),
+    ('gjalarhorm', {'Gjallarhorn'}),  # Two edits in a long word
+    ('gjalarhrm', set()),  # Three edits is too many
+    ('acee', {'Ace of Spades'}),
+    ('ade', set()),  # Short words must match exactly
+    ('jade shotgun', set()),  # Every word must match the same name
+    ('', set()),
+    ('sunshot', {'Sunshot'}),
+])
+def test_fuzzy_search(query, expected):
+    assert FuzzyNameIndex(NAMES).search(query) == expected
+
+
+def test_fuzzy_search_prefers_lowest_total_distance():
+    index = FuzzyNameIndex(['Cold Front', 'Coldheart', 'Cold Heart'])
+
+    # "cold" matches a word of "Cold Front" and "Cold Heart" exactly, but not "Coldheart"
+    assert index.search('cold') == {'Cold Front', 'Cold Heart'}
+    assert index.search('coldheart') == {'Coldheart', 'Cold Heart'}
+    assert index.search('cold hart') == {'Cold Heart'}
+
+
+def test_fuzzy_search_ties_return_every_best_match():
+    index = FuzzyNameIndex(['Fatebringer', 'Fatebringar', 'Fatebringers'])
+
+    assert index.search('fatebringe') == {'Fatebringer'}
+    assert index.search('fatebringir') == {'Fatebringer', 'Fatebringar'}
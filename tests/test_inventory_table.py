@@ -0,0 +1,102 @@
+from itertools import product
+import operator
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from src import inventory_table
+from src.enums import DamageType, TierType, WeaponSubType, WeaponType
+from src.inventory_table import InventoryTable
+
+
+WEAPON_TYPES = [WeaponType.KINETIC, WeaponType.ENERGY, WeaponType.POWER]
+SUB_TYPES = [WeaponSubType.AUTO_RIFLE, WeaponSubType.HAND_CANNON, WeaponSubType.SNIPER_RIFLE]
+DAMAGE_TYPES = [DamageType.KINETIC, DamageType.ARC, DamageType.THERMAL, DamageType.VOID]
+TIERS = [TierType.RARE, TierType.SUPERIOR, TierType.EXOTIC]
+
+
+@pytest.fixture(params=['array', 'numpy'])
+def backend(request, monkeypatch):
+    """
+    Run the test with the columns stored as numpy arrays, and again as array.array objects
+    """
+    if request.param == 'numpy':
+        monkeypatch.setattr(inventory_table, 'numpy', pytest.importorskip('numpy'))
+    else:
+        monkeypatch.setattr(inventory_table, 'numpy', None)
+    return request.param
+
+
+def make_weapons(count=400, seed=0):
+    rng = random.Random(seed)
+    weapons = []
+    for i in range(count):
+        tier = rng.choice(TIERS)
+        weapons.append(SimpleNamespace(item_id=str(6917529000000000000 + i),
+                                       item_hash=rng.randrange(2 ** 32),
+                                       type=rng.choice(WEAPON_TYPES),
+                                       sub_type=rng.choice(SUB_TYPES),
+                                       damage_type=rng.choice(DAMAGE_TYPES),
+                                       tier=tier,
+                                       is_exotic=tier == TierType.EXOTIC,
+                                       power=rng.randrange(1750, 1811)))
+    return weapons
+
+
+def list_select(weapons, weapon_type=None, weapon_sub_type=None, damage_type=None,
+                min_power=None, allow_exotics=True):
+    """
+    Filtering as it was done before InventoryTable, one list comprehension per criterion
+    """
+    if weapon_type is not None:
+        weapons = [x for x in weapons if x.type == weapon_type]
+    if weapon_sub_type is not None:
+        weapons = [x for x in weapons if x.sub_type == weapon_sub_type]
+    if damage_type is not None:
+        weapons = [x for x in weapons if x.damage_type == damage_type]
+    if min_power is not None:
+        weapons = [x for x in weapons if x.power >= min_power]
+    if not allow_exotics:
+        weapons = [x for x in weapons if not x.is_exotic]
+    return weapons
+
+
+def test_select_matches_list_filters(backend):
+    weapons = make_weapons()
+    table = InventoryTable(weapons)
+
+    for criteria in product([None] + WEAPON_TYPES, [None] + SUB_TYPES[:2],
+                            [None, DamageType.ARC, DamageType.VOID], [None, 1750, 1800, 1811],
+                            [True, False]):
+        assert table.select(*criteria) == list_select(weapons, *criteria), criteria
+
+
+def test_columns_hold_full_range_of_values(backend):
+    weapons = make_weapons(count=3)
+    weapons[0].item_hash = 2 ** 32 - 1
+    weapons[1].power = 2000
+    table = InventoryTable(weapons)
+
+    assert list(table.columns['item_id']) == [int(x.item_id) for x in weapons]
+    assert int(table.columns['item_hash'][0]) == 2 ** 32 - 1
+    assert table.select(min_power=2000) == [weapons[1]]
+    assert table.select(min_power=2001) == []
+
+
+def test_locations(backend):
+    weapons = make_weapons(count=4)
+    first, second = SimpleNamespace(character_id='1'), SimpleNamespace(character_id='2')
+    owners = {weapons[0].item_id: second, weapons[1].item_id: None, weapons[2].item_id: first}
+    table = InventoryTable(weapons, owners)
+
+    assert table.locations == [None, '2', '1']
+    assert list(table.columns['location']) == [1, 0, 2, 0]
+    assert list(table.mask([('location', operator.eq, 0)])) == [False, True, False, True]
+
+
+def test_empty_table(backend):
+    table = InventoryTable([])
+
+    assert len(table) == 0
+    assert table.select(WeaponType.KINETIC, min_power=1800, allow_exotics=False) == []
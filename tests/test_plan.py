@@ -0,0 +1,85 @@
+from threading import Event
+
+import pytest
+
+from src.plan import Plan
+
+
+class StepFailed(Exception):
+    pass
+
+
+def fail():
+    raise StepFailed()
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_steps_run_after_their_dependencies(max_workers):
+    order = []
+    plan = Plan()
+    first = plan.add('first', lambda: order.append('first'))
+    second = plan.add('second', lambda: order.append('second'), [first])
+    plan.add('third', lambda: order.append('third'), [first, second, None])
+
+    plan.run(max_workers)
+
+    assert order == ['first', 'second', 'third']
+    assert all(x.done for x in plan.steps)
+
+
+def test_independent_steps_run_concurrently():
+    # Each step waits for the other to start, so this only finishes if both run at once
+    first_started, second_started = Event(), Event()
+    plan = Plan()
+    plan.add('first', lambda: first_started.set() or second_started.wait(5))
+    plan.add('second', lambda: second_started.set() or first_started.wait(5))
+
+    plan.run()
+
+    assert first_started.is_set() and second_started.is_set()
+    assert all(x.done for x in plan.steps)
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_failure_stops_dependent_steps(max_workers):
+    calls = []
+    plan = Plan()
+    failing = plan.add('failing', fail)
+    dependent = plan.add('dependent', lambda: calls.append('dependent'), [failing])
+
+    with pytest.raises(StepFailed):
+        plan.run(max_workers)
+
+    assert plan.failed_step is failing
+    assert calls == []
+    assert not failing.done and not dependent.done
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_run_resumes_from_failed_step(max_workers):
+    calls = []
+    plan = Plan()
+    first = plan.add('first', lambda: calls.append('first'))
+    failing = plan.add('failing', fail, [first])
+    plan.add('last', lambda: calls.append('last'), [failing])
+
+    with pytest.raises(StepFailed):
+        plan.run(max_workers)
+    assert calls == ['first']
+
+    failing.function = lambda: calls.append('fixed')
+    plan.run(max_workers)
+
+    assert calls == ['first', 'fixed', 'last']
+    assert plan.failed_step is None
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_unsatisfiable_dependencies(max_workers):
+    plan = Plan()
+    first = plan.add('first', lambda: None)
+    second = plan.add('second', lambda: None, [first])
+    first.depends_on.append(second)
+
+    with pytest.raises(ValueError):
+        plan.run(max_workers)
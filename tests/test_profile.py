@@ -0,0 +1,37 @@
+from threading import Thread
+
+from src.profile import Profile
+
+
+def test_get_all_weapons_refreshes_again_after_concurrent_invalidation():
+    profile = Profile(None)
+    refreshes = []
+
+    def refresh_inventory():
+        # Another thread invalidates the snapshot straight after the first refresh
+        refreshes.append(1)
+        profile._inventory = ['weapon']
+        if len(refreshes) == 1:
+            thread = Thread(target=profile.invalidate_inventory)
+            thread.start()
+            thread.join()
+
+    profile._refresh_inventory = refresh_inventory
+
+    assert profile.get_all_weapons() == ['weapon']
+    assert len(refreshes) == 2
+
+
+def test_invalidate_inventory_waits_for_refresh_in_progress():
+    profile = Profile(None)
+    profile._inventory = ['weapon']
+
+    with profile._refresh_lock:
+        thread = Thread(target=profile.invalidate_inventory)
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        assert profile._inventory == ['weapon']
+    thread.join(5)
+
+    assert profile._inventory is None
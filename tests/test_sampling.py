@@ -0,0 +1,109 @@
+from collections import Counter
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from src.sampling import PER_NAME, PER_RARITY, AliasTable, WeaponSampler
+
+
+def make_weapon(name, weapon_type=1, sub_type=6, tier=5, is_exotic=False):
+    return SimpleNamespace(name=name, type=weapon_type, sub_type=sub_type, tier=tier,
+                           is_exotic=is_exotic)
+
+
+def frequencies(sample, count=100000, seed=0):
+    rng = random.Random(seed)
+    counts = Counter(sample(rng) for _ in range(count))
+    return {k: v / count for k, v in counts.items()}
+
+
+@pytest.mark.parametrize('items, weights', [
+    ([], []),
+    (['a', 'b'], [0, 0]),
+])
+def test_alias_table_needs_a_positive_weight(items, weights):
+    with pytest.raises(ValueError):
+        AliasTable(items, weights)
+
+
+def test_alias_table_never_samples_zero_weights():
+    table = AliasTable(['a', 'b', 'c', 'd'], [0, 3, 0, 1])
+
+    assert set(frequencies(table.sample, 20000)) == {'b', 'd'}
+
+
+def test_alias_table_uniform_weights():
+    table = AliasTable(['a', 'b', 'c'], [2, 2, 2])
+
+    # Every column holds a single item, so no alias is ever used
+    assert table._probability == [1.0, 1.0, 1.0]
+    for item, frequency in frequencies(table.sample).items():
+        assert frequency == pytest.approx(1 / 3, abs=0.01)
+
+
+def test_alias_table_distribution():
+    weights = [1, 2, 3, 4, 0.5, 9.5]
+    table = AliasTable(list(range(len(weights))), weights)
+
+    observed = frequencies(table.sample)
+    for item, weight in enumerate(weights):
+        assert observed[item] == pytest.approx(weight / sum(weights), abs=0.01)
+
+
+def test_alias_table_single_item():
+    table = AliasTable(['a'], [0.1])
+
+    assert table.sample() == 'a'
+
+
+def test_sampler_buckets():
+    kinetic = make_weapon('Kinetic', weapon_type=1, sub_type=6)
+    exotic = make_weapon('Exotic', weapon_type=1, sub_type=7, tier=6, is_exotic=True)
+    energy = make_weapon('Energy', weapon_type=2, sub_type=6)
+    sampler = WeaponSampler([kinetic, exotic, energy])
+
+    def names(weapons):
+        return {x.name for x in weapons}
+
+    assert names(sampler.options()) == {'Kinetic', 'Exotic', 'Energy'}
+    assert names(sampler.options(allow_exotics=False)) == {'Kinetic', 'Energy'}
+    assert names(sampler.options(weapon_type=1)) == {'Kinetic', 'Exotic'}
+    assert names(sampler.options(weapon_sub_type=6)) == {'Kinetic', 'Energy'}
+    assert sampler.options(weapon_type=1, weapon_sub_type=7, allow_exotics=False) == ()
+    assert sampler.sample(weapon_type=1, weapon_sub_type=7, allow_exotics=False) is None
+    assert sampler.sample(weapon_type=2) is energy
+
+
+def test_sampler_per_name_weighting():
+    weapons = [make_weapon('Copy')] * 3 + [make_weapon('Single')]
+    sampler = WeaponSampler(weapons, mode=PER_NAME)
+
+    observed = frequencies(lambda rng: sampler.sample(rng=rng).name)
+    assert observed['Copy'] == pytest.approx(0.5, abs=0.01)
+
+
+def test_sampler_per_rarity_weighting():
+    weapons = [make_weapon('Legendary {}'.format(i), tier=5) for i in range(9)] + \
+        [make_weapon('Exotic', tier=6, is_exotic=True)]
+    sampler = WeaponSampler(weapons, mode=PER_RARITY)
+
+    observed = frequencies(lambda rng: sampler.sample(rng=rng).name)
+    assert observed['Exotic'] == pytest.approx(0.5, abs=0.01)
+
+
+def test_sampler_recent_penalty():
+    weapons = [make_weapon('Recent'), make_weapon('Other')]
+
+    sampler = WeaponSampler(weapons, recent_names=['Recent'], recent_penalty=0.25)
+    observed = frequencies(lambda rng: sampler.sample(rng=rng).name)
+    assert observed['Recent'] == pytest.approx(0.2, abs=0.01)
+
+    # A penalty that would leave nothing to choose is ignored
+    sampler = WeaponSampler(weapons[:1], recent_names=['Recent'], recent_penalty=0)
+    assert sampler.get_weights(weapons[:1]) == [1.0]
+
+
+def test_sampler_unknown_mode():
+    with pytest.raises(ValueError):
+        WeaponSampler([], mode='unknown')
@@ -0,0 +1,161 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import time
+
+import pytest
+
+from src.single_flight import SingleFlight
+
+
+def start_callers(count, target):
+    threads = [Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight()
+    started, release = Event(), Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    threads = start_callers(1, lambda: results.append(flights.do('key', work)))
+    assert started.wait(5)
+    threads += start_callers(3, lambda: results.append(flights.do('key', work)))
+    # Wait until the other callers have joined the call in flight
+    wait_until(lambda: flights.shared == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    assert (flights.calls, flights.shared) == (1, 3)
+
+
+def test_exception_is_shared():
+    flights = SingleFlight()
+    started, release = Event(), Event()
+    errors = []
+
+    def work():
+        started.set()
+        release.wait(5)
+        raise KeyError('missing')
+
+    def call():
+        try:
+            flights.do('key', work)
+        except KeyError as e:
+            errors.append(e)
+
+    threads = start_callers(1, call)
+    assert started.wait(5)
+    threads += start_callers(2, call)
+    wait_until(lambda: flights.shared == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert all(x is errors[0] for x in errors)
+
+
+def test_calls_after_finish_run_again():
+    flights = SingleFlight()
+    calls = []
+
+    assert flights.do('key', lambda: calls.append(1) or len(calls)) == 1
+    assert flights.do('key', lambda: calls.append(1) or len(calls)) == 2
+    with pytest.raises(ValueError):
+        flights.do('key', int, 'not a number')
+    assert flights.do('key', int, '3') == 3
+
+    assert flights.shared == 0
+
+
+def test_different_keys_do_not_share():
+    flights = SingleFlight()
+    started, release = Event(), Event()
+    results = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    threads = start_callers(1, lambda: results.append(flights.do('slow', slow)))
+    assert started.wait(5)
+    assert flights.do('fast', lambda: 'fast') == 'fast'
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['slow']
+    assert flights.shared == 0
+
+
+def test_do_async_shares_call_with_threads():
+    flights = SingleFlight()
+    started, release = Event(), Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    async def main(executor):
+        # A coroutine makes the call on a worker thread, and another coroutine and a thread wait
+        # for it, without blocking the event loop
+        leader = asyncio.ensure_future(flights.do_async('key', work, executor=executor))
+        await asyncio.get_event_loop().run_in_executor(None, started.wait, 5)
+        follower = asyncio.ensure_future(flights.do_async('key', work))
+        thread_results = []
+        thread = Thread(target=lambda: thread_results.append(flights.do('key', work)))
+        thread.start()
+        while flights.shared < 2:
+            await asyncio.sleep(0.001)
+        release.set()
+        results = await asyncio.gather(leader, follower)
+        thread.join(5)
+        return results + thread_results
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = asyncio.run(main(executor))
+
+    assert results == ['result'] * 3
+    assert len(calls) == 1
+
+
+def test_do_async_shares_exception():
+    flights = SingleFlight()
+
+    def work():
+        raise KeyError('missing')
+
+    async def main():
+        results = await asyncio.gather(flights.do_async('key', work),
+                                       flights.do_async('key', work), return_exceptions=True)
+        return results
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(x, KeyError) for x in results)
+    assert flights.calls + flights.shared == 2